@@ -1,19 +1,35 @@
 # bot.py
 import discord
 from discord.ext import commands
+import aiohttp
 import asyncio
 import subprocess
 import json
 from datetime import datetime
-import shlex
 import logging
-import shutil
 import os
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
 import threading
 import time
 import sqlite3
 import random
+import queue
+import atexit
+import functools
+import itertools
+import math
+import re
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from contextlib import contextmanager
+from collections import deque
+
+from cgroup_metrics import CgroupCollector, CgroupMetrics
+from lxd_client import LXDClient, LXDConflict, LXDError, LXDNotFound
+from port_forwards import PortAllocator, proxy_devices
+from reconciler import Reconciler
+from usage_history import HISTORY_TIERS, UsageHistory
 
 # Load environment variables
 DISCORD_TOKEN = ''
@@ -23,6 +39,22 @@ YOUR_SERVER_IP = ''
 MAIN_ADMIN_ID = '1372237657207345183'
 VPS_USER_ROLE_ID = ''
 DEFAULT_STORAGE_POOL = 'default'
+DB_PATH = 'vps.db'
+DB_READER_POOL_SIZE = 4
+DB_DEBUG_QUERY_PLANS = False
+PORT_FORWARD_RANGES = [(20000, 50000)]
+LXD_SOCKET_PATH = '/var/snap/lxd/common/lxd/unix.socket'
+LXD_REQUEST_TIMEOUT = 120
+# Image remotes understood in OS_OPTIONS values ("ubuntu:22.04", "images:debian/12").
+# A value may also be a local simplestreams directory, for mirrors and offline hosts.
+LXD_IMAGE_SERVERS = {
+    'ubuntu': 'https://cloud-images.ubuntu.com/releases',
+    'images': 'https://images.linuxcontainers.org',
+}
+# Host-side cgroup v2 hierarchy and the per-container directory LXD creates in it
+CGROUP_ROOT = '/sys/fs/cgroup'
+LXD_CGROUP_PATTERN = 'lxc.payload.{name}'
+PROC_ROOT = '/proc'
 THUMBNAIL = ""
 BANNER = ""
 
@@ -61,26 +93,195 @@ logging.basicConfig(
 )
 logger = logging.getLogger(f'{BOT_NAME.lower()}_vps_bot')
 
-# Check if lxc command is available
-if not shutil.which("lxc"):
-    logger.error("LXC command not found. Please ensure LXC is installed.")
-    raise SystemExit("LXC command not found. Please ensure LXC is installed.")
+# Check that the LXD API socket is available
+if not os.path.exists(LXD_SOCKET_PATH):
+    logger.error(f"LXD socket not found at {LXD_SOCKET_PATH}. Please ensure LXD is installed.")
+    raise SystemExit(f"LXD socket not found at {LXD_SOCKET_PATH}. Please ensure LXD is installed.")
 
 # Database setup
-def get_db():
-    conn = sqlite3.connect('vps.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+class DatabaseManager:
+    """Long-lived SQLite access for the whole process.
+
+    One writer connection (serialised by a lock) and a small pool of reader
+    connections stay open for the life of the bot, so helpers no longer pay
+    for connect/close on every call. Every connection runs in WAL mode, which
+    lets readers proceed while a write is in flight, and keeps a per-connection
+    prepared statement cache so repeated queries skip re-parsing.
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -16000",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA mmap_size = 134217728",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA foreign_keys = ON",
+    )
+
+    def __init__(self, path: str, readers: int = 4, statement_cache: int = 256, debug_plans: bool = False):
+        self.path = path
+        self.statement_cache = statement_cache
+        self.debug_plans = debug_plans
+        self._explained = set()
+        self._write_lock = threading.RLock()
+        self._writer = self._connect()
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(max(1, readers)):
+            reader = self._connect()
+            reader.execute("PRAGMA query_only = ON")
+            self._readers.put(reader)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=self.statement_cache
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of writes atomically on the writer connection."""
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            else:
+                self._writer.execute("COMMIT")
+
+    def explain(self, sql: str, params: tuple = ()) -> List[str]:
+        """Log and return the query plan for sql; full table scans are logged as warnings."""
+        with self.reader() as conn:
+            return self._explain(conn, sql, params)
+
+    def _explain(self, conn: sqlite3.Connection, sql: str, params: tuple) -> List[str]:
+        try:
+            plan = [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        except sqlite3.Error as e:
+            logger.debug(f"Could not explain query: {sql} - {e}")
+            return []
+        full_scans = [step for step in plan if step.startswith('SCAN ') and ' USING ' not in step]
+        if full_scans:
+            logger.warning(f"Query plan (full scan): {sql} -> {'; '.join(plan)}")
+        else:
+            logger.info(f"Query plan: {sql} -> {'; '.join(plan)}")
+        return plan
+
+    def _maybe_explain(self, conn: sqlite3.Connection, sql: str, params: tuple):
+        if self.debug_plans and sql not in self._explained and not sql.lstrip().upper().startswith('PRAGMA'):
+            self._explained.add(sql)
+            self._explain(conn, sql, params)
+
+    def fetchone(self, sql: str, params: tuple = ()) -> Optional[sqlite3.Row]:
+        with self.reader() as conn:
+            self._maybe_explain(conn, sql, params)
+            return conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self.reader() as conn:
+            self._maybe_explain(conn, sql, params)
+            return conn.execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._write_lock:
+            self._maybe_explain(self._writer, sql, params)
+            return self._writer.execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq_of_params)
+
+    def close(self):
+        with self._write_lock:
+            while not self._readers.empty():
+                self._readers.get_nowait().close()
+            self._writer.close()
+
+class AsyncDatabase:
+    """Awaitable data-access layer over DatabaseManager.
+
+    Queries never run on the event loop: writes go to a single dedicated DB
+    thread (which also keeps them ordered), reads go to an executor sized to
+    the reader pool. A slow fsync therefore only delays the coroutine that
+    asked for it, not the gateway heartbeat or other users' interactions.
+    """
+
+    def __init__(self, manager: DatabaseManager, readers: int = 4):
+        self.manager = manager
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix='db-reader')
+
+    async def _run(self, executor, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args))
+
+    async def fetchone(self, sql: str, params: tuple = ()) -> Optional[sqlite3.Row]:
+        return await self._run(self._readers, self.manager.fetchone, sql, params)
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        return await self._run(self._readers, self.manager.fetchall, sql, params)
+
+    async def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return await self._run(self._writer, self.manager.execute, sql, params)
+
+    async def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        return await self._run(self._writer, self.manager.executemany, sql, list(seq_of_params))
+
+    async def transaction(self, fn, *args):
+        """Run fn(conn, *args) inside one write transaction on the DB thread."""
+        def run():
+            with self.manager.transaction() as conn:
+                return fn(conn, *args)
+        return await self._run(self._writer, run)
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.manager.close()
+
+db = DatabaseManager(DB_PATH, readers=DB_READER_POOL_SIZE, debug_plans=DB_DEBUG_QUERY_PLANS)
+adb = AsyncDatabase(db, readers=DB_READER_POOL_SIZE)
+atexit.register(adb.close)
 
 def init_db():
-    conn = get_db()
-    cur = conn.cursor()
+    migrate_db()
+    with db.transaction() as conn:
+        cur = conn.cursor()
+        cur.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (str(MAIN_ADMIN_ID),))
+        
+        # Initialize settings
+        for key, (_, default, *_) in SETTINGS_SCHEMA.items():
+            cur.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', (key, str(default)))
     
+    if DB_DEBUG_QUERY_PLANS:
+        for sql, params in HOT_QUERIES:
+            db.explain(sql, params)
+
+# Schema migrations
+# Each migration runs in its own transaction and bumps PRAGMA user_version,
+# so vps.db can be evolved in place. Never edit a released migration; append
+# a new one instead.
+def _migration_baseline(cur):
     # Admins table
     cur.execute('''CREATE TABLE IF NOT EXISTS admins (
         user_id TEXT PRIMARY KEY
     )''')
-    cur.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (str(MAIN_ADMIN_ID),))
     
     # VPS table
     cur.execute('''CREATE TABLE IF NOT EXISTS vps (
@@ -130,232 +331,767 @@ def init_db():
         host_port INTEGER NOT NULL,
         created_at TEXT NOT NULL
     )''')
-    
-    # Initialize settings
-    settings_init = [
-        ('cpu_threshold', '90'),
-        ('ram_threshold', '90'),
-    ]
-    for key, value in settings_init:
-        cur.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', (key, value))
-    
-    conn.commit()
-    conn.close()
-
-def get_setting(key: str, default: Any = None):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT value FROM settings WHERE key = ?', (key,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else default
-
-def set_setting(key: str, value: str):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
-    conn.commit()
-    conn.close()
-
-def get_vps_data() -> Dict[str, List[Dict[str, Any]]]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM vps')
-    rows = cur.fetchall()
-    conn.close()
+
+def _migration_lookup_indexes(cur):
+    # vps.container_name, user_stats.user_id and port_allocations.user_id are
+    # already covered by their UNIQUE/PRIMARY KEY indexes.
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_vps_user_id ON vps (user_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_port_forwards_user_id ON port_forwards (user_id, created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_port_forwards_vps_container ON port_forwards (vps_container)')
+
+def _migration_unique_host_port(cur):
+    duplicates = cur.execute('''SELECT id, vps_container, host_port FROM port_forwards
+                                WHERE id NOT IN (SELECT MIN(id) FROM port_forwards GROUP BY host_port)''').fetchall()
+    # The proxy devices behind dropped rows still hold their host ports; the
+    # reconciler removes them from LXD on its first pass
+    cur.execute('''CREATE TABLE IF NOT EXISTS dropped_port_forwards (
+        vps_container TEXT NOT NULL,
+        host_port INTEGER NOT NULL,
+        PRIMARY KEY (vps_container, host_port)
+    )''')
+    for row in duplicates:
+        logger.warning(f"Dropping duplicate port forward {row['id']} (host port {row['host_port']} on {row['vps_container']}); "
+                       f"its proxy devices will be removed at the next startup")
+    cur.executemany('INSERT OR IGNORE INTO dropped_port_forwards (vps_container, host_port) VALUES (?, ?)',
+                    [(row['vps_container'], row['host_port']) for row in duplicates])
+    cur.executemany('DELETE FROM port_forwards WHERE id = ?', [(row['id'],) for row in duplicates])
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_port_forwards_host_port ON port_forwards (host_port)')
+
+def _migration_normalize_shares_and_suspensions(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS vps_shares (
+        vps_id INTEGER NOT NULL REFERENCES vps (id) ON DELETE CASCADE,
+        user_id TEXT NOT NULL,
+        granted_at TEXT NOT NULL,
+        PRIMARY KEY (vps_id, user_id)
+    )''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_vps_shares_user_id ON vps_shares (user_id)')
+    cur.execute('''CREATE TABLE IF NOT EXISTS vps_suspensions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vps_id INTEGER NOT NULL REFERENCES vps (id) ON DELETE CASCADE,
+        event TEXT NOT NULL,
+        reason TEXT,
+        created_at TEXT NOT NULL
+    )''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_vps_suspensions_vps_id ON vps_suspensions (vps_id, created_at)')
+    
+    # Move the old JSON columns into the new tables. The columns stay in
+    # place (dropping them needs a table rebuild) but are no longer used.
+    now = datetime.now().isoformat()
+    for row in cur.execute('SELECT id, shared_with, suspension_history FROM vps').fetchall():
+        for shared_id in json.loads(row['shared_with'] or '[]'):
+            cur.execute('INSERT OR IGNORE INTO vps_shares (vps_id, user_id, granted_at) VALUES (?, ?, ?)',
+                        (row['id'], str(shared_id), now))
+        for entry in json.loads(row['suspension_history'] or '[]'):
+            entry = entry if isinstance(entry, dict) else {'reason': str(entry)}
+            cur.execute('INSERT INTO vps_suspensions (vps_id, event, reason, created_at) VALUES (?, ?, ?, ?)',
+                        (row['id'], entry.get('event', 'suspended'), entry.get('reason'),
+                         entry.get('time') or entry.get('timestamp') or now))
+    cur.execute("UPDATE vps SET shared_with = '[]', suspension_history = '[]'")
+
+def _migration_usage_history(cur):
+    # One row per (tier, container, metric, bucket). Tier 0 holds raw samples
+    # (samples = 1, all four values equal); higher tiers hold rollups.
+    cur.execute('''CREATE TABLE IF NOT EXISTS usage_history (
+        tier INTEGER NOT NULL,
+        container_name TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        min_value REAL NOT NULL,
+        avg_value REAL NOT NULL,
+        max_value REAL NOT NULL,
+        p95_value REAL NOT NULL,
+        PRIMARY KEY (tier, container_name, metric, ts)
+    ) WITHOUT ROWID''')
+
+def _migration_usage_history_ts_index(cur):
+    # Retention deletes, rollup range scans and MAX(ts) filter on (tier, ts),
+    # which the primary key can only serve by scanning every container in a tier
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_usage_history_tier_ts ON usage_history (tier, ts)')
+
+MIGRATIONS = [
+    (1, "baseline tables", _migration_baseline),
+    (2, "lookup indexes on vps and port_forwards", _migration_lookup_indexes),
+    (3, "unique host_port on port_forwards", _migration_unique_host_port),
+    (4, "vps_shares and vps_suspensions tables", _migration_normalize_shares_and_suspensions),
+    (5, "usage_history table", _migration_usage_history),
+    (6, "usage_history (tier, ts) index", _migration_usage_history_ts_index),
+]
+
+def get_schema_version() -> int:
+    return db.fetchone('PRAGMA user_version')[0]
+
+def migrate_db():
+    current = get_schema_version()
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        with db.transaction() as conn:
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
+        logger.info(f"Applied schema migration {version}: {description}")
+        current = version
+
+# Queries behind .ports list, .vpsinfo and .userinfo; their plans are logged
+# at startup when DB_DEBUG_QUERY_PLANS is on.
+HOT_QUERIES = [
+    ('SELECT * FROM port_forwards WHERE user_id = ? ORDER BY created_at DESC', ('',)),
+    ('SELECT COUNT(*) FROM port_forwards WHERE user_id = ?', ('',)),
+    ('SELECT COUNT(*) FROM port_forwards WHERE vps_container = ?', ('',)),
+    ('SELECT id, host_port FROM port_forwards WHERE vps_container = ?', ('',)),
+    ('SELECT allocated_ports FROM port_allocations WHERE user_id = ?', ('',)),
+    ('SELECT * FROM user_stats WHERE user_id = ?', ('',)),
+    ('SELECT * FROM vps WHERE user_id = ?', ('',)),
+    ('SELECT vps_id FROM vps_shares WHERE user_id = ?', ('',)),
+    ('SELECT metric, samples, min_value, avg_value, max_value, p95_value FROM usage_history WHERE tier = ? AND container_name = ? AND metric IN (?, ?, ?, ?, ?, ?) AND ts >= ?', (0, '', 'cpu', 'memory', 'disk', 'net_rx', 'net_tx', 'pids', 0)),
+    ('SELECT MAX(ts) FROM usage_history WHERE tier = ?', (1,)),
+    ('DELETE FROM usage_history WHERE tier = ? AND ts < ?', (0, 0)),
+]
+
+# Settings
+def at_least(minimum):
+    def check(value):
+        if value < minimum:
+            raise ValueError(f"must be at least {minimum:g}")
+    return check
+
+def between(minimum, maximum):
+    def check(value):
+        if not minimum <= value <= maximum:
+            raise ValueError(f"must be between {minimum:g} and {maximum:g}")
+    return check
+
+def one_of(*choices):
+    def check(value):
+        if value not in choices:
+            raise ValueError(f"must be one of {', '.join(choices)}")
+    return check
+
+# Every tunable is declared here as key -> (type, default[, validator]); add
+# new ones to this table rather than as module globals. A validator raises
+# ValueError for values the key cannot take.
+SETTINGS_SCHEMA: Dict[str, tuple] = {
+    'cpu_threshold': (int, 90, at_least(0)),
+    'ram_threshold': (int, 90, at_least(0)),
+    # Seconds a fleet state snapshot is reused before LXD is asked again
+    'snapshot_ttl': (float, 5.0, at_least(0)),
+    # CPU sampler: seconds between samples and how many samples each container keeps
+    'cpu_sample_interval': (float, 10.0, at_least(1)),
+    'cpu_window_samples': (int, 30, at_least(2)),
+    # Rendered container stats: reuse for metrics_ttl seconds, and keep containers
+    # viewed in the last metrics_hot_seconds refreshed in the background
+    'metrics_ttl': (float, 15.0, at_least(1)),
+    'metrics_hot_seconds': (float, 300.0, at_least(0)),
+    # Stats rendering: containers collected at once across all users, and seconds
+    # a view waits before showing what it has
+    'stats_concurrency': (int, 8, at_least(1)),
+    'stats_deadline': (float, 5.0, at_least(0)),
+    # Auto-suspension: seconds between fleet scans, consecutive over-threshold
+    # scans before acting, and whether offenders are stopped or frozen
+    'monitor_enabled': (bool, True),
+    'monitor_interval': (float, 30.0, at_least(1)),
+    'monitor_strikes': (int, 3, at_least(1)),
+    'monitor_action': (str, 'stop', one_of('stop', 'freeze')),
+    # Drift check between vps.db and LXD when the bot starts: off, report or fix
+    'reconcile_on_startup': (str, 'report', one_of('off', 'report', 'fix')),
+    # Seconds to wait for a started VPS to have init running and an address
+    'guest_ready_timeout': (float, 60.0, at_least(0)),
+    # Seconds between background refreshes of the cached OS images
+    'image_refresh_interval': (float, 86400.0, at_least(60)),
+    # Warm pool: stopped spare containers kept per OS (0 turns the pool off),
+    # the most kept across all OSes, how many are built at once, and the free
+    # storage pool space (percent) below which none are built
+    'warm_pool_size': (int, 0, at_least(0)),
+    'warm_pool_max_spares': (int, 8, at_least(0)),
+    'warm_pool_concurrency': (int, 2, at_least(1)),
+    'warm_pool_min_free_disk': (float, 20.0, between(0, 100)),
+}
+
+class SettingsService:
+    """Typed, in-memory view of the settings table.
+
+    Values are loaded once at startup and read without I/O. set() writes
+    through to SQLite, updates the cache and then calls the key's subscribers
+    with (key, value); subscribers may be plain functions or coroutines.
+    """
+
+    def __init__(self, schema: Dict[str, tuple]):
+        self.schema = schema
+        self._values: Dict[str, Any] = {}
+        self._subscribers: Dict[str, List[Callable]] = {}
+
+    def _coerce(self, key: str, value: Any) -> Any:
+        """Convert value to the key's type and validate it; ValueError says why it was rejected."""
+        if key not in self.schema:
+            raise KeyError(f"Unknown setting: {key}")
+        value_type, _, *validator = self.schema[key]
+        if value_type is bool and isinstance(value, str):
+            word = value.strip().lower()
+            if word in ('1', 'true', 'yes', 'on'):
+                return True
+            if word in ('0', 'false', 'no', 'off'):
+                return False
+            raise ValueError(f"`{value}` is not a valid bool for `{key}`; use true/false, yes/no, on/off or 1/0")
+        try:
+            converted = value_type(value.strip() if isinstance(value, str) else value)
+        except (TypeError, ValueError):
+            raise ValueError(f"`{value}` is not a valid {value_type.__name__} for `{key}`")
+        if isinstance(converted, float) and not math.isfinite(converted):
+            raise ValueError(f"`{key}` must be a finite number")
+        if validator:
+            try:
+                validator[0](converted)
+            except ValueError as e:
+                raise ValueError(f"`{key}` {e}")
+        return converted
+
+    def load(self):
+        stored = {row['key']: row['value'] for row in db.fetchall('SELECT key, value FROM settings')}
+        for key, (_, default, *_) in self.schema.items():
+            try:
+                self._values[key] = self._coerce(key, stored.get(key, default))
+            except ValueError:
+                logger.warning(f"Invalid stored value for setting {key}: {stored.get(key)!r}, using default")
+                self._values[key] = default
+
+    def get(self, key: str) -> Any:
+        return self._values[key]
+
+    def __getitem__(self, key: str) -> Any:
+        return self._values[key]
+
+    def items(self):
+        return self._values.items()
+
+    def subscribe(self, key: str, callback: Callable):
+        self._subscribers.setdefault(key, []).append(callback)
+
+    async def set(self, key: str, value: Any) -> Any:
+        value = self._coerce(key, value)
+        await adb.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, str(value)))
+        changed = self._values.get(key) != value
+        self._values[key] = value
+        if changed:
+            for callback in self._subscribers.get(key, []):
+                try:
+                    result = callback(key, value)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Settings subscriber for {key} failed: {e}")
+        return value
+
+settings = SettingsService(SETTINGS_SCHEMA)
+
+# VPS records and change tracking
+VPS_COLUMNS = ('user_id', 'container_name', 'ram', 'cpu', 'storage', 'config', 'os_version', 'status',
+               'suspended', 'whitelisted', 'created_at')
+
+class VPSStatus(str, Enum):
+    RUNNING = 'running'
+    STOPPED = 'stopped'
+    FROZEN = 'frozen'
+    UNKNOWN = 'unknown'
+
+    def __str__(self):
+        return self.value
+
+    @classmethod
+    def parse(cls, value) -> "VPSStatus":
+        try:
+            return cls(value)
+        except ValueError:
+            return cls.UNKNOWN
+
+def parse_size(value, unit: str = 'GB') -> int:
+    """Parse a stored size such as "12GB" or "512MB" into whole units of `unit`.
+
+    Bare numbers are taken to already be in `unit`.
+    """
+    if isinstance(value, int):
+        return value
+    text = str(value).strip().upper()
+    factors = {'MB': 1, 'GB': 1024}
+    for suffix, factor in factors.items():
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor) // factors[unit]
+    return int(float(text))
+
+def format_size(mb: int) -> str:
+    return f"{mb // 1024}GB" if mb % 1024 == 0 else f"{mb}MB"
+
+# Records with unsaved changes, keyed by id() of the record
+_pending_vps: Dict[int, "VPSRecord"] = {}
+
+# Tracked attribute -> vps table columns it is stored in. The config column
+# is derived from the resource fields, so it is rewritten whenever they change.
+_VPS_ATTR_COLUMNS = {
+    'user_id': ('user_id',),
+    'container_name': ('container_name',),
+    'ram_mb': ('ram', 'config'),
+    'cpu': ('cpu', 'config'),
+    'storage_gb': ('storage', 'config'),
+    'os_version': ('os_version',),
+    'status': ('status',),
+    'suspended': ('suspended',),
+    'whitelisted': ('whitelisted',),
+    'created_at': ('created_at',),
+}
+
+class VPSRecord:
+    """A VPS row with typed fields that remembers which columns changed.
+
+    Resources are held as integers (RAM in MB, storage in GB) and parsed once
+    when the row is loaded; the "12GB" text format only exists in the table.
+    Assigning a tracked attribute marks its columns dirty and queues the
+    record for the next save_vps_data(). shared_with is an in-memory mirror of
+    the vps_shares table and is maintained by share_vps()/unshare_vps().
+    """
+
+    __slots__ = ('id', 'user_id', 'container_name', 'ram_mb', 'cpu', 'storage_gb', 'os_version', 'status',
+                 'suspended', 'whitelisted', 'created_at', 'shared_with', 'dirty')
+
+    def __init__(self, user_id: str, container_name: str, ram_mb: int, cpu: int, storage_gb: int,
+                 os_version: str = 'ubuntu:22.04', status: VPSStatus = VPSStatus.RUNNING,
+                 suspended: bool = False, whitelisted: bool = False, created_at: Optional[str] = None,
+                 shared_with: Optional[List[str]] = None, vps_id: Optional[int] = None):
+        set_ = object.__setattr__
+        set_(self, 'dirty', set())
+        set_(self, 'id', vps_id)
+        set_(self, 'user_id', str(user_id))
+        set_(self, 'container_name', container_name)
+        set_(self, 'ram_mb', int(ram_mb))
+        set_(self, 'cpu', int(cpu))
+        set_(self, 'storage_gb', int(storage_gb))
+        set_(self, 'os_version', os_version or 'ubuntu:22.04')
+        set_(self, 'status', VPSStatus.parse(status))
+        set_(self, 'suspended', bool(suspended))
+        set_(self, 'whitelisted', bool(whitelisted))
+        set_(self, 'created_at', created_at or datetime.now().isoformat())
+        set_(self, 'shared_with', shared_with if shared_with is not None else [])
+        if vps_id is None:
+            _pending_vps[id(self)] = self
+
+    @classmethod
+    def from_row(cls, row, shared_with: Optional[List[str]] = None) -> "VPSRecord":
+        return cls(row['user_id'], row['container_name'], parse_size(row['ram'], 'MB'), parse_size(row['cpu']),
+                   parse_size(row['storage'], 'GB'), row['os_version'], row['status'], row['suspended'],
+                   row['whitelisted'], row['created_at'], shared_with, row['id'])
+
+    def __setattr__(self, name, value):
+        columns = _VPS_ATTR_COLUMNS.get(name)
+        if columns is None:
+            object.__setattr__(self, name, value)
+            return
+        if name == 'status':
+            value = VPSStatus.parse(value)
+        elif name in ('suspended', 'whitelisted'):
+            value = bool(value)
+        elif name in ('ram_mb', 'cpu', 'storage_gb'):
+            value = int(value)
+        if getattr(self, name) == value:
+            return
+        recount = name in _AGGREGATE_FIELDS and fleet_stats.counts(self)
+        if recount:
+            fleet_stats.remove(self)
+        object.__setattr__(self, name, value)
+        if recount:
+            fleet_stats.add(self)
+        self.mark_dirty(*columns)
+
+    def __repr__(self):
+        return f"VPSRecord({self.container_name!r}, owner={self.user_id}, id={self.id})"
+
+    @property
+    def ram_gb(self) -> int:
+        return self.ram_mb // 1024
+
+    @property
+    def config(self) -> str:
+        return f"{format_size(self.ram_mb)} RAM / {self.cpu} CPU / {self.storage_gb}GB Disk"
+
+    @property
+    def is_running(self) -> bool:
+        return self.status is VPSStatus.RUNNING
+
+    def mark_dirty(self, *columns):
+        self.dirty.update(column for column in columns if column in VPS_COLUMNS)
+        if self.dirty or self.id is None:
+            _pending_vps[id(self)] = self
+
+    def column_value(self, column: str):
+        if column == 'ram':
+            return format_size(self.ram_mb)
+        if column == 'storage':
+            return f"{self.storage_gb}GB"
+        if column == 'cpu':
+            return str(self.cpu)
+        if column == 'status':
+            return self.status.value
+        if column in ('suspended', 'whitelisted'):
+            return 1 if getattr(self, column) else 0
+        return getattr(self, column)
+
+    def to_row(self, columns=VPS_COLUMNS) -> tuple:
+        return tuple(self.column_value(column) for column in columns)
+
+# Startup loaders run once, before the event loop exists, so they use the
+# synchronous manager directly.
+def get_vps_data() -> Dict[str, List[VPSRecord]]:
+    shares: Dict[int, List[str]] = {}
+    for row in db.fetchall('SELECT vps_id, user_id FROM vps_shares ORDER BY granted_at'):
+        shares.setdefault(row['vps_id'], []).append(row['user_id'])
+    
+    rows = db.fetchall(f"SELECT id, {', '.join(VPS_COLUMNS)} FROM vps")
     data = {}
     for row in rows:
         user_id = row['user_id']
         if user_id not in data:
             data[user_id] = []
-        vps = dict(row)
-        vps['shared_with'] = json.loads(vps['shared_with'])
-        vps['suspension_history'] = json.loads(vps['suspension_history'])
-        vps['suspended'] = bool(vps['suspended'])
-        vps['whitelisted'] = bool(vps['whitelisted'])
-        vps['os_version'] = vps.get('os_version', 'ubuntu:22.04')
-        data[user_id].append(vps)
+        data[user_id].append(VPSRecord.from_row(row, shares.get(row['id'], [])))
     return data
 
 def get_admins() -> List[str]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT user_id FROM admins')
-    rows = cur.fetchall()
-    conn.close()
+    rows = db.fetchall('SELECT user_id FROM admins')
     return [row['user_id'] for row in rows]
 
-def save_vps_data():
-    conn = get_db()
-    cur = conn.cursor()
-    for user_id, vps_list in vps_data.items():
-        for vps in vps_list:
-            shared_json = json.dumps(vps['shared_with'])
-            history_json = json.dumps(vps['suspension_history'])
-            suspended_int = 1 if vps['suspended'] else 0
-            whitelisted_int = 1 if vps.get('whitelisted', False) else 0
-            os_ver = vps.get('os_version', 'ubuntu:22.04')
-            created_at = vps.get('created_at', datetime.now().isoformat())
-            
-            if 'id' not in vps or vps['id'] is None:
-                cur.execute('''INSERT INTO vps (user_id, container_name, ram, cpu, storage, config, os_version, status, suspended, whitelisted, created_at, shared_with, suspension_history)
-                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                            (user_id, vps['container_name'], vps['ram'], vps['cpu'], vps['storage'], vps['config'],
-                             os_ver, vps['status'], suspended_int, whitelisted_int,
-                             created_at, shared_json, history_json))
-                vps['id'] = cur.lastrowid
-            else:
-                cur.execute('''UPDATE vps SET user_id = ?, ram = ?, cpu = ?, storage = ?, config = ?, os_version = ?, status = ?, suspended = ?, whitelisted = ?, shared_with = ?, suspension_history = ?
-                               WHERE id = ?''',
-                            (user_id, vps['ram'], vps['cpu'], vps['storage'], vps['config'],
-                             os_ver, vps['status'], suspended_int, whitelisted_int, shared_json, history_json, vps['id']))
-    conn.commit()
-    conn.close()
-
-def save_admin_data():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('DELETE FROM admins')
-    for admin_id in admin_data['admins']:
-        cur.execute('INSERT INTO admins (user_id) VALUES (?)', (admin_id,))
-    conn.commit()
-    conn.close()
+_vps_save_lock = asyncio.Lock()
+
+async def save_vps_data():
+    """Persist every record with unsaved changes in a single transaction.
+
+    New records are inserted in full; existing ones only get an UPDATE of
+    the columns that actually changed, batched per column set.
+    """
+    # Rows are serialised on the event loop so the DB thread never reads a
+    # record while a handler is mutating it; the lock stops two concurrent
+    # saves from inserting the same new record twice.
+    async with _vps_save_lock:
+        records = list(_pending_vps.values())
+        _pending_vps.clear()
+        if not records:
+            return
+        changed = [(vps, vps.dirty) for vps in records]
+        inserts, updates = _collect_vps_changes(records)
+        for vps in records:
+            vps.dirty = set()
+        try:
+            new_ids = await adb.transaction(_write_vps_changes, [row for _, row in inserts], updates)
+        except Exception:
+            for vps, columns in changed:
+                vps.mark_dirty(*columns)
+            raise
+        for (vps, _), new_id in zip(inserts, new_ids):
+            vps.id = new_id
+
+async def bulk_update_vps(records: List[VPSRecord], **fields):
+    """Apply the same field changes to many records and persist them as one batch."""
+    for vps in records:
+        for key, value in fields.items():
+            setattr(vps, key, value)
+    await save_vps_data()
+
+async def delete_vps_record(vps: VPSRecord):
+    # Share grants and suspension events go with the row (ON DELETE CASCADE)
+    _pending_vps.pop(id(vps), None)
+    if vps.id is not None:
+        await adb.execute('DELETE FROM vps WHERE id = ?', (vps.id,))
+
+# VPS sharing and suspension history
+async def share_vps(vps: VPSRecord, user_id: str):
+    if vps.id is None:
+        await save_vps_data()
+    await adb.execute('INSERT OR IGNORE INTO vps_shares (vps_id, user_id, granted_at) VALUES (?, ?, ?)',
+                      (vps.id, user_id, datetime.now().isoformat()))
+    if user_id not in vps.shared_with:
+        vps.shared_with.append(user_id)
+
+async def unshare_vps(vps: VPSRecord, user_id: str):
+    await adb.execute('DELETE FROM vps_shares WHERE vps_id = ? AND user_id = ?', (vps.id, user_id))
+    if user_id in vps.shared_with:
+        vps.shared_with.remove(user_id)
+
+async def get_shared_vps(user_id: str) -> List[tuple]:
+    """Reverse lookup: every VPS shared with user_id, as (owner_id, vps_number, record)."""
+    rows = await adb.fetchall('''SELECT v.container_name FROM vps_shares s
+                                 JOIN vps v ON v.id = s.vps_id
+                                 WHERE s.user_id = ? ORDER BY s.granted_at''', (user_id,))
+    shared = []
+    for row in rows:
+        found = find_vps(row['container_name'])
+        if found:
+            owner_id, vps = found
+            shared.append((owner_id, get_vps_number(owner_id, vps), vps))
+    return shared
+
+async def record_suspension_event(vps: VPSRecord, event: str, reason: Optional[str] = None):
+    """Append a suspend/unsuspend event to the VPS's history."""
+    if vps.id is None:
+        await save_vps_data()
+    await adb.execute('INSERT INTO vps_suspensions (vps_id, event, reason, created_at) VALUES (?, ?, ?, ?)',
+                      (vps.id, event, reason, datetime.now().isoformat()))
+
+async def get_suspension_history(vps: VPSRecord, limit: int = 10) -> List[Dict[str, Any]]:
+    rows = await adb.fetchall('''SELECT event, reason, created_at FROM vps_suspensions
+                                 WHERE vps_id = ? ORDER BY created_at DESC LIMIT ?''', (vps.id, limit))
+    return [dict(row) for row in rows]
+
+def _collect_vps_changes(records: List[VPSRecord]):
+    inserts = []
+    updates: Dict[tuple, List[tuple]] = {}
+    for vps in records:
+        if vps.id is None:
+            inserts.append((vps, vps.to_row()))
+        elif vps.dirty:
+            columns = tuple(sorted(vps.dirty))
+            row = vps.to_row(columns) + (vps.id,)
+            updates.setdefault(columns, []).append(row)
+    return inserts, updates
+
+def _write_vps_changes(conn, inserts, updates):
+    insert_sql = f"INSERT INTO vps ({', '.join(VPS_COLUMNS)}) VALUES ({', '.join('?' * len(VPS_COLUMNS))})"
+    new_ids = [conn.execute(insert_sql, row).lastrowid for row in inserts]
+    for columns, rows in updates.items():
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        conn.executemany(f'UPDATE vps SET {assignments} WHERE id = ?', rows)
+    return new_ids
 
 # User stats functions
-def get_user_stats(user_id: str) -> Dict[str, Any]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    conn.close()
+async def get_user_stats(user_id: str) -> Dict[str, Any]:
+    row = await adb.fetchone('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
     if row:
         return dict(row)
     return {'user_id': user_id, 'invites': 0, 'boosts': 0, 'claimed_free_vps': 0, 'last_updated': None}
 
-def update_user_stats(user_id: str, invites: int = 0, boosts: int = 0, claimed_free_vps: int = 0):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('''INSERT OR REPLACE INTO user_stats 
+async def update_user_stats(user_id: str, invites: int = 0, boosts: int = 0, claimed_free_vps: int = 0):
+    await adb.execute('''INSERT OR REPLACE INTO user_stats 
                    (user_id, invites, boosts, claimed_free_vps, last_updated) 
                    VALUES (?, COALESCE((SELECT invites FROM user_stats WHERE user_id = ?), 0) + ?, 
                            COALESCE((SELECT boosts FROM user_stats WHERE user_id = ?), 0) + ?,
                            COALESCE((SELECT claimed_free_vps FROM user_stats WHERE user_id = ?), 0) + ?,
                            ?)''',
                 (user_id, user_id, invites, user_id, boosts, user_id, claimed_free_vps, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
 
 # Port forwarding functions
-def get_user_allocation(user_id: str) -> int:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT allocated_ports FROM port_allocations WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    conn.close()
+async def get_user_allocation(user_id: str) -> int:
+    row = await adb.fetchone('SELECT allocated_ports FROM port_allocations WHERE user_id = ?', (user_id,))
     return row[0] if row else 0
 
-def get_user_used_ports(user_id: str) -> int:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT COUNT(*) FROM port_forwards WHERE user_id = ?', (user_id,))
-    row = cur.fetchone()
-    conn.close()
+async def get_user_used_ports(user_id: str) -> int:
+    row = await adb.fetchone('SELECT COUNT(*) FROM port_forwards WHERE user_id = ?', (user_id,))
     return row[0]
 
-def allocate_ports(user_id: str, amount: int):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('INSERT OR REPLACE INTO port_allocations (user_id, allocated_ports) VALUES (?, COALESCE((SELECT allocated_ports FROM port_allocations WHERE user_id = ?), 0) + ?)', (user_id, user_id, amount))
-    conn.commit()
-    conn.close()
-
-def deallocate_ports(user_id: str, amount: int):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('UPDATE port_allocations SET allocated_ports = GREATEST(0, allocated_ports - ?) WHERE user_id = ?', (amount, user_id))
-    conn.commit()
-    conn.close()
-
-def get_available_host_port() -> Optional[int]:
-    used_ports = set()
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT host_port FROM port_forwards')
-    for row in cur.fetchall():
-        used_ports.add(row[0])
-    conn.close()
-    for _ in range(100):
-        port = random.randint(20000, 50000)
-        if port not in used_ports:
-            return port
-    return None
+async def allocate_ports(user_id: str, amount: int):
+    await adb.execute('INSERT OR REPLACE INTO port_allocations (user_id, allocated_ports) VALUES (?, COALESCE((SELECT allocated_ports FROM port_allocations WHERE user_id = ?), 0) + ?)', (user_id, user_id, amount))
+
+async def deallocate_ports(user_id: str, amount: int):
+    await adb.execute('UPDATE port_allocations SET allocated_ports = MAX(0, allocated_ports - ?) WHERE user_id = ?', (amount, user_id))
+
+port_allocator = PortAllocator(PORT_FORWARD_RANGES, adb)
 
 async def create_port_forward(user_id: str, container: str, vps_port: int) -> Optional[int]:
-    host_port = get_available_host_port()
-    if not host_port:
+    reservation = await port_allocator.reserve(user_id, container, vps_port)
+    if not reservation:
         return None
+    forward_id, host_port = reservation
     try:
-        await execute_lxc(f"lxc config device add {container} tcp_proxy_{host_port} proxy listen=tcp:0.0.0.0:{host_port} connect=tcp:127.0.0.1:{vps_port}")
-        await execute_lxc(f"lxc config device add {container} udp_proxy_{host_port} proxy listen=udp:0.0.0.0:{host_port} connect=udp:127.0.0.1:{vps_port}")
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute('INSERT INTO port_forwards (user_id, vps_container, vps_port, host_port, created_at) VALUES (?, ?, ?, ?, ?)',
-                    (user_id, container, vps_port, host_port, datetime.now().isoformat()))
-        conn.commit()
-        conn.close()
+        await lxd.update_instance(container, devices=proxy_devices(host_port, vps_port))
         return host_port
     except Exception as e:
         logger.error(f"Failed to create port forward: {e}")
+        try:
+            await lxd.remove_devices(container, f"tcp_proxy_{host_port}", f"udp_proxy_{host_port}", missing_ok=True)
+        except Exception:
+            pass
+        await adb.execute('DELETE FROM port_forwards WHERE id = ?', (forward_id,))
+        port_allocator.release(host_port)
         return None
 
 async def remove_port_forward(forward_id: int, is_admin: bool = False) -> tuple[bool, Optional[str]]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT user_id, vps_container, host_port FROM port_forwards WHERE id = ?', (forward_id,))
-    row = cur.fetchone()
+    row = await adb.fetchone('SELECT user_id, vps_container, host_port FROM port_forwards WHERE id = ?', (forward_id,))
     if not row:
-        conn.close()
         return False, None
     user_id, container, host_port = row
     try:
-        await execute_lxc(f"lxc config device remove {container} tcp_proxy_{host_port}")
-        await execute_lxc(f"lxc config device remove {container} udp_proxy_{host_port}")
-        cur.execute('DELETE FROM port_forwards WHERE id = ?', (forward_id,))
-        conn.commit()
-        conn.close()
+        await lxd.remove_devices(container, f"tcp_proxy_{host_port}", f"udp_proxy_{host_port}")
+        await adb.execute('DELETE FROM port_forwards WHERE id = ?', (forward_id,))
+        port_allocator.release(host_port)
         return True, user_id
     except Exception as e:
         logger.error(f"Failed to remove port forward {forward_id}: {e}")
-        conn.close()
         return False, None
 
-def get_user_forwards(user_id: str) -> List[Dict]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM port_forwards WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
-    rows = cur.fetchall()
-    conn.close()
+async def get_user_forwards(user_id: str) -> List[Dict]:
+    rows = await adb.fetchall('SELECT * FROM port_forwards WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
     return [dict(row) for row in rows]
 
+# In-memory VPS index
+# vps_data is the by-owner index (owner_id -> records) and container_index the
+# by-name one (container_name -> (owner_id, record)). Both hold the same record
+# objects and must only be changed through add_vps()/remove_vps().
+def build_container_index(data: Dict[str, List[VPSRecord]]) -> Dict[str, tuple]:
+    return {vps.container_name: (owner_id, vps) for owner_id, vps_list in data.items() for vps in vps_list}
+
+def find_vps(container_name: str) -> Optional[tuple]:
+    """Return (owner_id, record) for a container, or None if the bot doesn't manage it."""
+    return container_index.get(container_name)
+
+def get_owner_vps(owner_id: str) -> List[VPSRecord]:
+    return vps_data.get(owner_id, [])
+
+def get_vps_number(owner_id: str, vps: VPSRecord) -> int:
+    """1-based position of a record in its owner's list, as shown to users."""
+    return get_owner_vps(owner_id).index(vps) + 1
+
+def add_vps(owner_id: str, vps: VPSRecord):
+    vps_data.setdefault(owner_id, []).append(vps)
+    container_index[vps.container_name] = (owner_id, vps)
+    provisioning.discard(vps.container_name)
+    fleet_stats.add(vps)
+
+def remove_vps(owner_id: str, vps: VPSRecord):
+    vps_list = vps_data.get(owner_id, [])
+    if vps in vps_list:
+        vps_list.remove(vps)
+    if not vps_list:
+        vps_data.pop(owner_id, None)
+    container_index.pop(vps.container_name, None)
+    fleet_stats.remove(vps)
+
+# Fleet aggregates
+# Record fields that feed the totals; VPSRecord.__setattr__ re-counts a
+# record whenever one of them changes.
+_AGGREGATE_FIELDS = frozenset(('user_id', 'status', 'suspended', 'whitelisted', 'ram_mb', 'cpu', 'storage_gb'))
+
+class FleetTotals:
+    """Counts and resource sums for a group of VPS records."""
+
+    __slots__ = ('total', 'running', 'active', 'stopped', 'suspended', 'whitelisted', 'ram_mb', 'cpu', 'storage_gb')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def apply(self, vps: VPSRecord, sign: int):
+        self.total += sign
+        self.running += sign * vps.is_running
+        # Running and not suspended, i.e. what users see as online
+        self.active += sign * (vps.is_running and not vps.suspended)
+        self.stopped += sign * (vps.status is VPSStatus.STOPPED)
+        self.suspended += sign * vps.suspended
+        self.whitelisted += sign * vps.whitelisted
+        self.ram_mb += sign * vps.ram_mb
+        self.cpu += sign * vps.cpu
+        self.storage_gb += sign * vps.storage_gb
+
+    @property
+    def ram_gb(self) -> int:
+        return self.ram_mb // 1024
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class FleetAggregates:
+    """Per-owner and fleet-wide totals kept up to date as records change.
+
+    Records are counted when add_vps() registers them and uncounted by
+    remove_vps(); field changes in between are applied as a remove/add of the
+    record's contribution, so summary commands never walk vps_data.
+    """
+
+    def __init__(self):
+        self.fleet = FleetTotals()
+        self.owners: Dict[str, FleetTotals] = {}
+        self._counted = set()
+
+    def counts(self, vps: VPSRecord) -> bool:
+        return id(vps) in self._counted
+
+    def add(self, vps: VPSRecord):
+        if id(vps) not in self._counted:
+            self._counted.add(id(vps))
+            self._apply(vps, 1)
+
+    def remove(self, vps: VPSRecord):
+        if id(vps) in self._counted:
+            self._counted.discard(id(vps))
+            self._apply(vps, -1)
+
+    def _apply(self, vps: VPSRecord, sign: int):
+        self.fleet.apply(vps, sign)
+        owner = self.owners.get(vps.user_id)
+        if owner is None:
+            owner = self.owners[vps.user_id] = FleetTotals()
+        owner.apply(vps, sign)
+        if owner.total == 0:
+            del self.owners[vps.user_id]
+
+    def owner(self, owner_id: str) -> FleetTotals:
+        return self.owners.get(owner_id) or FleetTotals()
+
+    @property
+    def owner_count(self) -> int:
+        return len(self.owners)
+
+    def rebuild(self, data: Dict[str, List[VPSRecord]]):
+        self.fleet = FleetTotals()
+        self.owners = {}
+        self._counted = set()
+        for vps_list in data.values():
+            for vps in vps_list:
+                self.add(vps)
+
+    def verify(self, data: Dict[str, List[VPSRecord]]) -> List[str]:
+        """Recount from scratch and return a description of every mismatch."""
+        expected = FleetAggregates()
+        expected.rebuild(data)
+        problems = []
+        groups = [('fleet', self.fleet, expected.fleet)]
+        for owner_id in sorted(set(self.owners) | set(expected.owners)):
+            groups.append((f"owner {owner_id}", self.owner(owner_id), expected.owner(owner_id)))
+        for label, actual, wanted in groups:
+            actual_values, wanted_values = actual.as_dict(), wanted.as_dict()
+            for name, value in wanted_values.items():
+                if actual_values[name] != value:
+                    problems.append(f"{label}: {name} is {actual_values[name]}, expected {value}")
+        if self._counted != expected._counted:
+            problems.append(f"{len(self._counted ^ expected._counted)} records counted incorrectly")
+        return problems
+
+fleet_stats = FleetAggregates()
+
 # Initialize database
 init_db()
 
 # Load data at startup
 vps_data = get_vps_data()
+container_index = build_container_index(vps_data)
+# Containers being created that add_vps has not recorded yet
+provisioning: set = set()
+fleet_stats.rebuild(vps_data)
 admin_data = {'admins': get_admins()}
+port_allocator.load(row[0] for row in db.fetchall('SELECT host_port FROM port_forwards'))
 
 # Global settings from DB
-CPU_THRESHOLD = int(get_setting('cpu_threshold', 90))
-RAM_THRESHOLD = int(get_setting('ram_threshold', 90))
+settings.load()
 
 # Bot setup
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+class VPSBot(commands.Bot):
+    async def close(self):
+        lxd_events.stop()
+        image_manager.stop()
+        warm_pool.stop()
+        cpu_sampler.stop()
+        metrics_cache.stop()
+        usage_history.stop()
+        resource_monitor.stop()
+        await lxd.close()
+        await super().close()
 
-# Resource monitoring settings
-resource_monitor_active = True
+bot = VPSBot(command_prefix=PREFIX, intents=intents, help_command=None)
 
 # Helper function to truncate text
 def truncate_text(text, max_length=1024):
@@ -423,202 +1159,1348 @@ def is_main_admin():
         raise commands.CheckFailure("Only the main admin can use this command.")
     return commands.check(predicate)
 
-# Clean LXC command execution
-async def execute_lxc(command, timeout=120):
-    try:
-        cmd = shlex.split(command)
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+# LXD REST API
+lxd = LXDClient(LXD_SOCKET_PATH, timeout=LXD_REQUEST_TIMEOUT)
+
+# Configuration shared by every VPS, through the base profile (or inline if profiles cannot be synced)
+VPS_INSTANCE_CONFIG = {
+    'security.nesting': 'true',
+    'security.privileged': 'true',
+    'security.syscalls.intercept.mknod': 'true',
+    'security.syscalls.intercept.setxattr': 'true',
+    'linux.kernel_modules': 'overlay,loop,nf_nat,ip_tables,ip6_tables,netlink_diag,br_netfilter',
+    'raw.lxc': """
+lxc.apparmor.profile = unconfined
+lxc.cgroup.devices.allow = a
+lxc.cap.drop =
+lxc.mount.auto = proc:rw sys:rw cgroup:rw
+""",
+}
+
+VPS_INSTANCE_DEVICES = {
+    'fuse': {'type': 'unix-char', 'path': '/dev/fuse'},
+}
+
+def lxd_image_source(os_version: str) -> Dict[str, str]:
+    """Translate a CLI-style image name ("ubuntu:22.04", "images:debian/12") into an LXD source."""
+    remote, _, alias = os_version.partition(':')
+    if alias and remote in LXD_IMAGE_SERVERS:
+        return {'type': 'image', 'mode': 'pull', 'server': LXD_IMAGE_SERVERS[remote],
+                'protocol': 'simplestreams', 'alias': alias}
+    return {'type': 'image', 'alias': os_version}
+
+# Local image cache
+HOST_ARCHITECTURES = {'x86_64': 'amd64', 'aarch64': 'arm64', 'armv7l': 'armhf', 'ppc64le': 'ppc64el', 's390x': 's390x'}
+
+class SimpleStreamsDirectory:
+    """Reads a simplestreams tree on disk (streams/v1/index.json and its product files)."""
+
+    def __init__(self, root: str, architecture: Optional[str] = None):
+        self.root = root
+        self.architecture = architecture or HOST_ARCHITECTURES.get(os.uname().machine, os.uname().machine)
+
+    def _load(self, path: str) -> Dict[str, Any]:
+        with open(os.path.join(self.root, path)) as f:
+            return json.load(f)
+
+    def find(self, alias: str) -> Optional[Dict[str, Any]]:
+        """Newest container image for alias: {'version', 'fingerprint', 'metadata_path', 'rootfs_path'}."""
+        index = self._load('streams/v1/index.json')
+        for stream in index.get('index', {}).values():
+            if stream.get('datatype') != 'image-downloads':
+                continue
+            for product in self._load(stream['path']).get('products', {}).values():
+                if product.get('arch') != self.architecture:
+                    continue
+                if alias not in [name.strip() for name in product.get('aliases', '').split(',')]:
+                    continue
+                for version in sorted(product.get('versions', {}), reverse=True):
+                    items = product['versions'][version].get('items', {})
+                    metadata = next((item for item in items.values() if item.get('ftype') == 'lxd.tar.xz'), None)
+                    rootfs = next((item for item in items.values() if item.get('ftype') == 'squashfs'), None)
+                    if metadata and rootfs:
+                        return {'version': version,
+                                'fingerprint': metadata.get('combined_squashfs_sha256'),
+                                'metadata_path': os.path.join(self.root, metadata['path']),
+                                'rootfs_path': os.path.join(self.root, rootfs['path'])}
+        return None
+
+class CachedImage:
+    __slots__ = ('os_version', 'alias', 'fingerprint', 'size', 'refreshed_at', 'error')
+
+    def __init__(self, os_version: str, alias: str):
+        self.os_version = os_version
+        self.alias = alias
+        self.fingerprint: Optional[str] = None
+        self.size = 0
+        self.refreshed_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+class ImageManager:
+    """Keeps every OS_OPTIONS image in the local LXD store under a stable alias.
+
+    Images are prefetched at startup and refreshed every image_refresh_interval
+    seconds in the background; a refresh moves the alias to the new image and
+    deletes the old one. Provisioning always creates from the local alias, only
+    pulling inline when an image has never been cached. Sources are the
+    LXD_IMAGE_SERVERS remotes, or a simplestreams directory on local disk.
+    """
+
+    def __init__(self, client: LXDClient, os_versions: List[str]):
+        self.client = client
+        self.images = {os_version: CachedImage(os_version, self.alias_for(os_version)) for os_version in os_versions}
+        self.loaded = False
+        self._fetches: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def alias_for(os_version: str) -> str:
+        return f"{BOT_NAME.lower()}/{os_version.replace(':', '/')}"
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh_all()
+            except Exception as e:
+                logger.warning(f"Image refresh failed: {e}")
+            await asyncio.sleep(settings['image_refresh_interval'])
+
+    async def load(self):
+        """Pick up aliases already in the local store (one call)."""
+        targets = {alias['name']: alias['target'] for alias in await self.client.list_image_aliases()}
+        for image in self.images.values():
+            image.fingerprint = targets.get(image.alias)
+        self.loaded = True
+
+    async def _fetch(self, os_version: str) -> str:
+        """Bring the newest upstream image into the store; returns its fingerprint."""
+        remote, _, alias = os_version.partition(':')
+        server = LXD_IMAGE_SERVERS.get(remote) if alias else None
+        if server and not server.startswith(('https://', 'http://')):
+            directory = SimpleStreamsDirectory(server)
+            found = await asyncio.to_thread(directory.find, alias)
+            if not found:
+                raise LXDNotFound(f"{alias} not found in {server}", 404)
+            if found['fingerprint'] and await self.client.has_image(found['fingerprint']):
+                return found['fingerprint']
+            return await self.client.upload_image(found['metadata_path'], found['rootfs_path'])
+        return await self.client.pull_image(lxd_image_source(os_version))
+
+    async def refresh(self, os_version: str) -> CachedImage:
+        """Fetch os_version and point its alias at the result; concurrent callers share one fetch."""
+        if os_version not in self._fetches or self._fetches[os_version].done():
+            self._fetches[os_version] = asyncio.ensure_future(self._refresh(os_version))
+        return await asyncio.shield(self._fetches[os_version])
+
+    async def _refresh(self, os_version: str) -> CachedImage:
+        image = self.images.setdefault(os_version, CachedImage(os_version, self.alias_for(os_version)))
+        if not self.loaded:
+            await self.load()
         try:
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
-        except asyncio.TimeoutError:
-            proc.kill()
-            await proc.wait()
-            raise asyncio.TimeoutError(f"Command timed out after {timeout} seconds")
-        if proc.returncode != 0:
-            error = stderr.decode().strip() if stderr else "Command failed with no error output"
-            raise Exception(error)
-        return stdout.decode().strip() if stdout else True
-    except asyncio.TimeoutError as te:
-        logger.error(f"LXC command timed out: {command} - {str(te)}")
-        raise
+            fingerprint = await self._fetch(os_version)
+            previous = image.fingerprint
+            if previous is None:
+                await self.client.create_image_alias(image.alias, fingerprint, f"{BOT_NAME} cache of {os_version}")
+            elif previous != fingerprint:
+                await self.client.update_image_alias(image.alias, fingerprint, f"{BOT_NAME} cache of {os_version}")
+                try:
+                    await self.client.delete_image(previous)
+                except LXDError as e:
+                    logger.warning(f"Could not delete superseded image {previous[:12]}: {e}")
+            if previous != fingerprint:
+                logger.info(f"Cached {os_version} as {image.alias} ({fingerprint[:12]})")
+            image.fingerprint = fingerprint
+            image.size = (await self.client.get_image(fingerprint)).get('size') or 0
+            image.refreshed_at = time.time()
+            image.error = None
+        except Exception as e:
+            image.error = str(e)
+            raise
+        return image
+
+    async def refresh_all(self) -> List[CachedImage]:
+        """Refresh every image one at a time, so downloads never compete with each other."""
+        for os_version in list(self.images):
+            try:
+                await self.refresh(os_version)
+            except Exception as e:
+                logger.warning(f"Could not refresh image {os_version}: {e}")
+        return list(self.images.values())
+
+    async def source(self, os_version: str) -> Dict[str, str]:
+        """Instance source for os_version from the local store, caching it first on a cold miss."""
+        if not self.loaded:
+            await self.load()
+        image = self.images.get(os_version)
+        if image is None or image.fingerprint is None:
+            image = await self.refresh(os_version)
+        return {'type': 'image', 'alias': image.alias}
+
+image_manager = ImageManager(lxd, [option['value'] for option in OS_OPTIONS])
+
+def vps_limits(ram_mb: int, cpu: int, disk_gb: int) -> tuple:
+    """Config keys and root device that size a VPS."""
+    config = {'limits.memory': f"{ram_mb}MB", 'limits.cpu': str(cpu)}
+    devices = {'root': {'type': 'disk', 'path': '/', 'pool': DEFAULT_STORAGE_POOL, 'size': f"{disk_gb}GB"}}
+    return config, devices
+
+def vps_instance_spec(ram_mb: int, cpu: int, disk_gb: int) -> tuple:
+    """Config keys and devices for a VPS with the given limits, without profiles."""
+    limits, root = vps_limits(ram_mb, cpu, disk_gb)
+    return dict(VPS_INSTANCE_CONFIG, **limits), dict(VPS_INSTANCE_DEVICES, **root)
+
+# LXD profiles
+BASE_PROFILE = f"{BOT_NAME.lower()}-docker-ready"
+
+class ProfileManager:
+    """Keeps the bot's LXD profiles in line with VPS_INSTANCE_CONFIG.
+
+    Every VPS gets the base docker-ready profile, which carries only the
+    configuration all VPS share. Limits and root disk size are always set on
+    the instance, so editing a profile or FREE_VPS_PLANS never resizes
+    existing VPS. Profiles are created or overwritten at startup only when
+    they differ.
+    """
+
+    def __init__(self, client: LXDClient):
+        self.client = client
+        self._synced: Optional[asyncio.Future] = None
+
+    def desired(self) -> Dict[str, tuple]:
+        """profile name -> (config, devices, description)"""
+        return {BASE_PROFILE: (dict(VPS_INSTANCE_CONFIG), dict(VPS_INSTANCE_DEVICES),
+                               f"{BOT_NAME} VPS base: nesting, privileged, fuse, Docker kernel modules")}
+
+    async def _sync_profile(self, name: str, config: Dict[str, str], devices: Dict[str, Dict[str, str]],
+                            description: str) -> Optional[str]:
+        try:
+            current = await self.client.get_profile(name)
+        except LXDNotFound:
+            await self.client.create_profile(name, config, devices, description)
+            return 'created'
+        if (current.get('config') or {}) == config and (current.get('devices') or {}) == devices \
+                and current.get('description', '') == description:
+            return None
+        await self.client.replace_profile(name, config, devices, description)
+        return 'updated'
+
+    async def sync(self) -> Dict[str, str]:
+        """Create or update every profile; returns {name: 'created' | 'updated'} for those changed."""
+        changes = {}
+        for name, (config, devices, description) in self.desired().items():
+            change = await self._sync_profile(name, config, devices, description)
+            if change:
+                changes[name] = change
+                logger.info(f"LXD profile {name} {change}")
+        return changes
+
+    def start(self):
+        asyncio.ensure_future(self.ensure())
+
+    async def ensure(self) -> bool:
+        """Sync once per process; False (and retried next time) if LXD refused."""
+        if self._synced is None or (self._synced.done() and not self._synced.result()):
+            self._synced = asyncio.ensure_future(self._ensure())
+        return await asyncio.shield(self._synced)
+
+    async def _ensure(self) -> bool:
+        try:
+            await self.sync()
+            return True
+        except Exception as e:
+            logger.error(f"Could not sync LXD profiles, falling back to per-instance config: {e}")
+            return False
+
+    def instance_spec(self, ram_mb: int, cpu: int, disk_gb: int) -> tuple:
+        """(profiles, config, devices) for a new VPS of this size."""
+        config, devices = vps_limits(ram_mb, cpu, disk_gb)
+        return ['default', BASE_PROFILE], config, devices
+
+profile_manager = ProfileManager(lxd)
+
+# Warm pool of spare containers
+SPARE_MARKER_KEY = f"user.{BOT_NAME.lower()}.spare"
+
+class WarmPool:
+    """Stopped, fully configured spare containers per OS, ready to be claimed.
+
+    A spare is created from the cached image with the base profile and the
+    guest sysctl file, and tagged with SPARE_MARKER_KEY. Claiming one is a
+    rename plus a single PATCH for limits and profiles; the caller then starts
+    it. Refills run in the background, at most warm_pool_concurrency at once.
+    The pool never holds more than warm_pool_max_spares in total, and stops
+    building while the storage pool has less than warm_pool_min_free_disk
+    percent free; that check is a snapshot, so concurrent builds can each
+    pass it. Each spare remembers the image it was built from, and spares
+    left behind by an image refresh are deleted and rebuilt. Spare names
+    never match the VPS naming scheme, so the reconciler and fleet views
+    leave them alone.
+    """
+
+    RECHECK_SECONDS = 300
+
+    def __init__(self, client: LXDClient, os_versions: List[str]):
+        self.client = client
+        self.os_versions = os_versions
+        # os_version -> (spare name, image fingerprint) pairs
+        self.ready: Dict[str, deque] = {os_version: deque() for os_version in os_versions}
+        self.filling: Dict[str, int] = {os_version: 0 for os_version in os_versions}
+        self.hits: Dict[str, int] = {os_version: 0 for os_version in os_versions}
+        self.misses: Dict[str, int] = {os_version: 0 for os_version in os_versions}
+        self.free_disk_percent: Optional[float] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        settings.subscribe('warm_pool_size', lambda key, value: self._wake.set())
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        try:
+            await self.load()
+        except Exception as e:
+            logger.warning(f"Could not load warm pool spares: {e}")
+        while True:
+            self._wake.clear()
+            try:
+                await self.fill()
+            except Exception as e:
+                logger.warning(f"Warm pool refill failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.RECHECK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def load(self):
+        """Adopt spares left stopped by a previous run (one call)."""
+        for instance in await self.client.list_instances(recursion=1):
+            config = instance.get('config') or {}
+            os_version = config.get(SPARE_MARKER_KEY)
+            if os_version in self.ready and instance.get('status') == 'Stopped' \
+                    and instance['name'] not in [name for name, _ in self.ready[os_version]]:
+                self.ready[os_version].append((instance['name'], config.get('volatile.base_image')))
+
+    @staticmethod
+    def is_current(os_version: str, fingerprint: Optional[str]) -> bool:
+        """False once the cached image for os_version has moved past the one a spare was built from."""
+        image = image_manager.images.get(os_version)
+        return image is None or image.fingerprint is None or fingerprint == image.fingerprint
+
+    async def _discard(self, name: str):
+        try:
+            await self.client.delete_instance(name, force=True)
+        except Exception as e:
+            logger.warning(f"Could not delete spare {name}: {e}")
+
+    async def recycle(self) -> int:
+        """Delete spares built from a superseded image; fill() replaces them."""
+        stale = []
+        for os_version, spares in self.ready.items():
+            current = [spare for spare in spares if self.is_current(os_version, spare[1])]
+            stale += [name for name, fingerprint in spares if not self.is_current(os_version, fingerprint)]
+            self.ready[os_version] = deque(current)
+        for name in stale:
+            logger.info(f"Warm pool: {name} was built from an old image, rebuilding")
+            await self._discard(name)
+        return len(stale)
+
+    async def has_capacity(self) -> bool:
+        space = (await self.client.get_storage_pool_resources(DEFAULT_STORAGE_POOL)).get('space') or {}
+        total = space.get('total') or 0
+        self.free_disk_percent = (total - (space.get('used') or 0)) / total * 100 if total else None
+        return self.free_disk_percent is None or self.free_disk_percent >= settings['warm_pool_min_free_disk']
+
+    async def fill(self):
+        await self.recycle()
+        target = settings['warm_pool_size']
+        deficits = [[os_version] * max(target - len(self.ready[os_version]) - self.filling[os_version], 0)
+                    for os_version in self.os_versions]
+        # Round-robin across OSes so one slow image does not starve the rest
+        wanted = [os_version for batch in itertools.zip_longest(*deficits) for os_version in batch if os_version]
+        room = settings['warm_pool_max_spares'] - sum(map(len, self.ready.values())) - sum(self.filling.values())
+        wanted = wanted[:max(room, 0)]
+        if not wanted:
+            return
+        limiter = asyncio.Semaphore(max(settings['warm_pool_concurrency'], 1))
+        await asyncio.gather(*(self._make_spare(os_version, limiter) for os_version in wanted))
+
+    async def _make_spare(self, os_version: str, limiter: asyncio.Semaphore):
+        self.filling[os_version] += 1
+        try:
+            async with limiter:
+                if not await self.has_capacity():
+                    logger.info(f"Warm pool paused: {self.free_disk_percent:.0f}% storage free")
+                    return
+                name = f"{BOT_NAME.lower()}-spare-{random.getrandbits(32):08x}"
+                if await profile_manager.ensure():
+                    profiles, config, devices = ['default', BASE_PROFILE], {}, {}
+                else:
+                    profiles, config, devices = None, dict(VPS_INSTANCE_CONFIG), dict(VPS_INSTANCE_DEVICES)
+                config[SPARE_MARKER_KEY] = os_version
+                try:
+                    source = await image_manager.source(os_version)
+                    fingerprint = image_manager.images[os_version].fingerprint
+                    await self.client.create_instance(name, source, config, devices, profiles)
+                    await push_guest_sysctl(name)
+                except Exception as e:
+                    logger.warning(f"Could not build {os_version} spare: {e}")
+                    try:
+                        await self.client.delete_instance(name, force=True)
+                    except Exception:
+                        pass
+                    return
+                self.ready[os_version].append((name, fingerprint))
+                logger.info(f"Warm pool: {name} ready for {os_version}")
+        finally:
+            self.filling[os_version] -= 1
+
+    async def claim(self, container_name: str, os_version: str, ram_mb: int, cpu: int, disk_gb: int) -> bool:
+        """Turn a spare into container_name with the given limits; False on a pool miss."""
+        spares = self.ready.get(os_version)
+        spare = None
+        while spares and spare is None:
+            name, fingerprint = spares.popleft()
+            if self.is_current(os_version, fingerprint):
+                spare = name
+            else:
+                asyncio.ensure_future(self._discard(name))
+        self._wake.set()
+        if spare is None:
+            if os_version in self.misses:
+                self.misses[os_version] += 1
+            return False
+
+        renamed = False
+        try:
+            await self.client.rename_instance(spare, container_name)
+            renamed = True
+            profiles, config, devices = await vps_creation_spec(ram_mb, cpu, disk_gb)
+            await self.client.update_instance(container_name, dict(config, **{SPARE_MARKER_KEY: ''}), devices, profiles)
+        except Exception as e:
+            logger.warning(f"Could not claim spare {spare} as {container_name}: {e}")
+            self.misses[os_version] += 1
+            try:
+                await self.client.delete_instance(container_name if renamed else spare, force=True)
+            except Exception:
+                pass
+            return False
+        self.hits[os_version] += 1
+        logger.info(f"Warm pool hit: {spare} claimed as {container_name}")
+        return True
+
+warm_pool = WarmPool(lxd, [option['value'] for option in OS_OPTIONS])
+
+async def vps_creation_spec(ram_mb: int, cpu: int, disk_gb: int) -> tuple:
+    """(profiles, config, devices) for a VPS; profiles is None when they could not be synced."""
+    if await profile_manager.ensure():
+        return profile_manager.instance_spec(ram_mb, cpu, disk_gb)
+    config, devices = vps_instance_spec(ram_mb, cpu, disk_gb)
+    return None, config, devices
+
+async def push_guest_sysctl(container_name: str):
+    # Written before first boot, so the guest's own sysctl service applies it
+    try:
+        await lxd.push_file(container_name, GUEST_SYSCTL_PATH, GUEST_SYSCTL.encode())
     except Exception as e:
-        logger.error(f"LXC Error: {command} - {str(e)}")
-        raise
+        logger.warning(f"Could not write {GUEST_SYSCTL_PATH} into {container_name}: {e}")
+
+async def provision_instance(container_name: str, os_version: str, ram_mb: int, cpu: int, disk_gb: int):
+    """Create (or claim from the warm pool), configure and boot a VPS container.
 
-# Function to apply LXC config
-async def apply_lxc_config(container_name):
+    The name stays in ``provisioning`` until add_vps records it, so the
+    reconciler does not mistake the half-built container for an orphan.
+    """
+    provisioning.add(container_name)
     try:
-        await execute_lxc(f"lxc config set {container_name} security.nesting true")
-        await execute_lxc(f"lxc config set {container_name} security.privileged true")
-        await execute_lxc(f"lxc config set {container_name} security.syscalls.intercept.mknod true")
-        await execute_lxc(f"lxc config set {container_name} security.syscalls.intercept.setxattr true")
-        
+        if not await warm_pool.claim(container_name, os_version, ram_mb, cpu, disk_gb):
+            profiles, config, devices = await vps_creation_spec(ram_mb, cpu, disk_gb)
+            await lxd.create_instance(container_name, await image_manager.source(os_version), config, devices, profiles)
+            await push_guest_sysctl(container_name)
         try:
-            await execute_lxc(f"lxc config device add {container_name} fuse unix-char path=/dev/fuse")
+            if not await lxd.supports('instances_rebuild'):
+                # Without the rebuild API, reinstall restores this untouched copy
+                await lxd.create_snapshot(container_name, PRISTINE_SNAPSHOT)
         except Exception as e:
-            if "already exists" not in str(e).lower():
-                raise
-        
-        await execute_lxc(f"lxc config set {container_name} linux.kernel_modules overlay,loop,nf_nat,ip_tables,ip6_tables,netlink_diag,br_netfilter")
-        
-        raw_lxc_config = """
-lxc.apparmor.profile = unconfined
-lxc.cgroup.devices.allow = a
-lxc.cap.drop =
-lxc.mount.auto = proc:rw sys:rw cgroup:rw
+            logger.warning(f"Could not snapshot pristine {container_name}: {e}")
+        await lxd.start_instance(container_name)
+        await initialise_guest(container_name)
+    except Exception:
+        provisioning.discard(container_name)
+        raise
+    logger.info(f"Provisioned {container_name} ({os_version})")
+
+# Reinstall
+PRISTINE_SNAPSHOT = 'pristine'
+
+async def reinstall_instance(container_name: str, os_version: str, current_os: str) -> float:
+    """Swap in a fresh root filesystem, keeping the instance, its devices and proxies.
+
+    Uses LXD's rebuild API when available; otherwise a same-OS reinstall
+    restores the pristine snapshot taken at provisioning. Returns seconds taken.
+    """
+    started = time.monotonic()
+    if await lxd.supports('instances_rebuild'):
+        source = await image_manager.source(os_version)
+    elif os_version == current_os and await lxd.has_snapshot(container_name, PRISTINE_SNAPSHOT):
+        source = None
+    else:
+        raise LXDError("This LXD server cannot rebuild instances; only a reinstall of the current OS is possible")
+    
+    state = await lxd.get_instance_state(container_name)
+    was_running = state.get('status') != 'Stopped'
+    if was_running:
+        await lxd.stop_instance(container_name, force=True)
+    try:
+        if source is not None:
+            await lxd.rebuild_instance(container_name, source)
+            await push_guest_sysctl(container_name)
+        else:
+            await lxd.restore_rootfs(container_name, PRISTINE_SNAPSHOT)
+    except Exception:
+        # Leave the VPS as it was found rather than stopped
+        if was_running:
+            try:
+                await lxd.start_instance(container_name)
+            except Exception as e:
+                logger.error(f"Could not restart {container_name} after failed reinstall: {e}")
+        raise
+    finally:
+        metrics_cache.invalidate(container_name)
+    await lxd.start_instance(container_name)
+    await initialise_guest(container_name)
+    elapsed = time.monotonic() - started
+    logger.info(f"Reinstalled {container_name} with {os_version} in {elapsed:.1f}s")
+    return elapsed
+
+async def resize_instance(container_name: str, ram_mb: int = None, cpu: int = None, disk_gb: int = None):
+    """Apply new limits (and root disk size) in a single PATCH."""
+    config = {}
+    if ram_mb is not None:
+        config['limits.memory'] = f"{ram_mb}MB"
+    if cpu is not None:
+        config['limits.cpu'] = str(cpu)
+    devices = None
+    if disk_gb is not None:
+        instance = await lxd.get_instance(container_name)
+        root = instance.get('devices', {}).get('root') or instance.get('expanded_devices', {}).get('root')
+        if not root:
+            raise LXDNotFound(f"No root disk on {container_name}", 404)
+        devices = {'root': dict(root, size=f"{disk_gb}GB")}
+    await lxd.update_instance(container_name, config=config, devices=devices)
+
+# Guest initialisation
+GUEST_SYSCTL_PATH = '/etc/sysctl.d/99-custom.conf'
+GUEST_SYSCTL = """net.ipv4.ip_unprivileged_port_start=0
+net.ipv4.ping_group_range=0 2147483647
+fs.inotify.max_user_watches=524288
 """
-        await execute_lxc(f"lxc config set {container_name} raw.lxc '{raw_lxc_config}'")
-        
-        logger.info(f"Applied LXC config to {container_name}")
+
+def guest_network_up(state: Dict[str, Any]) -> bool:
+    """True once any non-loopback interface has a global address."""
+    for interface, info in (state.get('network') or {}).items():
+        if interface == 'lo':
+            continue
+        if any(address.get('scope') == 'global' for address in info.get('addresses') or []):
+            return True
+    return False
+
+async def wait_until_ready(container_name: str, timeout: float, network: bool = True) -> bool:
+    """Poll the instance until init is running and, if network is set, the network is up."""
+    deadline = time.monotonic() + timeout
+    delay = 0.2
+    while True:
+        state = await lxd.get_instance_state(container_name)
+        if state.get('status') == 'Running' and state.get('pid') and (not network or guest_network_up(state)):
+            return True
+        if time.monotonic() + delay > deadline:
+            return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, 2.0)
+
+async def initialise_guest(container_name: str, wait_for_network: bool = True) -> Dict[str, float]:
+    """Wait for the guest to come up, then apply the sysctl file in one exec.
+
+    The file itself lives in the guest's rootfs (pushed at provisioning), so
+    this only makes sure it is in effect. Interactive start/restart paths pass
+    wait_for_network=False: sysctl only needs init running, and a broken host
+    network should not hold up the reply. Returns seconds spent per stage.
+    """
+    timings = {}
+    started = time.monotonic()
+    try:
+        ready = await wait_until_ready(container_name, settings['guest_ready_timeout'], network=wait_for_network)
+        timings['ready'] = time.monotonic() - started
+        if not ready:
+            logger.warning(f"{container_name} not ready after {settings['guest_ready_timeout']:g}s, applying sysctl anyway")
+        
+        started = time.monotonic()
+        return_code, _, stderr = await lxd.exec(container_name, ["sysctl", "-p", GUEST_SYSCTL_PATH], check=False)
+        timings['sysctl'] = time.monotonic() - started
+        if return_code != 0:
+            logger.warning(f"sysctl on {container_name} exited {return_code}: {stderr.strip()}")
     except Exception as e:
-        logger.error(f"Failed to apply LXC config to {container_name}: {e}")
+        logger.error(f"Failed to initialise guest {container_name}: {e}")
+    logger.info(f"Initialised {container_name}: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
+    return timings
 
-async def apply_internal_permissions(container_name):
+# Get or create VPS user role
+async def get_or_create_vps_role(guild):
+    global VPS_USER_ROLE_ID
+    if VPS_USER_ROLE_ID:
+        role = guild.get_role(VPS_USER_ROLE_ID)
+        if role:
+            return role
+    role = discord.utils.get(guild.roles, name=f"{BOT_NAME} VPS User")
+    if role:
+        VPS_USER_ROLE_ID = role.id
+        return role
     try:
-        await asyncio.sleep(5)
-        
-        commands = [
-            "mkdir -p /etc/sysctl.d/",
-            "echo 'net.ipv4.ip_unprivileged_port_start=0' > /etc/sysctl.d/99-custom.conf",
-            "echo 'net.ipv4.ping_group_range=0 2147483647' >> /etc/sysctl.d/99-custom.conf",
-            "echo 'fs.inotify.max_user_watches=524288' >> /etc/sysctl.d/99-custom.conf",
-            "sysctl -p /etc/sysctl.d/99-custom.conf || true"
-        ]
-        
-        for cmd in commands:
+        role = await guild.create_role(
+            name=f"{BOT_NAME} VPS User",
+            color=discord.Color.dark_purple(),
+            reason=f"{BOT_NAME} VPS User role for bot management",
+            permissions=discord.Permissions.none()
+        )
+        VPS_USER_ROLE_ID = role.id
+        logger.info(f"Created {BOT_NAME} VPS User role: {role.name} (ID: {role.id})")
+        return role
+    except Exception as e:
+        logger.error(f"Failed to create {BOT_NAME} VPS User role: {e}")
+        return None
+
+# Fleet state snapshot
+_BYTE_UNITS = {'B': 1, 'kB': 10**3, 'MB': 10**6, 'GB': 10**9, 'TB': 10**12,
+               'KiB': 2**10, 'MiB': 2**20, 'GiB': 2**30, 'TiB': 2**40}
+
+def parse_bytes(value) -> Optional[int]:
+    """Parse an LXD size such as "2048MB" or "2GiB" into bytes; None if unset or relative."""
+    if value in (None, ''):
+        return None
+    text = str(value).strip()
+    for unit in sorted(_BYTE_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
             try:
-                await execute_lxc(f"lxc exec {container_name} -- bash -c \"{cmd}\"")
-            except Exception:
+                return int(float(text[:-len(unit)]) * _BYTE_UNITS[unit])
+            except ValueError:
+                return None
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+def parse_cpu_limit(value) -> Optional[int]:
+    """Number of CPUs in limits.cpu, which is either a count or a set like "0-3,6"."""
+    if value in (None, ''):
+        return None
+    text = str(value).strip()
+    if text.isdigit():
+        return int(text)
+    count = 0
+    for part in text.split(','):
+        low, _, high = part.partition('-')
+        count += int(high) - int(low) + 1 if high else 1
+    return count
+
+def format_bytes(value: int) -> str:
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(value) < 1024:
+            return f"{value:.1f}{unit}" if unit != 'B' else f"{value}B"
+        value /= 1024
+    return f"{value:.1f}T"
+
+class InstanceState:
+    """Runtime state of one instance, parsed from a recursion=2 instance listing."""
+
+    __slots__ = ('name', 'status', 'pid', 'processes', 'cpu_ns', 'cpu_limit', 'memory_bytes', 'memory_peak_bytes',
+                 'memory_limit_bytes', 'disk_bytes', 'disk_limit_bytes', 'net_rx_bytes', 'net_tx_bytes')
+
+    def __init__(self, instance: Dict[str, Any]):
+        state = instance.get('state') or {}
+        config = instance.get('expanded_config') or instance.get('config') or {}
+        devices = instance.get('expanded_devices') or instance.get('devices') or {}
+        memory = state.get('memory') or {}
+        network = state.get('network') or {}
+        self.name = instance['name']
+        self.status = (state.get('status') or instance.get('status') or 'unknown').lower()
+        self.pid = state.get('pid') or 0
+        self.processes = state.get('processes') or 0
+        self.cpu_ns = (state.get('cpu') or {}).get('usage') or 0
+        self.cpu_limit = parse_cpu_limit(config.get('limits.cpu'))
+        self.memory_bytes = memory.get('usage') or 0
+        self.memory_peak_bytes = memory.get('usage_peak') or 0
+        self.memory_limit_bytes = parse_bytes(config.get('limits.memory')) or memory.get('total') or None
+        self.disk_bytes = ((state.get('disk') or {}).get('root') or {}).get('usage') or 0
+        self.disk_limit_bytes = parse_bytes((devices.get('root') or {}).get('size'))
+        counters = [iface.get('counters') or {} for name, iface in network.items() if name != 'lo']
+        self.net_rx_bytes = sum(c.get('bytes_received', 0) for c in counters)
+        self.net_tx_bytes = sum(c.get('bytes_sent', 0) for c in counters)
+
+    @property
+    def is_running(self) -> bool:
+        return self.status == 'running'
+
+class FleetSnapshot:
+    __slots__ = ('instances', 'taken_at', 'generation')
+
+    def __init__(self, instances: Dict[str, InstanceState], taken_at: float, generation: int):
+        self.instances = instances
+        self.taken_at = taken_at
+        self.generation = generation
+
+    def get(self, name: str) -> Optional[InstanceState]:
+        return self.instances.get(name)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.taken_at
+
+class FleetSnapshotCache:
+    """Serves every status/stats lookup from one /1.0/instances?recursion=2 call.
+
+    A snapshot is reused until it is older than the snapshot_ttl setting or
+    an instance has been created, deleted, renamed, started or stopped since
+    it was taken. Callers that find it
+    stale share a single in-flight request rather than each issuing their own.
+    """
+
+    def __init__(self, client: LXDClient):
+        self.client = client
+        self._snapshot: Optional[FleetSnapshot] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._inflight_generation = -1
+
+    def _is_fresh(self, snapshot: Optional[FleetSnapshot], max_age: float) -> bool:
+        return snapshot is not None and snapshot.generation == self.client.generation and snapshot.age <= max_age
+
+    async def get(self, max_age: Optional[float] = None) -> FleetSnapshot:
+        if max_age is None:
+            max_age = settings['snapshot_ttl']
+        if self._is_fresh(self._snapshot, max_age):
+            return self._snapshot
+        if self._inflight is None or self._inflight_generation != self.client.generation:
+            self._inflight_generation = self.client.generation
+            self._inflight = asyncio.ensure_future(self._fetch())
+        return await asyncio.shield(self._inflight)
+
+    async def _fetch(self) -> FleetSnapshot:
+        generation = self.client.generation
+        try:
+            instances = await self.client.list_instances(recursion=2)
+            snapshot = FleetSnapshot({i['name']: InstanceState(i) for i in instances}, time.monotonic(), generation)
+            self._snapshot = snapshot
+            return snapshot
+        finally:
+            if self._inflight is asyncio.current_task():
+                self._inflight = None
+
+    async def get_instance(self, name: str) -> Optional[InstanceState]:
+        return (await self.get()).get(name)
+
+    def invalidate(self):
+        self._snapshot = None
+
+fleet_snapshot = FleetSnapshotCache(lxd)
+
+# Host-side container metrics
+cgroup_collector = CgroupCollector(CGROUP_ROOT, PROC_ROOT, LXD_CGROUP_PATTERN)
+
+class CPUSampler:
+    """Samples cumulative CPU time for every running VPS at a fixed interval.
+
+    Utilisation is delta CPU time over delta wall-clock time, divided by the
+    container's limits.cpu, so 100% means the container is using everything
+    it is allowed. Each container keeps a rolling window of the last
+    cpu_window_samples values; readers never wait on a sample.
+    """
+
+    def __init__(self, collector: CgroupCollector, snapshots: FleetSnapshotCache):
+        self.collector = collector
+        self.snapshots = snapshots
+        self.history: Dict[str, deque] = {}
+        self._last: Dict[str, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+        settings.subscribe('cpu_window_samples', self._resize_windows)
+
+    def _resize_windows(self, key, size):
+        self.history = {name: deque(window, maxlen=size) for name, window in self.history.items()}
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sample_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"CPU sampling failed: {e}")
+            await asyncio.sleep(settings['cpu_sample_interval'])
+
+    async def sample_once(self):
+        snapshot = await self.snapshots.get(max_age=settings['cpu_sample_interval'] / 2)
+        running = set()
+        for name, state in snapshot.instances.items():
+            if not state.is_running or name not in container_index:
                 continue
-        
-        logger.info(f"Applied internal permissions to {container_name}")
-    except Exception as e:
-        logger.error(f"Failed to apply internal permissions to {container_name}: {e}")
+            running.add(name)
+            metrics = self.collector.read(name)
+            if metrics is not None:
+                self.record(name, metrics.taken_at, metrics.cpu_usage_usec, state.cpu_limit)
+            else:
+                # No host cgroup access; LXD reports the same counter in ns
+                self.record(name, snapshot.taken_at, state.cpu_ns // 1000, state.cpu_limit)
+        for name in set(self._last) - running:
+            self._last.pop(name, None)
+            self.history.pop(name, None)
 
-# Get or create VPS user role
-async def get_or_create_vps_role(guild):
-    global VPS_USER_ROLE_ID
-    if VPS_USER_ROLE_ID:
-        role = guild.get_role(VPS_USER_ROLE_ID)
-        if role:
-            return role
-    role = discord.utils.get(guild.roles, name=f"{BOT_NAME} VPS User")
-    if role:
-        VPS_USER_ROLE_ID = role.id
-        return role
-    try:
-        role = await guild.create_role(
-            name=f"{BOT_NAME} VPS User",
-            color=discord.Color.dark_purple(),
-            reason=f"{BOT_NAME} VPS User role for bot management",
-            permissions=discord.Permissions.none()
-        )
-        VPS_USER_ROLE_ID = role.id
-        logger.info(f"Created {BOT_NAME} VPS User role: {role.name} (ID: {role.id})")
-        return role
-    except Exception as e:
-        logger.error(f"Failed to create {BOT_NAME} VPS User role: {e}")
-        return None
+    def record(self, name: str, taken_at: float, usage_usec: int, cpu_limit: Optional[int]):
+        previous = self._last.get(name)
+        self._last[name] = (taken_at, usage_usec)
+        # First sample, a repeated snapshot, or a counter reset by a restart
+        if previous is None or taken_at <= previous[0] or usage_usec < previous[1]:
+            return
+        elapsed_usec = (taken_at - previous[0]) * 1_000_000
+        percent = (usage_usec - previous[1]) / elapsed_usec / (cpu_limit or 1) * 100
+        window = self.history.get(name)
+        if window is None:
+            window = self.history[name] = deque(maxlen=settings['cpu_window_samples'])
+        window.append((time.time(), percent))
+
+    def current(self, name: str) -> Optional[float]:
+        window = self.history.get(name)
+        return window[-1][1] if window else None
+
+    def average(self, name: str) -> Optional[float]:
+        window = self.history.get(name)
+        return sum(percent for _, percent in window) / len(window) if window else None
+
+    def window(self, name: str) -> List[tuple]:
+        """(unix time, percent) samples, oldest first."""
+        return list(self.history.get(name, ()))
+
+cpu_sampler = CPUSampler(cgroup_collector, fleet_snapshot)
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes = seconds // 60
+    if days:
+        return f"{days}d {hours}h {minutes}m"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
+async def read_container_metrics(container_name: str) -> tuple:
+    """(InstanceState or None, CgroupMetrics or None) for a container."""
+    state = await fleet_snapshot.get_instance(container_name)
+    if not state or not state.is_running:
+        return state, None
+    return state, cgroup_collector.read(container_name, state.pid)
 
 # Helper functions for container stats
 async def get_container_status(container_name):
     try:
-        proc = await asyncio.create_subprocess_exec(
-            "lxc", "info", container_name,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        output = stdout.decode()
-        for line in output.splitlines():
-            if line.startswith("Status: "):
-                return line.split(": ", 1)[1].strip().lower()
-        return "unknown"
+        state = await fleet_snapshot.get_instance(container_name)
+        return state.status if state else "unknown"
     except Exception:
         return "unknown"
 
 async def get_container_cpu(container_name):
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            "lxc", "exec", container_name, "--", "top", "-bn1",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        output = stdout.decode()
-        for line in output.splitlines():
-            if '%Cpu(s):' in line:
-                parts = line.split()
-                us = float(parts[1])
-                sy = float(parts[3])
-                ni = float(parts[5])
-                id_ = float(parts[7])
-                wa = float(parts[9])
-                hi = float(parts[11])
-                si = float(parts[13])
-                st = float(parts[15])
-                usage = us + sy + ni + wa + hi + si + st
-                return f"{usage:.1f}%"
-        return "0.0%"
-    except Exception:
-        return "N/A"
+    usage = cpu_sampler.current(container_name)
+    if usage is None:
+        return "Sampling..." if await get_container_status(container_name) == 'running' else "0.0%"
+    window = cpu_sampler.window(container_name)
+    span = format_duration(window[-1][0] - window[0][0]) if len(window) > 1 else None
+    if not span or span == "0m":
+        return f"{usage:.1f}%"
+    return f"{usage:.1f}% (avg {cpu_sampler.average(container_name):.1f}% over {span})"
 
 async def get_container_memory(container_name):
     try:
-        proc = await asyncio.create_subprocess_exec(
-            "lxc", "exec", container_name, "--", "free", "-m",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        lines = stdout.decode().splitlines()
-        if len(lines) > 1:
-            parts = lines[1].split()
-            total = int(parts[1])
-            used = int(parts[2])
-            usage_pct = (used / total * 100) if total > 0 else 0
-            return f"{used}/{total} MB ({usage_pct:.1f}%)"
-        return "Unknown"
+        state, metrics = await read_container_metrics(container_name)
+        if not metrics:
+            return "Unknown"
+        used = metrics.memory_bytes // 2**20
+        limit = metrics.memory_limit_bytes or state.memory_limit_bytes
+        if not limit:
+            return f"{used} MB"
+        total = limit // 2**20
+        usage_pct = (used / total * 100) if total > 0 else 0
+        return f"{used}/{total} MB ({usage_pct:.1f}%)"
     except Exception:
         return "N/A"
 
 async def get_container_disk(container_name):
+    # Filesystem usage isn't in the cgroup; LXD reports it in the snapshot
     try:
-        proc = await asyncio.create_subprocess_exec(
-            "lxc", "exec", container_name, "--", "df", "-h", "/",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        lines = stdout.decode().splitlines()
-        for line in lines:
-            if '/dev/' in line and ' /' in line:
-                parts = line.split()
-                if len(parts) >= 5:
-                    used = parts[2]
-                    size = parts[1]
-                    perc = parts[4]
-                    return f"{used}/{size} ({perc})"
-        return "Unknown"
+        state = await fleet_snapshot.get_instance(container_name)
+        if not state or not state.disk_bytes:
+            return "Unknown"
+        if not state.disk_limit_bytes:
+            return format_bytes(state.disk_bytes)
+        perc = state.disk_bytes / state.disk_limit_bytes * 100
+        return f"{format_bytes(state.disk_bytes)}/{format_bytes(state.disk_limit_bytes)} ({perc:.0f}%)"
     except Exception:
         return "N/A"
 
 async def get_container_uptime(container_name):
     try:
-        proc = await asyncio.create_subprocess_exec(
-            "lxc", "exec", container_name, "--", "uptime",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, _ = await proc.communicate()
-        return stdout.decode().strip() if stdout else "Unknown"
+        _, metrics = await read_container_metrics(container_name)
+        if not metrics or metrics.uptime_seconds is None:
+            return "Unknown"
+        return f"up {format_duration(metrics.uptime_seconds)}"
+    except Exception:
+        return "N/A"
+
+async def get_container_activity(container_name):
+    """Process count and cumulative disk I/O."""
+    try:
+        _, metrics = await read_container_metrics(container_name)
+        if not metrics:
+            return "Unknown"
+        return f"{metrics.pids} processes | I/O {format_bytes(metrics.io_read_bytes)} read / {format_bytes(metrics.io_write_bytes)} written"
     except Exception:
         return "N/A"
 
+STATS_TIMED_OUT = "⏱️ timed out"
+
+class ContainerStats:
+    """Display-ready stats for one container, as collected at taken_at."""
+
+    __slots__ = ('name', 'status', 'cpu', 'memory', 'disk', 'uptime', 'activity', 'taken_at', 'generation')
+
+    def __init__(self, name, status, cpu, memory, disk, uptime, activity, generation):
+        self.name = name
+        self.status = status
+        self.cpu = cpu
+        self.memory = memory
+        self.disk = disk
+        self.uptime = uptime
+        self.activity = activity
+        self.taken_at = time.monotonic()
+        self.generation = generation
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.taken_at
+
+    @property
+    def as_of(self) -> str:
+        age = int(self.age)
+        return "just now" if age < 1 else f"as of {age}s ago"
+
+    @property
+    def complete(self) -> bool:
+        return STATS_TIMED_OUT not in (self.status, self.cpu, self.memory, self.disk, self.uptime, self.activity)
+
+    @classmethod
+    def placeholder(cls, container_name: str, text: str = STATS_TIMED_OUT) -> "ContainerStats":
+        return cls(container_name, text, text, text, text, text, text, -1)
+
+STATS_FIELDS = (get_container_status, get_container_cpu, get_container_memory, get_container_disk,
+                get_container_uptime, get_container_activity)
+
+# Bounds stats collection across every view and user; rebuilt when the setting changes
+_stats_semaphore: Optional[asyncio.Semaphore] = None
+
+def _stats_limiter() -> asyncio.Semaphore:
+    global _stats_semaphore
+    if _stats_semaphore is None:
+        _stats_semaphore = asyncio.Semaphore(settings['stats_concurrency'])
+    return _stats_semaphore
+
+def _reset_stats_limiter(key, value):
+    global _stats_semaphore
+    _stats_semaphore = None
+
+settings.subscribe('stats_concurrency', _reset_stats_limiter)
+
+async def _stats_field(coro, timeout: float) -> str:
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        return STATS_TIMED_OUT
+
+async def collect_container_stats(container_name: str) -> ContainerStats:
+    generation = lxd.generation
+    timeout = settings['stats_deadline']
+    async with _stats_limiter():
+        results = await asyncio.gather(*(_stats_field(field(container_name), timeout) for field in STATS_FIELDS))
+    return ContainerStats(container_name, *results, generation)
+
+class MetricsCache:
+    """Per-container stats cache with single-flight refresh.
+
+    Entries are served while younger than the metrics_ttl setting; a change
+    to the container drops its entry, and a fleet-wide change (see
+    LXDClient.generation) drops them all. Concurrent misses for
+    the same container share one collection. A background task re-collects
+    every container viewed within metrics_hot_seconds, so interactive views
+    are normally answered from memory.
+    """
+
+    def __init__(self, collect: Callable):
+        self.collect = collect
+        self._entries: Dict[str, ContainerStats] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._last_access: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _is_fresh(self, entry: Optional[ContainerStats], max_age: float) -> bool:
+        return (entry is not None and entry.complete and entry.generation == lxd.generation
+                and entry.age <= max_age)
+
+    async def get(self, container_name: str, max_age: Optional[float] = None) -> ContainerStats:
+        self._last_access[container_name] = time.monotonic()
+        entry = self._entries.get(container_name)
+        if self._is_fresh(entry, settings['metrics_ttl'] if max_age is None else max_age):
+            return entry
+        return await self.refresh(container_name)
+
+    async def refresh(self, container_name: str) -> ContainerStats:
+        future = self._inflight.get(container_name)
+        if future is None:
+            future = self._inflight[container_name] = asyncio.ensure_future(self._collect(container_name))
+            future.add_done_callback(lambda _: self._inflight.pop(container_name, None))
+        return await asyncio.shield(future)
+
+    async def _collect(self, container_name: str) -> ContainerStats:
+        stats = await self.collect(container_name)
+        self._entries[container_name] = stats
+        return stats
+
+    def invalidate(self, container_name: Optional[str] = None):
+        if container_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(container_name, None)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings['metrics_ttl'])
+            try:
+                await self.refresh_hot()
+            except Exception as e:
+                logger.warning(f"Metrics refresh failed: {e}")
+
+    async def refresh_hot(self):
+        cutoff = time.monotonic() - settings['metrics_hot_seconds']
+        for name in [name for name, seen in self._last_access.items() if seen < cutoff]:
+            self._last_access.pop(name, None)
+            self._entries.pop(name, None)
+        hot = [name for name in self._last_access if name in container_index]
+        await asyncio.gather(*(self.refresh(name) for name in hot), return_exceptions=True)
+
+metrics_cache = MetricsCache(collect_container_stats)
+lxd.subscribe(metrics_cache.invalidate)
+
+async def gather_container_stats(container_names: List[str], deadline: Optional[float] = None) -> Dict[str, ContainerStats]:
+    """Stats for many containers at once, never waiting past the deadline.
+
+    Containers still pending at the deadline get a timed-out placeholder; their
+    collection keeps running and lands in the cache for the next view.
+    """
+    deadline = settings['stats_deadline'] if deadline is None else deadline
+    tasks = {name: asyncio.ensure_future(metrics_cache.get(name)) for name in dict.fromkeys(container_names)}
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=deadline)
+    results = {}
+    for name, task in tasks.items():
+        if not task.done():
+            task.cancel()
+            results[name] = ContainerStats.placeholder(name)
+        elif task.exception() is not None:
+            logger.warning(f"Stats collection for {name} failed: {task.exception()}")
+            results[name] = ContainerStats.placeholder(name, "N/A")
+        else:
+            results[name] = task.result()
+    return results
+
+async def get_container_stats(container_name: str) -> ContainerStats:
+    return (await gather_container_stats([container_name]))[container_name]
+
+# Usage history
+# Label and formatter for each of usage_history.METRICS
+HISTORY_METRICS = {
+    'cpu': ("CPU", lambda v: f"{v:.1f}%"),
+    'memory': ("Memory", lambda v: format_bytes(int(v))),
+    'disk': ("Disk", lambda v: format_bytes(int(v))),
+    'net_rx': ("Net In", lambda v: f"{format_bytes(int(v))}/s"),
+    'net_tx': ("Net Out", lambda v: f"{format_bytes(int(v))}/s"),
+    'pids': ("Processes", lambda v: f"{v:.0f}"),
+}
+
+def parse_duration(text: str) -> Optional[int]:
+    """'90s', '30m', '6h' or '7d' as seconds; None if unparseable."""
+    match = re.fullmatch(r'(\d+)\s*([smhd])', text.strip().lower())
+    if not match:
+        return None
+    return int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+usage_history = UsageHistory(fleet_snapshot, cpu_sampler, cgroup_collector, adb, container_index)
+
+async def format_usage_history(container_name: str, window: int) -> str:
+    try:
+        summary = await usage_history.summary(container_name, window)
+    except Exception as e:
+        logger.warning(f"Usage history query for {container_name} failed: {e}")
+        return "N/A"
+    if not summary:
+        return "No history recorded yet."
+    lines = ["min / avg / p95 / max"]
+    for metric, (label, fmt) in HISTORY_METRICS.items():
+        if metric in summary:
+            usage = summary[metric]
+            lines.append(f"**{label}:** {fmt(usage.min)} / {fmt(usage.avg)} / {fmt(usage.p95)} / {fmt(usage.max)}")
+    return "\n".join(lines)
+
+# Resource monitoring
+class ResourceMonitor:
+    """Suspends VPS that stay over the CPU/RAM thresholds.
+
+    Each scan covers the whole fleet from one snapshot request, the CPU
+    sampler's latest values and host cgroup memory readings, so its cost
+    does not grow in LXD calls or guest execs with the number of VPS. A VPS
+    must be over a threshold on monitor_strikes consecutive scans before it
+    is stopped (or frozen); whitelisted and already suspended VPS are skipped.
+    """
+
+    def __init__(self, snapshots: FleetSnapshotCache, sampler: CPUSampler, collector: CgroupCollector):
+        self.snapshots = snapshots
+        self.sampler = sampler
+        self.collector = collector
+        self.strikes: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings['monitor_interval'])
+            if not settings['monitor_enabled']:
+                self.strikes.clear()
+                continue
+            try:
+                await self.scan()
+            except Exception as e:
+                logger.error(f"Resource monitor scan failed: {e}")
+
+    def _memory_percent(self, name: str, state: InstanceState) -> Optional[float]:
+        metrics = self.collector.read(name, state.pid)
+        used = metrics.memory_bytes if metrics else state.memory_bytes
+        limit = (metrics.memory_limit_bytes if metrics else None) or state.memory_limit_bytes
+        return used / limit * 100 if limit else None
+
+    async def scan(self) -> List[tuple]:
+        """Check every running VPS once; returns the (owner_id, record, reason) suspended."""
+        snapshot = await self.snapshots.get(max_age=settings['monitor_interval'] / 2)
+        cpu_limit, ram_limit = settings['cpu_threshold'], settings['ram_threshold']
+        offenders = []
+        checked = set()
+        for name, state in snapshot.instances.items():
+            found = find_vps(name)
+            if not found or not state.is_running:
+                continue
+            owner_id, vps = found
+            if vps.whitelisted or vps.suspended:
+                continue
+            checked.add(name)
+            reasons = []
+            cpu = self.sampler.current(name)
+            if cpu is not None and cpu > cpu_limit:
+                reasons.append(f"CPU {cpu:.1f}% > {cpu_limit}%")
+            ram = self._memory_percent(name, state)
+            if ram is not None and ram > ram_limit:
+                reasons.append(f"RAM {ram:.1f}% > {ram_limit}%")
+            if not reasons:
+                self.strikes.pop(name, None)
+                continue
+            self.strikes[name] = self.strikes.get(name, 0) + 1
+            if self.strikes[name] >= settings['monitor_strikes']:
+                offenders.append((owner_id, vps, ", ".join(reasons)))
+        for name in set(self.strikes) - checked:
+            self.strikes.pop(name, None)
+        
+        suspended = []
+        for owner_id, vps, reason in offenders:
+            if await self.suspend(owner_id, vps, reason):
+                suspended.append((owner_id, vps, reason))
+        return suspended
+
+    async def suspend(self, owner_id: str, vps: VPSRecord, reason: str) -> bool:
+        name = vps.container_name
+        action = settings['monitor_action']
+        try:
+            if action == 'freeze':
+                await lxd.set_state(name, 'freeze')
+                vps.status = VPSStatus.FROZEN
+            else:
+                await lxd.stop_instance(name, force=True)
+                vps.status = VPSStatus.STOPPED
+        except Exception as e:
+            logger.error(f"Auto-suspend of {name} failed: {e}")
+            return False
+        self.strikes.pop(name, None)
+        vps.suspended = True
+        await save_vps_data()
+        await record_suspension_event(vps, 'suspended', f"Auto-suspended: {reason}")
+        logger.warning(f"Auto-suspended {name} ({action}): {reason}")
+        
+        try:
+            owner = await bot.fetch_user(int(owner_id))
+            embed = create_warning_embed("⚠️ VPS Suspended",
+                f"Your VPS `{name}` was {'frozen' if action == 'freeze' else 'stopped'} for sustained high resource usage.")
+            add_field(embed, "Reason", reason, False)
+            add_field(embed, "Next Steps", "Contact an admin to have it unsuspended.", False)
+            await owner.send(embed=embed)
+        except Exception as e:
+            logger.warning(f"Could not notify {owner_id} about suspension of {name}: {e}")
+        return True
+
+resource_monitor = ResourceMonitor(fleet_snapshot, cpu_sampler, cgroup_collector)
+
+# LXD lifecycle events
+LIFECYCLE_STATUS = {
+    'instance-started': VPSStatus.RUNNING,
+    'instance-restarted': VPSStatus.RUNNING,
+    'instance-resumed': VPSStatus.RUNNING,
+    'instance-stopped': VPSStatus.STOPPED,
+    'instance-shutdown': VPSStatus.STOPPED,
+    'instance-paused': VPSStatus.FROZEN,
+}
+# Actions after which a cached view of the whole fleet is out of date
+FLEET_EVENTS = {'instance-created', 'instance-deleted', 'instance-renamed', *LIFECYCLE_STATUS}
+
+class LXDEventListener:
+    """Keeps VPS status current from LXD's lifecycle event stream.
+
+    Catches changes the bot did not make itself: poweroff inside a guest,
+    host reboots, or the lxc CLI. After every (re)connect the whole fleet is
+    resynced from a fresh snapshot, since events sent while disconnected are
+    gone. A dropped stream is retried with exponential backoff.
+    """
+
+    BACKOFF_MIN = 1
+    BACKOFF_MAX = 60
+
+    def __init__(self, client: LXDClient, snapshots: FleetSnapshotCache):
+        self.client = client
+        self.snapshots = snapshots
+        self.connected = False
+        self._delay = self.BACKOFF_MIN
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                async for event in self.client.events('lifecycle', on_connect=self.resync):
+                    await self.handle(event)
+                logger.warning("LXD event stream closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"LXD event stream lost: {e}")
+            self.connected = False
+            logger.info(f"Reconnecting to LXD events in {self._delay}s")
+            await asyncio.sleep(self._delay)
+            self._delay = min(self._delay * 2, self.BACKOFF_MAX)
+
+    async def resync(self):
+        """Apply a fresh snapshot to every record; returns how many changed."""
+        self.connected = True
+        self._delay = self.BACKOFF_MIN
+        # Anything may have changed while the stream was down
+        self.client.generation += 1
+        snapshot = await self.snapshots.get(max_age=0)
+        changed = 0
+        for name, (_, vps) in list(container_index.items()):
+            state = snapshot.get(name)
+            if state is not None and self._set_status(vps, VPSStatus.parse(state.status)):
+                changed += 1
+        if changed:
+            await save_vps_data()
+        logger.info(f"Subscribed to LXD events; resynced {changed} VPS status(es)")
+        return changed
+
+    def _set_status(self, vps: VPSRecord, status: VPSStatus) -> bool:
+        if vps.status is status:
+            return False
+        logger.info(f"{vps.container_name}: status {vps.status} -> {status}")
+        vps.status = status
+        metrics_cache.invalidate(vps.container_name)
+        return True
+
+    async def handle(self, event: Dict[str, Any]):
+        metadata = event.get('metadata') or {}
+        action = metadata.get('action') or ''
+        if event.get('type') != 'lifecycle' or not action.startswith('instance-'):
+            return
+        name = (metadata.get('source') or '').split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        if action in FLEET_EVENTS:
+            self.client.generation += 1
+        else:
+            metrics_cache.invalidate(name)
+        found = find_vps(name)
+        status = LIFECYCLE_STATUS.get(action)
+        if found and status is not None and self._set_status(found[1], status):
+            await save_vps_data()
+
+lxd_events = LXDEventListener(lxd, fleet_snapshot)
+
+# Reconciliation between vps.db and LXD
+MANAGED_CONTAINER_PATTERN = re.compile(rf'{re.escape(BOT_NAME.lower())}-\d+-\d+')
+
+async def forget_vps(owner_id: str, vps: VPSRecord):
+    """Drop a record whose container no longer exists from memory, the stats cache and vps.db."""
+    remove_vps(owner_id, vps)
+    metrics_cache.invalidate(vps.container_name)
+    await delete_vps_record(vps)
+
+reconciler = Reconciler(lxd, adb, container_index, provisioning, port_allocator, MANAGED_CONTAINER_PATTERN,
+                        forget_vps, save_vps_data)
+
 def get_uptime():
     try:
         result = subprocess.run(['uptime'], capture_output=True, text=True)
@@ -631,6 +2513,15 @@ def get_uptime():
 async def on_ready():
     logger.info(f'{bot.user} has connected to Discord!')
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name=f"{BOT_NAME} VPS Manager"))
+    profile_manager.start()
+    image_manager.start()
+    warm_pool.start()
+    lxd_events.start()
+    cpu_sampler.start()
+    metrics_cache.start()
+    usage_history.start()
+    resource_monitor.start()
+    reconciler.start(settings['reconcile_on_startup'])
     logger.info(f"{BOT_NAME} Bot is ready! Created by Wanny_Dragon • 6/01/2026")
 
 @bot.event
@@ -660,8 +2551,8 @@ async def about_command(ctx):
     bot_info += f"**Created:** 6/01/2026\n"
     bot_info += f"**Prefix:** `{PREFIX}`\n"
     bot_info += f"**Server IP:** `{YOUR_SERVER_IP if YOUR_SERVER_IP else 'Not Set'}`\n"
-    bot_info += f"**Total Users:** {len(vps_data)}\n"
-    bot_info += f"**Total VPS:** {sum(len(v) for v in vps_data.values())}"
+    bot_info += f"**Total Users:** {fleet_stats.owner_count}\n"
+    bot_info += f"**Total VPS:** {fleet_stats.fleet.total}"
     
     add_field(embed, "📊 Bot Information", bot_info, False)
     
@@ -682,6 +2573,105 @@ async def about_command(ctx):
     
     await ctx.send(embed=embed)
 
+@bot.command(name='fleet-check')
+@is_admin()
+async def fleet_check(ctx):
+    """Verify the cached fleet totals against the VPS records (Admin only)"""
+    problems = fleet_stats.verify(vps_data)
+    if not problems:
+        totals = fleet_stats.fleet
+        await ctx.send(embed=create_success_embed("Fleet Totals Consistent",
+            f"**Owners:** {fleet_stats.owner_count}\n**VPS:** {totals.total}\n**Running:** {totals.running}\n"
+            f"**Suspended:** {totals.suspended}\n**RAM:** {totals.ram_gb}GB | **CPU:** {totals.cpu} | **Storage:** {totals.storage_gb}GB"))
+        return
+    
+    logger.warning(f"Fleet totals drifted: {problems}")
+    fleet_stats.rebuild(vps_data)
+    embed = create_warning_embed("Fleet Totals Rebuilt", f"Found {len(problems)} mismatch(es); totals have been recounted.")
+    add_field(embed, "Mismatches", "\n".join(problems[:15])[:1024], False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='reconcile')
+@is_admin()
+async def reconcile(ctx, mode: str = None):
+    """Compare vps.db with LXD and optionally repair drift (Admin only)"""
+    if mode not in (None, 'fix'):
+        await ctx.send(embed=create_error_embed("Usage", f"`{PREFIX}reconcile` to report, `{PREFIX}reconcile fix` to repair."))
+        return
+    if mode == 'fix' and str(ctx.author.id) != str(MAIN_ADMIN_ID):
+        await ctx.send(embed=create_error_embed("Access Denied", "Only the main admin can repair drift; other admins can run the report."))
+        return
+    
+    try:
+        report = await reconciler.run(fix=mode == 'fix')
+    except Exception as e:
+        await ctx.send(embed=create_error_embed("Reconciliation Failed", str(e)))
+        return
+    
+    if report.is_clean:
+        await ctx.send(embed=create_success_embed("No Drift", "vps.db, LXD instances and proxy devices agree."))
+        return
+    
+    title = "Drift Repaired" if report.fixed else "Drift Found"
+    embed = create_warning_embed(title, f"Found {report.count} problem(s)." + ("" if report.fixed else f" Run `{PREFIX}reconcile fix` to repair."))
+    for label, lines in report.sections():
+        add_field(embed, label, "\n".join(lines[:15])[:1024], False)
+    if report.errors:
+        add_field(embed, "❌ Repair Errors", "\n".join(report.errors[:10])[:1024], False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='images')
+@is_admin()
+async def images_command(ctx, action: str = None):
+    """Show the local OS image cache, or refresh it now (Admin only)"""
+    if action not in (None, 'refresh'):
+        await ctx.send(embed=create_error_embed("Usage", f"`{PREFIX}images` to show, `{PREFIX}images refresh` to refresh."))
+        return
+    
+    try:
+        if action == 'refresh':
+            await ctx.send(embed=create_info_embed("Refreshing Images", f"Checking {len(image_manager.images)} images for updates..."))
+            await image_manager.refresh_all()
+        elif not image_manager.loaded:
+            await image_manager.load()
+    except Exception as e:
+        await ctx.send(embed=create_error_embed("Image Cache Failed", str(e)))
+        return
+    
+    embed = create_info_embed("💿 Image Cache", f"Refreshed every {format_duration(settings['image_refresh_interval'])}")
+    for image in image_manager.images.values():
+        if image.fingerprint:
+            text = f"**Alias:** `{image.alias}`\n**Image:** `{image.fingerprint[:12]}`"
+            if image.size:
+                text += f" ({format_bytes(image.size)})"
+            if image.refreshed_at:
+                text += f"\n**Checked:** {format_duration(time.time() - image.refreshed_at)} ago"
+        else:
+            text = "❌ Not cached"
+        if image.error:
+            text += f"\n**Last Error:** {truncate_text(image.error, 200)}"
+        add_field(embed, image.os_version, text, True)
+    await ctx.send(embed=embed)
+
+@bot.command(name='warm-pool')
+@is_admin()
+async def warm_pool_command(ctx):
+    """Show warm pool spares and hit/miss counts (Admin only)"""
+    hits, misses = sum(warm_pool.hits.values()), sum(warm_pool.misses.values())
+    rate = f"{hits / (hits + misses) * 100:.0f}%" if hits + misses else "N/A"
+    free = f"{warm_pool.free_disk_percent:.0f}%" if warm_pool.free_disk_percent is not None else "Unknown"
+    embed = create_info_embed("🔥 Warm Pool",
+        f"**Target:** {settings['warm_pool_size']} per OS (max {settings['warm_pool_max_spares']}) | **Concurrency:** {settings['warm_pool_concurrency']}\n"
+        f"**Hit Rate:** {rate} ({hits} hits / {misses} misses)\n"
+        f"**Storage Free:** {free} (min {settings['warm_pool_min_free_disk']:g}%)")
+    for os_version in warm_pool.os_versions:
+        text = f"**Ready:** {len(warm_pool.ready[os_version])}"
+        if warm_pool.filling[os_version]:
+            text += f" (+{warm_pool.filling[os_version]} building)"
+        text += f"\n**Hits:** {warm_pool.hits[os_version]} | **Misses:** {warm_pool.misses[os_version]}"
+        add_field(embed, os_version, text, True)
+    await ctx.send(embed=embed)
+
 @bot.command(name='userperms')
 @is_admin()
 async def user_perms(ctx, user: discord.Member = None):
@@ -733,39 +2723,31 @@ async def user_perms(ctx, user: discord.Member = None):
     
     # VPS Information
     vps_list = vps_data.get(user_id, [])
-    vps_count = len(vps_list)
+    totals = fleet_stats.owner(user_id)
+    vps_count = totals.total
     
     vps_info = f"**Total VPS:** {vps_count}\n"
     if vps_count > 0:
-        running = sum(1 for v in vps_list if v.get('status') == 'running')
-        suspended = sum(1 for v in vps_list if v.get('suspended', False))
-        whitelisted = sum(1 for v in vps_list if v.get('whitelisted', False))
-        
-        vps_info += f"**Running:** {running}\n"
-        vps_info += f"**Suspended:** {suspended}\n"
-        vps_info += f"**Whitelisted:** {whitelisted}\n"
-        
-        # Calculate total resources
-        total_ram = sum(int(v['ram'].replace('GB', '')) for v in vps_list)
-        total_cpu = sum(int(v['cpu']) for v in vps_list)
-        total_storage = sum(int(v['storage'].replace('GB', '')) for v in vps_list)
+        vps_info += f"**Running:** {totals.running}\n"
+        vps_info += f"**Suspended:** {totals.suspended}\n"
+        vps_info += f"**Whitelisted:** {totals.whitelisted}\n"
         
         vps_info += f"\n**Total Resources:**\n"
-        vps_info += f"• RAM: {total_ram}GB\n"
-        vps_info += f"• CPU: {total_cpu} cores\n"
-        vps_info += f"• Storage: {total_storage}GB"
+        vps_info += f"• RAM: {totals.ram_gb}GB\n"
+        vps_info += f"• CPU: {totals.cpu} cores\n"
+        vps_info += f"• Storage: {totals.storage_gb}GB"
     
     add_field(embed, "🖥️ VPS Overview", vps_info, False)
     
     # Stats
-    stats = get_user_stats(user_id)
+    stats = await get_user_stats(user_id)
     stats_text = f"**Invites:** {stats['invites']}\n"
     stats_text += f"**Boosts:** {stats['boosts']}\n"
     stats_text += f"**Claimed Free VPS:** {stats['claimed_free_vps']}\n"
     
     # Port allocation
-    port_alloc = get_user_allocation(user_id)
-    port_used = get_user_used_ports(user_id)
+    port_alloc = await get_user_allocation(user_id)
+    port_used = await get_user_used_ports(user_id)
     stats_text += f"\n**Port Forwarding:**\n"
     stats_text += f"• Allocated: {port_alloc} slots\n"
     stats_text += f"• Used: {port_used} slots\n"
@@ -775,9 +2757,9 @@ async def user_perms(ctx, user: discord.Member = None):
     
     # Last VPS if any
     if vps_count > 0:
-        latest_vps = max(vps_list, key=lambda x: x.get('created_at', ''))
-        created = datetime.fromisoformat(latest_vps['created_at']).strftime('%Y-%m-%d %H:%M') if latest_vps.get('created_at') else 'Unknown'
-        add_field(embed, "🆕 Latest VPS", f"**Name:** `{latest_vps['container_name']}`\n**Created:** {created}\n**Config:** {latest_vps.get('config', 'Custom')}", False)
+        latest_vps = max(vps_list, key=lambda x: x.created_at)
+        created = datetime.fromisoformat(latest_vps.created_at).strftime('%Y-%m-%d %H:%M') if latest_vps.created_at else 'Unknown'
+        add_field(embed, "🆕 Latest VPS", f"**Name:** `{latest_vps.container_name}`\n**Created:** {created}\n**Config:** {latest_vps.config}", False)
     
     await ctx.send(embed=embed)
 
@@ -927,12 +2909,13 @@ class HelpView(discord.ui.View):
                 (f"{PREFIX}manage @user", "Manage another user's VPS (Admin only)"),
                 (f"{PREFIX}share-user @user <vps>", "Share VPS access"),
                 (f"{PREFIX}share-ruser @user <vps>", "Revoke VPS access"),
-                (f"{PREFIX}manage-shared @owner <vps>", "Manage shared VPS")
+                (f"{PREFIX}manage-shared @owner <vps>", "Manage shared VPS"),
+                (f"{PREFIX}shared-with-me", "List VPS shared with you")
             ],
             "vps": [
                 (f"{PREFIX}myvps", "List your VPS"),
                 (f"{PREFIX}list", "Detailed VPS info"),
-                (f"{PREFIX}vpsinfo [container]", "Get VPS details"),
+                (f"{PREFIX}vpsinfo [container] [window]", "Get VPS details and usage history"),
                 (f"{PREFIX}manage", "Manage VPS (Start/Stop/SSH/Reinstall)"),
                 (f"{PREFIX}restart-vps <container>", "Restart VPS (Admin)"),
                 (f"{PREFIX}stop-vps-all", "Stop all VPS (Admin)")
@@ -958,6 +2941,11 @@ class HelpView(discord.ui.View):
                 (f"{PREFIX}userperms @user", "Detailed user permissions"),
                 (f"{PREFIX}serverstats", "Server statistics"),
                 (f"{PREFIX}list-all", "List all VPS on server"),
+                (f"{PREFIX}fleet-check", "Verify cached fleet totals"),
+                (f"{PREFIX}whitelist-vps <container> [on|off]", "Exempt VPS from auto-suspension"),
+                (f"{PREFIX}reconcile [fix]", "Check DB against LXD, optionally repair"),
+                (f"{PREFIX}images [refresh]", "Show or refresh the local OS image cache"),
+                (f"{PREFIX}warm-pool", "Show spare containers and pool hit rate"),
                 (f"{PREFIX}add-resources <container> [ram] [cpu] [disk]", "Add resources to VPS"),
                 (f"{PREFIX}invadd @user <amount>", "Add invites to user"),
                 (f"{PREFIX}boostadd @user <amount>", "Add boosts to user")
@@ -967,7 +2955,8 @@ class HelpView(discord.ui.View):
                 (f"{PREFIX}admin-remove @user", "Revoke admin privileges"),
                 (f"{PREFIX}admin-list", "List all admins"),
                 (f"{PREFIX}set-threshold <cpu> <ram>", "Set resource thresholds"),
-                (f"{PREFIX}set-status <type> <name>", "Set bot status")
+                (f"{PREFIX}set-status <type> <name>", "Set bot status"),
+                (f"{PREFIX}settings [key] [value]", "View or change bot settings")
             ],
             "info": [
                 (f"{PREFIX}about", "Bot information and credits"),
@@ -991,7 +2980,7 @@ class HelpView(discord.ui.View):
             if self.permission_level >= cat_info["permission"]:
                 # Count commands in this category
                 if cat_id == "user":
-                    total += 9
+                    total += 10
                 elif cat_id == "vps":
                     total += 7
                 elif cat_id == "ports":
@@ -999,9 +2988,9 @@ class HelpView(discord.ui.View):
                 elif cat_id == "free":
                     total += 4
                 elif cat_id == "admin":
-                    total += 9
+                    total += 14
                 elif cat_id == "main_admin":
-                    total += 5
+                    total += 6
                 elif cat_id == "info":
                     total += 6
         return total
@@ -1043,18 +3032,18 @@ async def my_vps(ctx):
     embed = create_info_embed("My VPS", f"You have {len(vps_list)} VPS")
     
     for i, vps in enumerate(vps_list, 1):
-        status = vps.get('status', 'unknown').upper()
-        if vps.get('suspended', False):
+        status = vps.status.value.upper()
+        if vps.suspended:
             status += " (SUSPENDED)"
-        if vps.get('whitelisted', False):
+        if vps.whitelisted:
             status += " (WHITELISTED)"
         
-        status_emoji = "🟢" if vps.get('status') == 'running' else "🔴" if vps.get('status') == 'stopped' else "🟡"
+        status_emoji = "🟢" if vps.is_running else "🔴" if vps.status is VPSStatus.STOPPED else "🟡"
         
-        vps_info = f"{status_emoji} **VPS #{i}:** `{vps['container_name']}`\n"
+        vps_info = f"{status_emoji} **VPS #{i}:** `{vps.container_name}`\n"
         vps_info += f"• **Status:** {status}\n"
-        vps_info += f"• **Resources:** {vps.get('config', 'Custom')}\n"
-        vps_info += f"• **Created:** {vps.get('created_at', 'Unknown')[:10]}\n"
+        vps_info += f"• **Resources:** {vps.config}\n"
+        vps_info += f"• **Created:** {vps.created_at[:10]}\n"
         
         add_field(embed, f"", vps_info, False)
     
@@ -1074,33 +3063,32 @@ async def list_user_vps(ctx):
     
     embed = create_info_embed("📋 Your VPS List", f"Showing {len(vps_list)} VPS for {ctx.author.mention}")
     
+    # Fetch every container's stats concurrently
+    all_stats = await gather_container_stats([vps.container_name for vps in vps_list])
+    
     for i, vps in enumerate(vps_list, 1):
-        container_name = vps['container_name']
+        container_name = vps.container_name
         
-        # Get live stats
-        status = await get_container_status(container_name)
-        cpu_usage = await get_container_cpu(container_name)
-        memory_usage = await get_container_memory(container_name)
-        disk_usage = await get_container_disk(container_name)
-        uptime_info = await get_container_uptime(container_name)
+        stats = all_stats[container_name]
+        status = stats.status
         
         # Status emoji
         status_emoji = "🟢" if status == 'running' else "🔴" if status == 'stopped' else "🟡"
-        suspended_text = " (SUSPENDED)" if vps.get('suspended', False) else ""
-        whitelisted_text = " (WHITELISTED)" if vps.get('whitelisted', False) else ""
+        suspended_text = " (SUSPENDED)" if vps.suspended else ""
+        whitelisted_text = " (WHITELISTED)" if vps.whitelisted else ""
         
         vps_info = f"**#{i} | {status_emoji} {status.upper()}{suspended_text}{whitelisted_text}**\n"
         vps_info += f"**Container:** `{container_name}`\n"
-        vps_info += f"**Resources:** {vps['ram']} RAM | {vps['cpu']} CPU | {vps['storage']} Storage\n"
-        vps_info += f"**OS:** {vps.get('os_version', 'ubuntu:22.04')}\n"
-        vps_info += f"**Uptime:** {uptime_info}\n"
-        vps_info += f"**CPU Usage:** {cpu_usage}\n"
-        vps_info += f"**Memory:** {memory_usage}\n"
-        vps_info += f"**Disk:** {disk_usage}\n"
-        vps_info += f"**Created:** {vps.get('created_at', 'Unknown')}\n"
-        
-        if vps.get('shared_with'):
-            shared_count = len(vps['shared_with'])
+        vps_info += f"**Resources:** {format_size(vps.ram_mb)} RAM | {vps.cpu} CPU | {vps.storage_gb}GB Storage\n"
+        vps_info += f"**OS:** {vps.os_version}\n"
+        vps_info += f"**Uptime:** {stats.uptime}\n"
+        vps_info += f"**CPU Usage:** {stats.cpu}\n"
+        vps_info += f"**Memory:** {stats.memory}\n"
+        vps_info += f"**Disk:** {stats.disk} ({stats.as_of})\n"
+        vps_info += f"**Created:** {vps.created_at}\n"
+        
+        if vps.shared_with:
+            shared_count = len(vps.shared_with)
             vps_info += f"**Shared with:** {shared_count} user(s)\n"
         
         add_field(embed, f"VPS #{i}", vps_info, False)
@@ -1143,7 +3131,7 @@ async def show_plans(ctx):
 async def claim_free_vps(ctx):
     """Claim a free VPS based on invites/boosts"""
     user_id = str(ctx.author.id)
-    stats = get_user_stats(user_id)
+    stats = await get_user_stats(user_id)
     
     # Check which plans user qualifies for
     available_plans = []
@@ -1199,7 +3187,7 @@ class ClaimFreeView(discord.ui.View):
             return
         
         # Check if user already claimed a free VPS
-        stats = get_user_stats(str(self.ctx.author.id))
+        stats = await get_user_stats(str(self.ctx.author.id))
         if stats['claimed_free_vps'] > 0:
             await interaction.response.send_message(
                 embed=create_error_embed("Already Claimed", "You have already claimed a free VPS!"),
@@ -1232,8 +3220,8 @@ async def add_invites(ctx, user: discord.Member, amount: int):
         await ctx.send(embed=create_error_embed("Invalid Amount", "Amount must be positive."))
         return
     
-    update_user_stats(str(user.id), invites=amount)
-    stats = get_user_stats(str(user.id))
+    await update_user_stats(str(user.id), invites=amount)
+    stats = await get_user_stats(str(user.id))
     
     embed = create_success_embed("Invites Added", f"Added {amount} invites to {user.mention}")
     add_field(embed, "Current Stats", f"**Total Invites:** {stats['invites']}\n**Boosts:** {stats['boosts']}", False)
@@ -1247,8 +3235,8 @@ async def add_boosts(ctx, user: discord.Member, amount: int):
         await ctx.send(embed=create_error_embed("Invalid Amount", "Amount must be positive."))
         return
     
-    update_user_stats(str(user.id), boosts=amount)
-    stats = get_user_stats(str(user.id))
+    await update_user_stats(str(user.id), boosts=amount)
+    stats = await get_user_stats(str(user.id))
     
     embed = create_success_embed("Boosts Added", f"Added {amount} boosts to {user.mention}")
     add_field(embed, "Current Stats", f"**Invites:** {stats['invites']}\n**Total Boosts:** {stats['boosts']}", False)
@@ -1282,40 +3270,16 @@ class OSSelectView(discord.ui.View):
         await interaction.response.edit_message(embed=creating_embed, view=self)
         
         user_id = str(self.user.id)
-        if user_id not in vps_data:
-            vps_data[user_id] = []
-        
-        vps_count = len(vps_data[user_id]) + 1
+        vps_count = len(get_owner_vps(user_id)) + 1
         container_name = f"{BOT_NAME.lower()}-{user_id}-{vps_count}"
         ram_mb = self.ram * 1024
         
         try:
-            await execute_lxc(f"lxc init {os_version} {container_name} -s {DEFAULT_STORAGE_POOL}")
-            await execute_lxc(f"lxc config set {container_name} limits.memory {ram_mb}MB")
-            await execute_lxc(f"lxc config set {container_name} limits.cpu {self.cpu}")
-            await execute_lxc(f"lxc config device set {container_name} root size={self.disk}GB")
-            await apply_lxc_config(container_name)
-            await execute_lxc(f"lxc start {container_name}")
-            await apply_internal_permissions(container_name)
+            await provision_instance(container_name, os_version, ram_mb, self.cpu, self.disk)
             
-            config_str = f"{self.ram}GB RAM / {self.cpu} CPU / {self.disk}GB Disk"
-            vps_info = {
-                "container_name": container_name,
-                "ram": f"{self.ram}GB",
-                "cpu": str(self.cpu),
-                "storage": f"{self.disk}GB",
-                "config": config_str,
-                "os_version": os_version,
-                "status": "running",
-                "suspended": False,
-                "whitelisted": False,
-                "suspension_history": [],
-                "created_at": datetime.now().isoformat(),
-                "shared_with": [],
-                "id": None
-            }
-            vps_data[user_id].append(vps_info)
-            save_vps_data()
+            vps_info = VPSRecord(user_id, container_name, ram_mb, self.cpu, self.disk, os_version)
+            add_vps(user_id, vps_info)
+            await save_vps_data()
             
             if self.ctx.guild:
                 vps_role = await get_or_create_vps_role(self.ctx.guild)
@@ -1339,7 +3303,7 @@ class OSSelectView(discord.ui.View):
             # Send DM to user
             try:
                 dm_embed = create_success_embed("VPS Created!", f"Your VPS has been successfully deployed by an admin!")
-                add_field(dm_embed, "VPS Details", f"**VPS ID:** #{vps_count}\n**Container Name:** `{container_name}`\n**Configuration:** {config_str}\n**Status:** Running\n**OS:** {os_version}\n**Created:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", False)
+                add_field(dm_embed, "VPS Details", f"**VPS ID:** #{vps_count}\n**Container Name:** `{container_name}`\n**Configuration:** {vps_info.config}\n**Status:** Running\n**OS:** {os_version}\n**Created:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", False)
                 add_field(dm_embed, "Management", f"• Use `{PREFIX}manage` to start/stop/reinstall your VPS\n• Use `{PREFIX}manage` → SSH for terminal access\n• Contact admin for upgrades or issues", False)
                 await self.user.send(embed=dm_embed)
             except discord.Forbidden:
@@ -1362,7 +3326,7 @@ async def create_vps(ctx, ram: int, cpu: int, disk: int, user: discord.Member):
     await ctx.send(embed=embed, view=view)
 
 class ManageView(discord.ui.View):
-    def __init__(self, user_id, vps_list, is_shared=False, owner_id=None, is_admin=False, actual_index: Optional[int] = None):
+    def __init__(self, user_id, vps_list, is_shared=False, owner_id=None, is_admin=False):
         super().__init__(timeout=300)
         self.user_id = user_id
         self.vps_list = vps_list[:]
@@ -1370,17 +3334,12 @@ class ManageView(discord.ui.View):
         self.is_shared = is_shared
         self.owner_id = owner_id or user_id
         self.is_admin = is_admin
-        self.actual_index = actual_index
-        self.indices = list(range(len(vps_list)))
-        
-        if self.is_shared and self.actual_index is None:
-            raise ValueError("actual_index required for shared views")
         
         if len(vps_list) > 1:
             options = [
                 discord.SelectOption(
-                    label=f"VPS {i+1} ({v.get('config', 'Custom')})",
-                    description=f"Status: {v.get('status', 'unknown')}",
+                    label=f"VPS {i+1} ({v.config})",
+                    description=f"Status: {v.status.value}",
                     value=str(i)
                 ) for i, v in enumerate(vps_list)
             ]
@@ -1388,7 +3347,7 @@ class ManageView(discord.ui.View):
             self.select.callback = self.select_vps
             self.add_item(self.select)
             self.initial_embed = create_embed("VPS Management", "Select a VPS from the dropdown menu below.", 0x1a1a1a)
-            add_field(self.initial_embed, "Available VPS", "\n".join([f"**VPS {i+1}:** `{v['container_name']}` - Status: `{v.get('status', 'unknown').upper()}`" for i, v in enumerate(vps_list)]), False)
+            add_field(self.initial_embed, "Available VPS", "\n".join([f"**VPS {i+1}:** `{v.container_name}` - Status: `{v.status.value.upper()}`" for i, v in enumerate(vps_list)]), False)
         else:
             self.selected_index = 0
             self.initial_embed = None
@@ -1402,19 +3361,15 @@ class ManageView(discord.ui.View):
     
     async def create_vps_embed(self, index):
         vps = self.vps_list[index]
-        status = vps.get('status', 'unknown')
-        suspended = vps.get('suspended', False)
-        whitelisted = vps.get('whitelisted', False)
+        status = vps.status.value
+        suspended = vps.suspended
+        whitelisted = vps.whitelisted
         status_color = 0x00ff88 if status == 'running' and not suspended else 0xffaa00 if suspended else 0xff3366
-        container_name = vps['container_name']
+        container_name = vps.container_name
         
-        lxc_status = await get_container_status(container_name)
-        cpu_usage = await get_container_cpu(container_name)
-        memory_usage = await get_container_memory(container_name)
-        disk_usage = await get_container_disk(container_name)
-        uptime = await get_container_uptime(container_name)
+        stats = await get_container_stats(container_name)
         
-        status_text = f"{lxc_status.upper()}"
+        status_text = f"{stats.status.upper()}"
         if suspended:
             status_text += " (SUSPENDED)"
         if whitelisted:
@@ -1434,13 +3389,13 @@ class ManageView(discord.ui.View):
             status_color
         )
         
-        resource_info = f"**Configuration:** {vps.get('config', 'Custom')}\n"
+        resource_info = f"**Configuration:** {vps.config}\n"
         resource_info += f"**Status:** `{status_text}`\n"
-        resource_info += f"**RAM:** {vps['ram']}\n"
-        resource_info += f"**CPU:** {vps['cpu']} Cores\n"
-        resource_info += f"**Storage:** {vps['storage']}\n"
-        resource_info += f"**OS:** {vps.get('os_version', 'ubuntu:22.04')}\n"
-        resource_info += f"**Uptime:** {uptime}"
+        resource_info += f"**RAM:** {format_size(vps.ram_mb)}\n"
+        resource_info += f"**CPU:** {vps.cpu} Cores\n"
+        resource_info += f"**Storage:** {vps.storage_gb}GB\n"
+        resource_info += f"**OS:** {vps.os_version}\n"
+        resource_info += f"**Uptime:** {stats.uptime}"
         
         add_field(embed, "📊 Allocated Resources", resource_info, False)
         
@@ -1449,8 +3404,8 @@ class ManageView(discord.ui.View):
         if whitelisted:
             add_field(embed, "✅ Whitelisted", "This VPS is exempt from auto-suspension.", False)
         
-        live_stats = f"**CPU Usage:** {cpu_usage}\n**Memory:** {memory_usage}\n**Disk:** {disk_usage}"
-        add_field(embed, "📈 Live Usage", live_stats, False)
+        live_stats = f"**CPU Usage:** {stats.cpu}\n**Memory:** {stats.memory}\n**Disk:** {stats.disk}"
+        add_field(embed, f"📈 Live Usage ({stats.as_of})", live_stats, False)
         add_field(embed, "🎮 Controls", "Use the buttons below to manage your VPS", False)
         
         return embed
@@ -1499,29 +3454,30 @@ class ManageView(discord.ui.View):
             await interaction.response.send_message(embed=create_error_embed("No VPS Selected", "Please select a VPS first."), ephemeral=True)
             return
         
-        actual_idx = self.actual_index if self.is_shared else self.indices[self.selected_index]
-        target_vps = vps_data[self.owner_id][actual_idx]
-        suspended = target_vps.get('suspended', False)
+        found = find_vps(self.vps_list[self.selected_index].container_name)
+        if not found:
+            await interaction.response.send_message(embed=create_error_embed("VPS Not Found", "This VPS no longer exists."), ephemeral=True)
+            return
+        target_vps = found[1]
+        suspended = target_vps.suspended
         
         if suspended and not self.is_admin and action != 'stats':
             await interaction.response.send_message(embed=create_error_embed("Access Denied", "This VPS is suspended. Contact an admin to unsuspend."), ephemeral=True)
             return
         
-        container_name = target_vps["container_name"]
+        container_name = target_vps.container_name
         
         if action == 'stats':
-            status = await get_container_status(container_name)
-            cpu_usage = await get_container_cpu(container_name)
-            memory_usage = await get_container_memory(container_name)
-            disk_usage = await get_container_disk(container_name)
-            uptime = await get_container_uptime(container_name)
+            stats = await get_container_stats(container_name)
             
-            stats_embed = create_info_embed("📈 Live Statistics", f"Real-time stats for `{container_name}`")
-            add_field(stats_embed, "Status", f"`{status.upper()}`", True)
-            add_field(stats_embed, "CPU", cpu_usage, True)
-            add_field(stats_embed, "Memory", memory_usage, True)
-            add_field(stats_embed, "Disk", disk_usage, True)
-            add_field(stats_embed, "Uptime", uptime, True)
+            stats_embed = create_info_embed("📈 Live Statistics", f"Stats for `{container_name}` ({stats.as_of})")
+            add_field(stats_embed, "Status", f"`{stats.status.upper()}`", True)
+            add_field(stats_embed, "CPU", stats.cpu, True)
+            add_field(stats_embed, "Memory", stats.memory, True)
+            add_field(stats_embed, "Disk", stats.disk, True)
+            add_field(stats_embed, "Uptime", stats.uptime, True)
+            add_field(stats_embed, "Activity", stats.activity, False)
+            add_field(stats_embed, "📉 Last Hour", await format_usage_history(container_name, 3600), False)
             
             await interaction.response.send_message(embed=stats_embed, ephemeral=True)
             return
@@ -1535,67 +3491,63 @@ class ManageView(discord.ui.View):
                 await interaction.response.send_message(embed=create_error_embed("Cannot Reinstall", "Unsuspend the VPS first."), ephemeral=True)
                 return
             
-            ram_gb = int(target_vps['ram'].replace('GB', ''))
-            cpu = int(target_vps['cpu'])
-            storage_gb = int(target_vps['storage'].replace('GB', ''))
+            ram_gb = target_vps.ram_gb
+            cpu = target_vps.cpu
+            storage_gb = target_vps.storage_gb
             
             confirm_embed = create_warning_embed("Reinstall Warning",
                 f"⚠️ **WARNING:** This will erase all data on VPS `{container_name}` and reinstall a fresh OS.\n\n"
                 f"This action cannot be undone. Continue?")
             
             class ConfirmView(discord.ui.View):
-                def __init__(self, parent_view, container_name, owner_id, actual_idx, ram_gb, cpu, storage_gb):
+                def __init__(self, parent_view, container_name, owner_id, ram_gb, cpu, storage_gb):
                     super().__init__(timeout=60)
                     self.parent_view = parent_view
                     self.container_name = container_name
                     self.owner_id = owner_id
-                    self.actual_idx = actual_idx
                     self.ram_gb = ram_gb
                     self.cpu = cpu
                     self.storage_gb = storage_gb
                 
                 @discord.ui.button(label="Confirm", style=discord.ButtonStyle.danger)
                 async def confirm(self, inter: discord.Interaction, item: discord.ui.Button):
-                    await inter.response.defer(ephemeral=True)
-                    try:
-                        await inter.followup.send(embed=create_info_embed("Deleting Container", f"Forcefully removing container `{self.container_name}`..."), ephemeral=True)
-                        await execute_lxc(f"lxc delete {self.container_name} --force")
-                        
-                        # Create reinstall OS selection view
-                        os_view = ReinstallOSSelectView(self.parent_view, self.container_name, self.owner_id, self.actual_idx, self.ram_gb, self.cpu, self.storage_gb)
-                        await inter.followup.send(embed=create_info_embed("Select OS", "Choose the new OS for reinstallation."), view=os_view, ephemeral=True)
-                    except Exception as e:
-                        await inter.followup.send(embed=create_error_embed("Delete Failed", f"Error: {str(e)}"), ephemeral=True)
+                    # Nothing is touched until an OS is picked, so letting the menu time out is harmless
+                    os_view = ReinstallOSSelectView(self.parent_view, self.container_name, self.owner_id, self.ram_gb, self.cpu, self.storage_gb)
+                    await inter.response.send_message(embed=create_info_embed("Select OS", "Choose the new OS for reinstallation."), view=os_view, ephemeral=True)
                 
                 @discord.ui.button(label="Cancel", style=discord.ButtonStyle.secondary)
                 async def cancel(self, inter: discord.Interaction, item: discord.ui.Button):
                     new_embed = await self.parent_view.create_vps_embed(self.parent_view.selected_index)
                     await inter.response.edit_message(embed=new_embed, view=self.parent_view)
             
-            await interaction.response.send_message(embed=confirm_embed, view=ConfirmView(self, container_name, self.owner_id, actual_idx, ram_gb, cpu, storage_gb), ephemeral=True)
+            await interaction.response.send_message(embed=confirm_embed, view=ConfirmView(self, container_name, self.owner_id, ram_gb, cpu, storage_gb), ephemeral=True)
             return
         
         await interaction.response.defer(ephemeral=True)
         
         if suspended:
-            target_vps['suspended'] = False
-            save_vps_data()
+            target_vps.suspended = False
+            await save_vps_data()
+            await record_suspension_event(target_vps, 'unsuspended', f"Admin {action} by {interaction.user.id}")
         
         if action == 'start':
             try:
-                await execute_lxc(f"lxc start {container_name}")
-                target_vps["status"] = "running"
-                save_vps_data()
-                await apply_internal_permissions(container_name)
+                if target_vps.status is VPSStatus.FROZEN:
+                    await lxd.set_state(container_name, 'unfreeze')
+                else:
+                    await lxd.start_instance(container_name)
+                target_vps.status = VPSStatus.RUNNING
+                await save_vps_data()
+                await initialise_guest(container_name, wait_for_network=False)
                 await interaction.followup.send(embed=create_success_embed("VPS Started", f"VPS `{container_name}` is now running!"), ephemeral=True)
             except Exception as e:
                 await interaction.followup.send(embed=create_error_embed("Start Failed", str(e)), ephemeral=True)
         
         elif action == 'stop':
             try:
-                await execute_lxc(f"lxc stop {container_name}", timeout=120)
-                target_vps["status"] = "stopped"
-                save_vps_data()
+                await lxd.stop_instance(container_name, timeout=120)
+                target_vps.status = VPSStatus.STOPPED
+                await save_vps_data()
                 await interaction.followup.send(embed=create_success_embed("VPS Stopped", f"VPS `{container_name}` has been stopped!"), ephemeral=True)
             except Exception as e:
                 await interaction.followup.send(embed=create_error_embed("Stop Failed", str(e)), ephemeral=True)
@@ -1609,31 +3561,21 @@ class ManageView(discord.ui.View):
             
             try:
                 # Check if tmate is installed
-                check_proc = await asyncio.create_subprocess_exec(
-                    "lxc", "exec", container_name, "--", "which", "tmate",
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-                stdout, stderr = await check_proc.communicate()
+                return_code, _, _ = await lxd.exec(container_name, ["which", "tmate"], check=False)
                 
-                if check_proc.returncode != 0:
+                if return_code != 0:
                     await interaction.followup.send(embed=create_info_embed("Installing SSH", "Installing tmate..."), ephemeral=True)
-                    await execute_lxc(f"lxc exec {container_name} -- apt-get update -y")
-                    await execute_lxc(f"lxc exec {container_name} -- apt-get install tmate -y")
+                    await lxd.exec(container_name, ["apt-get", "update", "-y"], timeout=600)
+                    await lxd.exec(container_name, ["apt-get", "install", "tmate", "-y"], timeout=600)
                     await interaction.followup.send(embed=create_success_embed("Installed", "SSH service installed!"), ephemeral=True)
                 
                 # Generate SSH session
                 session_name = f"{BOT_NAME.lower()}-session-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                await execute_lxc(f"lxc exec {container_name} -- tmate -S /tmp/{session_name}.sock new-session -d")
+                await lxd.exec(container_name, ["tmate", "-S", f"/tmp/{session_name}.sock", "new-session", "-d"])
                 await asyncio.sleep(3)
                 
-                ssh_proc = await asyncio.create_subprocess_exec(
-                    "lxc", "exec", container_name, "--", "tmate", "-S", f"/tmp/{session_name}.sock", "display", "-p", "#{tmate_ssh}",
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-                stdout, stderr = await ssh_proc.communicate()
-                ssh_url = stdout.decode().strip() if stdout else None
+                _, stdout, stderr = await lxd.exec(container_name, ["tmate", "-S", f"/tmp/{session_name}.sock", "display", "-p", "#{tmate_ssh}"], check=False)
+                ssh_url = stdout.strip() or None
                 
                 if ssh_url:
                     try:
@@ -1646,7 +3588,7 @@ class ManageView(discord.ui.View):
                     except discord.Forbidden:
                         await interaction.followup.send(embed=create_error_embed("DM Failed", "Enable DMs to receive SSH link!"), ephemeral=True)
                 else:
-                    error_msg = stderr.decode().strip() if stderr else "Unknown error"
+                    error_msg = stderr.strip() or "Unknown error"
                     await interaction.followup.send(embed=create_error_embed("SSH Failed", error_msg), ephemeral=True)
             
             except Exception as e:
@@ -1657,12 +3599,11 @@ class ManageView(discord.ui.View):
         await interaction.edit_original_response(embed=new_embed, view=self)
 
 class ReinstallOSSelectView(discord.ui.View):
-    def __init__(self, parent_view, container_name, owner_id, actual_idx, ram_gb, cpu, storage_gb):
+    def __init__(self, parent_view, container_name, owner_id, ram_gb, cpu, storage_gb):
         super().__init__(timeout=300)
         self.parent_view = parent_view
         self.container_name = container_name
         self.owner_id = owner_id
-        self.actual_idx = actual_idx
         self.ram_gb = ram_gb
         self.cpu = cpu
         self.storage_gb = storage_gb
@@ -1680,27 +3621,20 @@ class ReinstallOSSelectView(discord.ui.View):
         creating_embed = create_info_embed("Reinstalling VPS", f"Deploying {os_version} for `{self.container_name}`...")
         await interaction.response.edit_message(embed=creating_embed, view=self)
         
-        ram_mb = self.ram_gb * 1024
-        
         try:
-            await execute_lxc(f"lxc init {os_version} {self.container_name} -s {DEFAULT_STORAGE_POOL}")
-            await execute_lxc(f"lxc config set {self.container_name} limits.memory {ram_mb}MB")
-            await execute_lxc(f"lxc config set {self.container_name} limits.cpu {self.cpu}")
-            await execute_lxc(f"lxc config device set {self.container_name} root size={self.storage_gb}GB")
-            await apply_lxc_config(self.container_name)
-            await execute_lxc(f"lxc start {self.container_name}")
-            await apply_internal_permissions(self.container_name)
+            found = find_vps(self.container_name)
+            if not found:
+                raise LXDNotFound(f"VPS `{self.container_name}` no longer exists", 404)
+            target_vps = found[1]
+            elapsed = await reinstall_instance(self.container_name, os_version, target_vps.os_version)
             
-            target_vps = vps_data[self.owner_id][self.actual_idx]
-            target_vps["os_version"] = os_version
-            target_vps["status"] = "running"
-            target_vps["suspended"] = False
-            target_vps["created_at"] = datetime.now().isoformat()
-            config_str = f"{self.ram_gb}GB RAM / {self.cpu} CPU / {self.storage_gb}GB Disk"
-            target_vps["config"] = config_str
-            save_vps_data()
+            target_vps.os_version = os_version
+            target_vps.status = VPSStatus.RUNNING
+            target_vps.suspended = False
+            target_vps.created_at = datetime.now().isoformat()
+            await save_vps_data()
             
-            success_embed = create_success_embed("Reinstall Complete", f"VPS `{self.container_name}` has been successfully reinstalled!")
+            success_embed = create_success_embed("Reinstall Complete", f"VPS `{self.container_name}` has been reinstalled in {elapsed:.0f}s! Port forwards were kept.")
             add_field(success_embed, "Resources", f"**RAM:** {self.ram_gb}GB\n**CPU:** {self.cpu} Cores\n**Storage:** {self.storage_gb}GB", False)
             add_field(success_embed, "OS", os_version, True)
             add_field(success_embed, "Features", "Nesting, Privileged, FUSE, Kernel Modules (Docker Ready), Unprivileged Ports from 0", False)
@@ -1710,6 +3644,14 @@ class ReinstallOSSelectView(discord.ui.View):
             self.stop()
         
         except Exception as e:
+            found = find_vps(self.container_name)
+            if found:
+                try:
+                    state = await lxd.get_instance_state(self.container_name)
+                    found[1].status = VPSStatus.parse((state.get('status') or '').lower())
+                except Exception:
+                    found[1].status = VPSStatus.UNKNOWN
+                await save_vps_data()
             error_embed = create_error_embed("Reinstall Failed", f"Error: {str(e)}")
             await interaction.followup.send(embed=error_embed, ephemeral=True)
             self.stop()
@@ -1756,15 +3698,11 @@ async def share_user(ctx, shared_user: discord.Member, vps_number: int):
         return
     
     vps = vps_data[user_id][vps_number - 1]
-    if "shared_with" not in vps:
-        vps["shared_with"] = []
-    
-    if shared_user_id in vps["shared_with"]:
+    if shared_user_id in vps.shared_with:
         await ctx.send(embed=create_error_embed("Already Shared", f"{shared_user.mention} already has access to this VPS!"))
         return
     
-    vps["shared_with"].append(shared_user_id)
-    save_vps_data()
+    await share_vps(vps, shared_user_id)
     
     await ctx.send(embed=create_success_embed("VPS Shared", f"VPS #{vps_number} shared with {shared_user.mention}!"))
 
@@ -1779,15 +3717,11 @@ async def revoke_share(ctx, shared_user: discord.Member, vps_number: int):
         return
     
     vps = vps_data[user_id][vps_number - 1]
-    if "shared_with" not in vps:
-        vps["shared_with"] = []
-    
-    if shared_user_id not in vps["shared_with"]:
+    if shared_user_id not in vps.shared_with:
         await ctx.send(embed=create_error_embed("Not Shared", f"{shared_user.mention} doesn't have access to this VPS!"))
         return
     
-    vps["shared_with"].remove(shared_user_id)
-    save_vps_data()
+    await unshare_vps(vps, shared_user_id)
     
     await ctx.send(embed=create_success_embed("Access Revoked", f"Access to VPS #{vps_number} revoked from {shared_user.mention}!"))
 
@@ -1801,15 +3735,35 @@ async def manage_shared_vps(ctx, owner: discord.Member, vps_number: int):
         await ctx.send(embed=create_error_embed("Invalid VPS", "Invalid VPS number or owner doesn't have a VPS."))
         return
     
-    vps = vps_data[owner_id][vps_number - 1]
-    if user_id not in vps.get("shared_with", []):
+    shared = await get_shared_vps(user_id)
+    vps = next((v for oid, num, v in shared if oid == owner_id and num == vps_number), None)
+    if vps is None:
         await ctx.send(embed=create_error_embed("Access Denied", "You do not have access to this VPS."))
         return
     
-    view = ManageView(user_id, [vps], is_shared=True, owner_id=owner_id, actual_index=vps_number - 1)
+    view = ManageView(user_id, [vps], is_shared=True, owner_id=owner_id)
     embed = await view.get_initial_embed()
     await ctx.send(embed=embed, view=view)
 
+@bot.command(name='shared-with-me')
+async def shared_with_me(ctx):
+    """List VPS other users have shared with you"""
+    user_id = str(ctx.author.id)
+    shared = await get_shared_vps(user_id)
+    
+    if not shared:
+        await ctx.send(embed=create_info_embed("Shared VPS", "No VPS have been shared with you."))
+        return
+    
+    embed = create_info_embed("🔗 VPS Shared With You", f"You have access to {len(shared)} shared VPS")
+    lines = []
+    for owner_id, vps_number, vps in shared:
+        status_emoji = "🟢" if vps.is_running else "🔴" if vps.status is VPSStatus.STOPPED else "🟡"
+        lines.append(f"{status_emoji} <@{owner_id}> VPS #{vps_number}: `{vps.container_name}` - {vps.config}")
+    add_field(embed, "VPS", "\n".join(lines), False)
+    add_field(embed, "🔧 Management", f"Use `{PREFIX}manage-shared @owner <vps_number>` to manage a shared VPS", False)
+    await ctx.send(embed=embed)
+
 # ============ ADMIN COMMANDS ============
 
 @bot.command(name='admin-add')
@@ -1833,13 +3787,7 @@ async def admin_add(ctx, user: discord.Member):
         admin_data["admins"].append(user_id)
         
         # Save to database
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (user_id,))
-        conn.commit()
-        conn.close()
-        
-        save_admin_data()
+        await adb.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (user_id,))
         
         embed = create_success_embed("Admin Added", f"{user.mention} has been added as an admin!")
         await ctx.send(embed=embed)
@@ -1871,13 +3819,7 @@ async def admin_remove(ctx, user: discord.Member):
         admin_data["admins"].remove(user_id)
         
         # Remove from database
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute('DELETE FROM admins WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
-        
-        save_admin_data()
+        await adb.execute('DELETE FROM admins WHERE user_id = ?', (user_id,))
         
         embed = create_success_embed("Admin Removed", f"{user.mention} has been removed as an admin!")
         await ctx.send(embed=embed)
@@ -1925,17 +3867,7 @@ async def admin_list(ctx):
 async def server_stats(ctx):
     """Show server statistics (Admin only)"""
     try:
-        # Get container count
-        total_containers = sum(len(v) for v in vps_data.values())
-        running_containers = 0
-        suspended_containers = 0
-        
-        for vps_list in vps_data.values():
-            for vps in vps_list:
-                if vps.get('status') == 'running':
-                    running_containers += 1
-                if vps.get('suspended', False):
-                    suspended_containers += 1
+        totals = fleet_stats.fleet
         
         # Get disk usage
         disk_result = subprocess.run(['df', '-h', '/'], capture_output=True, text=True)
@@ -1952,11 +3884,11 @@ async def server_stats(ctx):
         host_info += f"**Prefix:** `{PREFIX}`"
         
         # VPS overview
-        vps_info = f"**Total VPS:** {total_containers}\n"
-        vps_info += f"**Running:** {running_containers}\n"
-        vps_info += f"**Stopped:** {total_containers - running_containers}\n"
-        vps_info += f"**Suspended:** {suspended_containers}\n"
-        vps_info += f"**Total Users:** {len(vps_data)}"
+        vps_info = f"**Total VPS:** {totals.total}\n"
+        vps_info += f"**Running:** {totals.running}\n"
+        vps_info += f"**Stopped:** {totals.total - totals.running}\n"
+        vps_info += f"**Suspended:** {totals.suspended}\n"
+        vps_info += f"**Total Users:** {fleet_stats.owner_count}"
         
         # Check KVM
         kvm_info = "Checking..."
@@ -2001,31 +3933,24 @@ async def delete_vps(ctx, user: discord.Member, vps_number: int, *, reason: str
         return
     
     vps = vps_data[user_id][vps_number - 1]
-    container_name = vps["container_name"]
+    container_name = vps.container_name
     
     # First, remove all port forwards for this VPS from database
-    conn = get_db()
-    cur = conn.cursor()
-    
     # Get all port forwards for this container
-    cur.execute('SELECT id, host_port FROM port_forwards WHERE vps_container = ?', (container_name,))
-    port_forwards = cur.fetchall()
+    port_forwards = await adb.fetchall('SELECT id, host_port FROM port_forwards WHERE vps_container = ?', (container_name,))
     
-    # Remove LXC proxy devices first
-    for pf in port_forwards:
-        forward_id, host_port = pf['id'], pf['host_port']
+    # Remove LXC proxy devices first, all in one update
+    if port_forwards:
+        devices = [f"{proto}_proxy_{pf['host_port']}" for pf in port_forwards for proto in ('tcp', 'udp')]
         try:
-            # Try to remove TCP proxy
-            await execute_lxc(f"lxc config device remove {container_name} tcp_proxy_{host_port} 2>/dev/null || true")
-            # Try to remove UDP proxy
-            await execute_lxc(f"lxc config device remove {container_name} udp_proxy_{host_port} 2>/dev/null || true")
+            await lxd.remove_devices(container_name, *devices, missing_ok=True)
         except Exception as e:
-            logger.warning(f"Failed to remove port forward device {host_port} for {container_name}: {e}")
-            continue
+            logger.warning(f"Failed to remove port forward devices for {container_name}: {e}")
     
     # Delete from database
-    cur.execute('DELETE FROM port_forwards WHERE vps_container = ?', (container_name,))
-    conn.commit()
+    await adb.execute('DELETE FROM port_forwards WHERE vps_container = ?', (container_name,))
+    for pf in port_forwards:
+        port_allocator.release(pf['host_port'])
     
     # Check container status and stop if running
     try:
@@ -2034,10 +3959,10 @@ async def delete_vps(ctx, user: discord.Member, vps_number: int, *, reason: str
             await ctx.send(embed=create_info_embed("Stopping VPS", f"Stopping VPS `{container_name}` before deletion..."))
             try:
                 # Try graceful stop first
-                await execute_lxc(f"lxc stop {container_name}", timeout=30)
+                await lxd.stop_instance(container_name, timeout=30)
             except Exception as e:
                 logger.warning(f"Graceful stop failed, trying force stop: {e}")
-                await execute_lxc(f"lxc stop {container_name} --force", timeout=15)
+                await lxd.stop_instance(container_name, force=True, timeout=15)
     except Exception as e:
         logger.warning(f"Could not check/stop container {container_name}: {e}")
     
@@ -2049,93 +3974,60 @@ async def delete_vps(ctx, user: discord.Member, vps_number: int, *, reason: str
         
         # Method 1: Try normal delete
         try:
-            await execute_lxc(f"lxc delete {container_name}")
+            await lxd.delete_instance(container_name)
+            delete_success = True
+        except LXDNotFound:
+            logger.warning(f"Container {container_name} no longer exists in LXD")
             delete_success = True
         except Exception as e1:
             logger.warning(f"Normal delete failed: {e1}")
             
-            # Method 2: Try force delete
+            # Method 2: Force stop, then delete
             try:
-                await execute_lxc(f"lxc delete {container_name} --force")
+                await lxd.delete_instance(container_name, force=True)
                 delete_success = True
             except Exception as e2:
-                logger.warning(f"Force delete failed: {e2}")
+                logger.error(f"Force delete failed: {e2}")
+                
+                # Manual cleanup - at least remove from database
+                await ctx.send(embed=create_warning_embed("Manual Cleanup", 
+                    f"Automatic deletion failed. Removing from database anyway..."))
                 
-                # Method 3: Try with sudo if snap permissions issue
+                # Remove from database anyway
+                remove_vps(user_id, vps)
+                await delete_vps_record(vps)
+                
+                # Clean up orphaned container manually
+                embed = create_warning_embed("Manual Action Required",
+                    f"Container `{container_name}` deletion partially failed.\n\n"
+                    f"**Error:** {e2}\n\n"
+                    f"**Manual cleanup steps:**\n"
+                    f"1. Run: `sudo lxc delete {container_name} --force`\n"
+                    f"2. Or: `sudo lxc stop {container_name} --force && sudo lxc delete {container_name}`\n\n"
+                    f"VPS has been removed from database.")
+                
+                # Notify main admin
                 try:
-                    # Use sudo if snap permissions issue
-                    proc = await asyncio.create_subprocess_exec(
-                        "sudo", "lxc", "delete", container_name, "--force",
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    stdout, stderr = await proc.communicate()
-                    
-                    if proc.returncode == 0:
-                        delete_success = True
-                        logger.info(f"Successfully deleted {container_name} with sudo")
-                    else:
-                        error_msg = stderr.decode().strip()
-                        logger.error(f"sudo delete failed: {error_msg}")
-                        
-                        # Method 4: Manual cleanup - at least remove from database
-                        await ctx.send(embed=create_warning_embed("Manual Cleanup", 
-                            f"Automatic deletion failed. Removing from database anyway..."))
-                        
-                        # Remove from database anyway
-                        del vps_data[user_id][vps_number - 1]
-                        if not vps_data[user_id]:
-                            del vps_data[user_id]
-                        save_vps_data()
-                        
-                        # Clean up orphaned container manually
-                        embed = create_warning_embed("Manual Action Required",
-                            f"Container `{container_name}` deletion partially failed.\n\n"
-                            f"**Manual cleanup steps:**\n"
-                            f"1. Run: `sudo lxc delete {container_name} --force`\n"
-                            f"2. Or: `sudo lxc stop {container_name} --force && sudo lxc delete {container_name}`\n\n"
-                            f"VPS has been removed from database.")
-                        
-                        # Notify main admin
-                        try:
-                            main_admin = await bot.fetch_user(int(MAIN_ADMIN_ID))
-                            await main_admin.send(embed=embed)
-                        except:
-                            pass
-                        
-                        embed = create_success_embed("VPS Removed from Database",
-                            f"VPS #{vps_number} has been removed from the database.\n\n"
-                            f"**Container:** `{container_name}`\n"
-                            f"**Owner:** {user.mention}\n"
-                            f"**Reason:** {reason}\n\n"
-                            f"Note: Manual container cleanup may be required.")
-                        await ctx.send(embed=embed)
-                        conn.close()
-                        return
-                        
-                except Exception as e3:
-                    logger.error(f"All deletion methods failed: {e3}")
-                    # Still remove from database
-                    del vps_data[user_id][vps_number - 1]
-                    if not vps_data[user_id]:
-                        del vps_data[user_id]
-                    save_vps_data()
-                    
-                    embed = create_warning_embed("Database Cleanup Complete",
-                        f"VPS #{vps_number} removed from database but container deletion failed.\n\n"
-                        f"**Container:** `{container_name}`\n"
-                        f"**Manual cleanup required**")
-                    await ctx.send(embed=embed)
-                    conn.close()
-                    return
+                    main_admin = await bot.fetch_user(int(MAIN_ADMIN_ID))
+                    await main_admin.send(embed=embed)
+                except:
+                    pass
+                
+                embed = create_success_embed("VPS Removed from Database",
+                    f"VPS #{vps_number} has been removed from the database.\n\n"
+                    f"**Container:** `{container_name}`\n"
+                    f"**Owner:** {user.mention}\n"
+                    f"**Reason:** {reason}\n\n"
+                    f"Note: Manual container cleanup may be required.")
+                await ctx.send(embed=embed)
+                return
         
         # If deletion succeeded
         if delete_success:
             # Remove from data structure
-            del vps_data[user_id][vps_number - 1]
+            remove_vps(user_id, vps)
             
-            if not vps_data[user_id]:
-                del vps_data[user_id]
+            if user_id not in vps_data:
                 if ctx.guild:
                     vps_role = await get_or_create_vps_role(ctx.guild)
                     if vps_role and vps_role in user.roles:
@@ -2144,7 +4036,7 @@ async def delete_vps(ctx, user: discord.Member, vps_number: int, *, reason: str
                         except discord.Forbidden:
                             logger.warning(f"Failed to remove VPS role from {user.name}")
             
-            save_vps_data()
+            await delete_vps_record(vps)
             
             embed = create_success_embed("VPS Deleted Successfully")
             add_field(embed, "Owner", user.mention, True)
@@ -2156,19 +4048,12 @@ async def delete_vps(ctx, user: discord.Member, vps_number: int, *, reason: str
     
     except Exception as e:
         await ctx.send(embed=create_error_embed("Deletion Failed", f"Error: {str(e)}"))
-    finally:
-        conn.close()
 
 @bot.command(name='list-all')
 @is_admin()
 async def list_all_vps(ctx):
     """List all VPS on the server (Admin only)"""
-    total_vps = 0
-    total_users = len(vps_data)
-    running_vps = 0
-    stopped_vps = 0
-    suspended_vps = 0
-    whitelisted_vps = 0
+    totals = fleet_stats.fleet
     
     vps_info = []
     user_summary = []
@@ -2176,35 +4061,24 @@ async def list_all_vps(ctx):
     for user_id, vps_list in vps_data.items():
         try:
             user = await bot.fetch_user(int(user_id))
-            user_vps_count = len(vps_list)
-            user_running = sum(1 for vps in vps_list if vps.get('status') == 'running' and not vps.get('suspended', False))
-            user_stopped = sum(1 for vps in vps_list if vps.get('status') == 'stopped')
-            user_suspended = sum(1 for vps in vps_list if vps.get('suspended', False))
-            user_whitelisted = sum(1 for vps in vps_list if vps.get('whitelisted', False))
-            
-            total_vps += user_vps_count
-            running_vps += user_running
-            stopped_vps += user_stopped
-            suspended_vps += user_suspended
-            whitelisted_vps += user_whitelisted
-            
-            user_summary.append(f"**{user.name}** ({user.mention}) - {user_vps_count} VPS ({user_running} running, {user_suspended} suspended, {user_whitelisted} whitelisted)")
+            user_totals = fleet_stats.owner(user_id)
+            user_summary.append(f"**{user.name}** ({user.mention}) - {user_totals.total} VPS ({user_totals.active} running, {user_totals.suspended} suspended, {user_totals.whitelisted} whitelisted)")
             
             for i, vps in enumerate(vps_list):
-                status_emoji = "🟢" if vps.get('status') == 'running' and not vps.get('suspended', False) else "🟡" if vps.get('suspended', False) else "🔴"
-                status_text = vps.get('status', 'unknown').upper()
-                if vps.get('suspended', False):
+                status_emoji = "🟢" if vps.is_running and not vps.suspended else "🟡" if vps.suspended else "🔴"
+                status_text = vps.status.value.upper()
+                if vps.suspended:
                     status_text += " (SUSPENDED)"
-                if vps.get('whitelisted', False):
+                if vps.whitelisted:
                     status_text += " (WHITELISTED)"
                 
-                vps_info.append(f"{status_emoji} **{user.name}** - VPS {i+1}: `{vps['container_name']}` - {vps.get('config', 'Custom')} - {status_text}")
+                vps_info.append(f"{status_emoji} **{user.name}** - VPS {i+1}: `{vps.container_name}` - {vps.config} - {status_text}")
         
         except discord.NotFound:
             vps_info.append(f"❓ Unknown User ({user_id}) - {len(vps_list)} VPS")
     
     embed = create_embed("All VPS Information", "Complete overview of all VPS deployments and user statistics", 0x1a1a1a)
-    add_field(embed, "System Overview", f"**Total Users:** {total_users}\n**Total VPS:** {total_vps}\n**Running:** {running_vps}\n**Stopped:** {stopped_vps}\n**Suspended:** {suspended_vps}\n**Whitelisted:** {whitelisted_vps}", False)
+    add_field(embed, "System Overview", f"**Total Users:** {fleet_stats.owner_count}\n**Total VPS:** {totals.total}\n**Running:** {totals.active}\n**Stopped:** {totals.stopped}\n**Suspended:** {totals.suspended}\n**Whitelisted:** {totals.whitelisted}", False)
     
     await ctx.send(embed=embed)
     
@@ -2237,34 +4111,17 @@ async def user_info(ctx, user: discord.Member):
     
     if vps_list:
         vps_info = []
-        total_ram = 0
-        total_cpu = 0
-        total_storage = 0
-        running_count = 0
-        suspended_count = 0
-        whitelisted_count = 0
+        totals = fleet_stats.owner(user_id)
         
         for i, vps in enumerate(vps_list):
-            status_emoji = "🟢" if vps.get('status') == 'running' and not vps.get('suspended', False) else "🟡" if vps.get('suspended', False) else "🔴"
-            status_text = vps.get('status', 'unknown').upper()
-            if vps.get('suspended', False):
+            status_emoji = "🟢" if vps.is_running and not vps.suspended else "🟡" if vps.suspended else "🔴"
+            status_text = vps.status.value.upper()
+            if vps.suspended:
                 status_text += " (SUSPENDED)"
-                suspended_count += 1
-            else:
-                running_count += 1 if vps.get('status') == 'running' else 0
-            
-            if vps.get('whitelisted', False):
-                whitelisted_count += 1
             
-            vps_info.append(f"{status_emoji} VPS {i+1}: `{vps['container_name']}` - {status_text}")
-            
-            ram_gb = int(vps['ram'].replace('GB', ''))
-            storage_gb = int(vps['storage'].replace('GB', ''))
-            total_ram += ram_gb
-            total_cpu += int(vps['cpu'])
-            total_storage += storage_gb
+            vps_info.append(f"{status_emoji} VPS {i+1}: `{vps.container_name}` - {status_text}")
         
-        vps_summary = f"**Total VPS:** {len(vps_list)}\n**Running:** {running_count}\n**Suspended:** {suspended_count}\n**Whitelisted:** {whitelisted_count}\n**Total RAM:** {total_ram}GB\n**Total CPU:** {total_cpu} cores\n**Total Storage:** {total_storage}GB"
+        vps_summary = f"**Total VPS:** {totals.total}\n**Running:** {totals.active}\n**Suspended:** {totals.suspended}\n**Whitelisted:** {totals.whitelisted}\n**Total RAM:** {totals.ram_gb}GB\n**Total CPU:** {totals.cpu} cores\n**Total Storage:** {totals.storage_gb}GB"
         add_field(embed, "🖥️ VPS Information", vps_summary, False)
         
         vps_text = "\n".join(vps_info)
@@ -2274,8 +4131,8 @@ async def user_info(ctx, user: discord.Member):
     else:
         add_field(embed, "🖥️ VPS Information", "**No VPS owned**", False)
     
-    port_quota = get_user_allocation(user_id)
-    port_used = get_user_used_ports(user_id)
+    port_quota = await get_user_allocation(user_id)
+    port_used = await get_user_used_ports(user_id)
     add_field(embed, "🌐 Port Quota", f"Allocated: {port_quota}, Used: {port_used}", False)
     
     is_admin_user = user_id == str(MAIN_ADMIN_ID) or user_id in admin_data.get("admins", [])
@@ -2291,75 +4148,59 @@ async def add_resources(ctx, vps_id: str, ram: int = None, cpu: int = None, disk
         await ctx.send(embed=create_error_embed("Missing Parameters", "Please specify at least one resource to add (ram, cpu, or disk)"))
         return
     
-    found_vps = None
-    user_id = None
-    vps_index = None
-    
-    for uid, vps_list in vps_data.items():
-        for i, vps in enumerate(vps_list):
-            if vps['container_name'] == vps_id:
-                found_vps = vps
-                user_id = uid
-                vps_index = i
-                break
-        if found_vps:
-            break
+    found = find_vps(vps_id)
+    found_vps = found[1] if found else None
     
     if not found_vps:
         await ctx.send(embed=create_error_embed("VPS Not Found", f"No VPS found with ID: `{vps_id}`"))
         return
     
-    was_running = found_vps.get('status') == 'running' and not found_vps.get('suspended', False)
+    was_running = found_vps.is_running and not found_vps.suspended
     disk_changed = disk is not None
     
     if was_running:
         await ctx.send(embed=create_info_embed("Stopping VPS", f"Stopping VPS `{vps_id}` to apply resource changes..."))
         try:
-            await execute_lxc(f"lxc stop {vps_id}")
-            found_vps['status'] = 'stopped'
-            save_vps_data()
+            await lxd.stop_instance(vps_id)
+            found_vps.status = VPSStatus.STOPPED
+            await save_vps_data()
         except Exception as e:
             await ctx.send(embed=create_error_embed("Stop Failed", f"Error stopping VPS: {str(e)}"))
             return
     
     changes = []
     try:
-        current_ram_gb = int(found_vps['ram'].replace('GB', ''))
-        current_cpu = int(found_vps['cpu'])
-        current_disk_gb = int(found_vps['storage'].replace('GB', ''))
-        
-        new_ram_gb = current_ram_gb
-        new_cpu = current_cpu
-        new_disk_gb = current_disk_gb
+        new_ram_mb = found_vps.ram_mb
+        new_cpu = found_vps.cpu
+        new_disk_gb = found_vps.storage_gb
         
         if ram is not None and ram > 0:
-            new_ram_gb += ram
-            ram_mb = new_ram_gb * 1024
-            await execute_lxc(f"lxc config set {vps_id} limits.memory {ram_mb}MB")
-            changes.append(f"RAM: +{ram}GB (New total: {new_ram_gb}GB)")
+            new_ram_mb += ram * 1024
+            changes.append(f"RAM: +{ram}GB (New total: {format_size(new_ram_mb)})")
         
         if cpu is not None and cpu > 0:
             new_cpu += cpu
-            await execute_lxc(f"lxc config set {vps_id} limits.cpu {new_cpu}")
             changes.append(f"CPU: +{cpu} cores (New total: {new_cpu} cores)")
         
         if disk is not None and disk > 0:
             new_disk_gb += disk
-            await execute_lxc(f"lxc config device set {vps_id} root size={new_disk_gb}GB")
             changes.append(f"Disk: +{disk}GB (New total: {new_disk_gb}GB)")
         
-        found_vps['ram'] = f"{new_ram_gb}GB"
-        found_vps['cpu'] = str(new_cpu)
-        found_vps['storage'] = f"{new_disk_gb}GB"
-        found_vps['config'] = f"{new_ram_gb}GB RAM / {new_cpu} CPU / {new_disk_gb}GB Disk"
-        vps_data[user_id][vps_index] = found_vps
-        save_vps_data()
+        await resize_instance(vps_id,
+                              ram_mb=new_ram_mb if new_ram_mb != found_vps.ram_mb else None,
+                              cpu=new_cpu if new_cpu != found_vps.cpu else None,
+                              disk_gb=new_disk_gb if new_disk_gb != found_vps.storage_gb else None)
+        
+        found_vps.ram_mb = new_ram_mb
+        found_vps.cpu = new_cpu
+        found_vps.storage_gb = new_disk_gb
+        await save_vps_data()
         
         if was_running:
-            await execute_lxc(f"lxc start {vps_id}")
-            found_vps['status'] = 'running'
-            save_vps_data()
-            await apply_internal_permissions(vps_id)
+            await lxd.start_instance(vps_id)
+            found_vps.status = VPSStatus.RUNNING
+            await save_vps_data()
+            await initialise_guest(vps_id, wait_for_network=False)
         
         embed = create_success_embed("Resources Added", f"Successfully added resources to VPS `{vps_id}`")
         add_field(embed, "Changes Applied", "\n".join(changes), False)
@@ -2376,16 +4217,12 @@ async def add_resources(ctx, vps_id: str, ram: int = None, cpu: int = None, disk
 @is_admin()
 async def set_threshold(ctx, cpu: int, ram: int):
     """Set resource thresholds for auto-suspension (Admin only)"""
-    global CPU_THRESHOLD, RAM_THRESHOLD
-    
     if cpu < 0 or ram < 0:
         await ctx.send(embed=create_error_embed("Invalid Thresholds", "Thresholds must be non-negative."))
         return
     
-    CPU_THRESHOLD = cpu
-    RAM_THRESHOLD = ram
-    set_setting('cpu_threshold', str(cpu))
-    set_setting('ram_threshold', str(ram))
+    await settings.set('cpu_threshold', cpu)
+    await settings.set('ram_threshold', ram)
     
     embed = create_success_embed("Thresholds Updated", f"**CPU:** {cpu}%\n**RAM:** {ram}%")
     await ctx.send(embed=embed)
@@ -2413,17 +4250,72 @@ async def set_status(ctx, activity_type: str, *, name: str):
 @is_admin()
 async def thresholds(ctx):
     """Show current resource thresholds (Admin only)"""
-    embed = create_info_embed("Resource Thresholds", f"**CPU:** {CPU_THRESHOLD}%\n**RAM:** {RAM_THRESHOLD}%")
+    embed = create_info_embed("Resource Thresholds", f"**CPU:** {settings['cpu_threshold']}%\n**RAM:** {settings['ram_threshold']}%")
+    monitor_text = (f"**Enabled:** {'Yes' if settings['monitor_enabled'] else 'No'}\n"
+                    f"**Scan Interval:** {settings['monitor_interval']:g}s\n"
+                    f"**Consecutive Scans:** {settings['monitor_strikes']}\n"
+                    f"**Action:** {settings['monitor_action']}\n"
+                    f"**VPS Over Threshold:** {len(resource_monitor.strikes)}")
+    add_field(embed, "🛡️ Auto-Suspension", monitor_text, False)
     await ctx.send(embed=embed)
 
+@bot.command(name='whitelist-vps')
+@is_admin()
+async def whitelist_vps(ctx, container_name: str, state: str = "on"):
+    """Exempt a VPS from auto-suspension, or remove the exemption (Admin only)"""
+    found = find_vps(container_name)
+    if not found:
+        await ctx.send(embed=create_error_embed("VPS Not Found", f"No VPS found with ID: `{container_name}`"))
+        return
+    if state.lower() not in ("on", "off"):
+        await ctx.send(embed=create_error_embed("Invalid State", "Use `on` or `off`."))
+        return
+    
+    vps = found[1]
+    vps.whitelisted = state.lower() == "on"
+    await save_vps_data()
+    resource_monitor.strikes.pop(container_name, None)
+    
+    if vps.whitelisted:
+        await ctx.send(embed=create_success_embed("VPS Whitelisted", f"`{container_name}` is now exempt from auto-suspension."))
+    else:
+        await ctx.send(embed=create_success_embed("Whitelist Removed", f"`{container_name}` is subject to auto-suspension again."))
+
+@bot.command(name='settings')
+@is_main_admin()
+async def settings_command(ctx, key: str = None, *, value: str = None):
+    """Show or change bot tunables (Main Admin only)"""
+    if key is None:
+        text = "\n".join(f"**{k}:** `{v}`" for k, v in sorted(settings.items()))
+        embed = create_info_embed("⚙️ Settings", text or "No settings defined.")
+        add_field(embed, "Usage", f"`{PREFIX}settings <key> <value>` to change a setting", False)
+        await ctx.send(embed=embed)
+        return
+    
+    if key not in SETTINGS_SCHEMA:
+        await ctx.send(embed=create_error_embed("Unknown Setting", f"Valid settings: {', '.join(sorted(SETTINGS_SCHEMA))}"))
+        return
+    
+    if value is None:
+        await ctx.send(embed=create_info_embed("⚙️ Setting", f"**{key}:** `{settings[key]}`"))
+        return
+    
+    try:
+        new_value = await settings.set(key, value)
+    except ValueError as e:
+        await ctx.send(embed=create_error_embed("Invalid Value", f"{e}."))
+        return
+    
+    await ctx.send(embed=create_success_embed("Setting Updated", f"**{key}:** `{new_value}`"))
+
 # ============ PORT FORWARDING COMMANDS ============
 
 @bot.command(name='ports')
 async def ports_command(ctx, subcmd: str = None, *args):
     """Manage port forwarding"""
     user_id = str(ctx.author.id)
-    allocated = get_user_allocation(user_id)
-    used = get_user_used_ports(user_id)
+    allocated = await get_user_allocation(user_id)
+    used = await get_user_used_ports(user_id)
     available = allocated - used
     
     if subcmd is None:
@@ -2452,7 +4344,7 @@ async def ports_command(ctx, subcmd: str = None, *args):
             return
         
         vps = vps_list[vps_num - 1]
-        container = vps['container_name']
+        container = vps.container_name
         
         if used >= allocated:
             await ctx.send(embed=create_error_embed("Quota Exceeded", f"No available slots. Allocated: {allocated}, Used: {used}. Contact admin for more."))
@@ -2468,15 +4360,16 @@ async def ports_command(ctx, subcmd: str = None, *args):
             await ctx.send(embed=create_error_embed("Failed", "Could not assign host port. Try again later."))
     
     elif subcmd == 'list':
-        forwards = get_user_forwards(user_id)
+        forwards = await get_user_forwards(user_id)
         embed = create_info_embed("Your Port Forwards", f"**Quota:** Allocated: {allocated}, Used: {used}, Available: {available}")
         
         if not forwards:
             add_field(embed, "Forwards", "No active port forwards.", False)
         else:
             text = []
+            vps_numbers = {v.container_name: i for i, v in enumerate(get_owner_vps(user_id), 1)}
             for f in forwards:
-                vps_num = next((i+1 for i, v in enumerate(vps_data.get(user_id, [])) if v['container_name'] == f['vps_container']), 'Unknown')
+                vps_num = vps_numbers.get(f['vps_container'], 'Unknown')
                 created = datetime.fromisoformat(f['created_at']).strftime('%Y-%m-%d %H:%M')
                 text.append(f"**ID {f['id']}** - VPS #{vps_num}: {f['vps_port']} (TCP/UDP) → {f['host_port']} (Created: {created})")
             
@@ -2517,10 +4410,10 @@ async def ports_add_user(ctx, amount: int, user: discord.Member):
         return
     
     user_id = str(user.id)
-    allocate_ports(user_id, amount)
+    await allocate_ports(user_id, amount)
     
     embed = create_success_embed("Ports Allocated", f"Allocated {amount} port slots to {user.mention}.")
-    add_field(embed, "Quota", f"Total: {get_user_allocation(user_id)} slots", False)
+    add_field(embed, "Quota", f"Total: {await get_user_allocation(user_id)} slots", False)
     await ctx.send(embed=embed)
     
     try:
@@ -2538,12 +4431,12 @@ async def ports_remove_user(ctx, amount: int, user: discord.Member):
         return
     
     user_id = str(user.id)
-    current = get_user_allocation(user_id)
+    current = await get_user_allocation(user_id)
     if amount > current:
         amount = current
     
-    deallocate_ports(user_id, amount)
-    remaining = get_user_allocation(user_id)
+    await deallocate_ports(user_id, amount)
+    remaining = await get_user_allocation(user_id)
     
     embed = create_success_embed("Ports Deallocated", f"Removed {amount} port slots from {user.mention}.")
     add_field(embed, "Remaining Quota", f"{remaining} slots", False)
@@ -2580,17 +4473,19 @@ async def restart_vps(ctx, container_name: str):
     await ctx.send(embed=create_info_embed("Restarting VPS", f"Restarting VPS `{container_name}`..."))
     
     try:
-        await execute_lxc(f"lxc restart {container_name}")
-        
-        for user_id, vps_list in vps_data.items():
-            for vps in vps_list:
-                if vps['container_name'] == container_name:
-                    vps['status'] = 'running'
-                    vps['suspended'] = False
-                    save_vps_data()
-                    break
-        
-        await apply_internal_permissions(container_name)
+        await lxd.restart_instance(container_name)
+        
+        found = find_vps(container_name)
+        if found:
+            vps = found[1]
+            was_suspended = vps.suspended
+            vps.status = VPSStatus.RUNNING
+            vps.suspended = False
+            await save_vps_data()
+            if was_suspended:
+                await record_suspension_event(vps, 'unsuspended', f"Restarted by {ctx.author.id}")
+        
+        await initialise_guest(container_name, wait_for_network=False)
         await ctx.send(embed=create_success_embed("VPS Restarted", f"VPS `{container_name}` has been restarted successfully!"))
     
     except Exception as e:
@@ -2610,32 +4505,17 @@ async def stop_all_vps(ctx):
         async def confirm(self, interaction: discord.Interaction, item: discord.ui.Button):
             await interaction.response.defer()
             try:
-                proc = await asyncio.create_subprocess_exec(
-                    "lxc", "stop", "--all", "--force",
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-                stdout, stderr = await proc.communicate()
+                await lxd.stop_all(force=True)
                 
-                if proc.returncode == 0:
-                    stopped_count = 0
-                    for user_id, vps_list in vps_data.items():
-                        for vps in vps_list:
-                            if vps.get('status') == 'running':
-                                vps['status'] = 'stopped'
-                                vps['suspended'] = False
-                                stopped_count += 1
-                    
-                    save_vps_data()
-                    embed = create_success_embed("All VPS Stopped", f"Successfully stopped {stopped_count} VPS using `lxc stop --all --force`")
-                    output_text = stdout.decode() if stdout else 'No output'
-                    add_field(embed, "Command Output", f"```\n{output_text}\n```", False)
-                    await interaction.followup.send(embed=embed)
-                else:
-                    error_msg = stderr.decode() if stderr else "Unknown error"
-                    embed = create_error_embed("Stop Failed", f"Failed to stop VPS: {error_msg}")
-                    await interaction.followup.send(embed=embed)
+                running = [vps for vps_list in vps_data.values() for vps in vps_list if vps.is_running]
+                await bulk_update_vps(running, status='stopped', suspended=False)
+                stopped_count = len(running)
+                embed = create_success_embed("All VPS Stopped", f"Successfully stopped {stopped_count} VPS with a forced bulk stop")
+                await interaction.followup.send(embed=embed)
             
+            except LXDError as e:
+                embed = create_error_embed("Stop Failed", f"Failed to stop VPS: {e}")
+                await interaction.followup.send(embed=embed)
             except Exception as e:
                 embed = create_error_embed("Error", f"Error stopping VPS: {str(e)}")
                 await interaction.followup.send(embed=embed)
@@ -2648,7 +4528,7 @@ async def stop_all_vps(ctx):
 
 @bot.command(name='vpsinfo')
 @is_admin()
-async def vps_info(ctx, container_name: str = None):
+async def vps_info(ctx, container_name: str = None, window: str = "1h"):
     """Get detailed information about a VPS (Admin only)"""
     if not container_name:
         all_vps = []
@@ -2656,12 +4536,12 @@ async def vps_info(ctx, container_name: str = None):
             try:
                 user = await bot.fetch_user(int(user_id))
                 for i, vps in enumerate(vps_list):
-                    status_text = vps.get('status', 'unknown').upper()
-                    if vps.get('suspended', False):
+                    status_text = vps.status.value.upper()
+                    if vps.suspended:
                         status_text += " (SUSPENDED)"
-                    if vps.get('whitelisted', False):
+                    if vps.whitelisted:
                         status_text += " (WHITELISTED)"
-                    all_vps.append(f"**{user.name}** - VPS {i+1}: `{vps['container_name']}` - {status_text}")
+                    all_vps.append(f"**{user.name}** - VPS {i+1}: `{vps.container_name}` - {status_text}")
             except:
                 pass
         
@@ -2673,37 +4553,34 @@ async def vps_info(ctx, container_name: str = None):
             await ctx.send(embed=embed)
     
     else:
-        found_vps = None
-        found_user = None
-        
-        for user_id, vps_list in vps_data.items():
-            for vps in vps_list:
-                if vps['container_name'] == container_name:
-                    found_vps = vps
-                    found_user = await bot.fetch_user(int(user_id))
-                    break
-            if found_vps:
-                break
+        found = find_vps(container_name)
+        found_vps = found[1] if found else None
         
         if not found_vps:
             await ctx.send(embed=create_error_embed("VPS Not Found", f"No VPS found with container name: `{container_name}`"))
             return
         
-        suspended_text = " (SUSPENDED)" if found_vps.get('suspended', False) else ""
-        whitelisted_text = " (WHITELISTED)" if found_vps.get('whitelisted', False) else ""
+        window_seconds = parse_duration(window)
+        if not window_seconds or window_seconds > HISTORY_TIERS[-1][1]:
+            await ctx.send(embed=create_error_embed("Invalid Window", f"Use a window like `30m`, `6h` or `7d` (at most {HISTORY_TIERS[-1][1] // 86400}d)."))
+            return
+        
+        found_user = await bot.fetch_user(int(found[0]))
+        
+        suspended_text = " (SUSPENDED)" if found_vps.suspended else ""
+        whitelisted_text = " (WHITELISTED)" if found_vps.whitelisted else ""
         
         embed = create_embed(f"🖥️ VPS Information - {container_name}", f"Details for VPS owned by {found_user.mention}{suspended_text}{whitelisted_text}", 0x1a1a1a)
         
         add_field(embed, "👤 Owner", f"**Name:** {found_user.name}\n**ID:** {found_user.id}", False)
-        add_field(embed, "📊 Specifications", f"**RAM:** {found_vps['ram']}\n**CPU:** {found_vps['cpu']} Cores\n**Storage:** {found_vps['storage']}", False)
-        add_field(embed, "📈 Status", f"**Current:** {found_vps.get('status', 'unknown').upper()}{suspended_text}{whitelisted_text}\n**Suspended:** {found_vps.get('suspended', False)}\n**Whitelisted:** {found_vps.get('whitelisted', False)}\n**Created:** {found_vps.get('created_at', 'Unknown')}", False)
+        add_field(embed, "📊 Specifications", f"**RAM:** {format_size(found_vps.ram_mb)}\n**CPU:** {found_vps.cpu} Cores\n**Storage:** {found_vps.storage_gb}GB", False)
+        add_field(embed, "📈 Status", f"**Current:** {found_vps.status.value.upper()}{suspended_text}{whitelisted_text}\n**Suspended:** {found_vps.suspended}\n**Whitelisted:** {found_vps.whitelisted}\n**Created:** {found_vps.created_at}", False)
         
-        if 'config' in found_vps:
-            add_field(embed, "⚙️ Configuration", f"**Config:** {found_vps['config']}", False)
+        add_field(embed, "⚙️ Configuration", f"**Config:** {found_vps.config}", False)
         
-        if found_vps.get('shared_with'):
+        if found_vps.shared_with:
             shared_users = []
-            for shared_id in found_vps['shared_with']:
+            for shared_id in found_vps.shared_with:
                 try:
                     shared_user = await bot.fetch_user(int(shared_id))
                     shared_users.append(f"• {shared_user.mention}")
@@ -2714,13 +4591,16 @@ async def vps_info(ctx, container_name: str = None):
             add_field(embed, "🔗 Shared With", shared_text, False)
         
         # Port forwards for this VPS
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute('SELECT COUNT(*) FROM port_forwards WHERE vps_container = ?', (container_name,))
-        port_count = cur.fetchone()[0]
-        conn.close()
+        port_count = (await adb.fetchone('SELECT COUNT(*) FROM port_forwards WHERE vps_container = ?', (container_name,)))[0]
         
         add_field(embed, "🌐 Active Ports", f"{port_count} forwarded ports (TCP/UDP)", False)
+        add_field(embed, f"📉 Usage (last {window})", await format_usage_history(container_name, window_seconds), False)
+        
+        history = await get_suspension_history(found_vps, limit=5)
+        if history:
+            lines = [f"**{entry['event'].title()}** {entry['created_at'][:19].replace('T', ' ')}" + (f" - {entry['reason']}" if entry['reason'] else "")
+                     for entry in history]
+            add_field(embed, "🚫 Suspension History", "\n".join(lines), False)
         await ctx.send(embed=embed)
 
 # ============ COMMAND ALIASES ============
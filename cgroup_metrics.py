@@ -0,0 +1,102 @@
+"""Host-side container metrics read from cgroup v2 files and /proc.
+
+Kept apart from bot.py, which connects to LXD and opens the database on
+import, so the collector can be used and tested on its own.
+"""
+import os
+import time
+from typing import Dict, Optional
+
+class CgroupMetrics:
+    """One reading of a container's cgroup v2 counters."""
+
+    __slots__ = ('name', 'taken_at', 'cpu_usage_usec', 'memory_bytes', 'memory_limit_bytes',
+                 'io_read_bytes', 'io_write_bytes', 'pids', 'uptime_seconds')
+
+    def __init__(self, name: str, taken_at: float):
+        self.name = name
+        self.taken_at = taken_at
+        self.cpu_usage_usec = 0
+        self.memory_bytes = 0
+        self.memory_limit_bytes = None
+        self.io_read_bytes = 0
+        self.io_write_bytes = 0
+        self.pids = 0
+        self.uptime_seconds = None
+
+class CgroupCollector:
+    """Reads container metrics from the host: cgroup v2 files plus /proc.
+
+    Nothing runs inside the guest, so readings are unaffected by the
+    tenant's load or image. Both roots are parameters so the collector can be
+    pointed at a fixture tree.
+    """
+
+    def __init__(self, cgroup_root: str = '/sys/fs/cgroup', proc_root: str = '/proc', pattern: str = 'lxc.payload.{name}'):
+        self.cgroup_root = cgroup_root
+        self.proc_root = proc_root
+        self.pattern = pattern
+        self._clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def cgroup_path(self, name: str) -> str:
+        return os.path.join(self.cgroup_root, self.pattern.format(name=name))
+
+    @staticmethod
+    def _read(path: str) -> Optional[str]:
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _keyed(text: Optional[str]) -> Dict[str, int]:
+        """Parse "key value" lines such as cpu.stat and memory.stat."""
+        values = {}
+        for line in (text or '').splitlines():
+            key, _, value = line.partition(' ')
+            if value.strip().isdigit():
+                values[key] = int(value)
+        return values
+
+    def read(self, name: str, init_pid: Optional[int] = None) -> Optional[CgroupMetrics]:
+        """Current counters for a container, or None if it has no cgroup (not running)."""
+        base = self.cgroup_path(name)
+        cpu_stat = self._read(os.path.join(base, 'cpu.stat'))
+        if cpu_stat is None:
+            return None
+        metrics = CgroupMetrics(name, time.monotonic())
+        metrics.cpu_usage_usec = self._keyed(cpu_stat).get('usage_usec', 0)
+        
+        current = (self._read(os.path.join(base, 'memory.current')) or '0').strip()
+        # Page cache the kernel can drop at any time isn't counted as used, as in free(1)
+        inactive_file = self._keyed(self._read(os.path.join(base, 'memory.stat'))).get('inactive_file', 0)
+        metrics.memory_bytes = max(int(current or 0) - inactive_file, 0)
+        limit = (self._read(os.path.join(base, 'memory.max')) or 'max').strip()
+        metrics.memory_limit_bytes = int(limit) if limit.isdigit() else None
+        
+        for line in (self._read(os.path.join(base, 'io.stat')) or '').splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition('=')
+                if key == 'rbytes':
+                    metrics.io_read_bytes += int(value)
+                elif key == 'wbytes':
+                    metrics.io_write_bytes += int(value)
+        
+        pids = (self._read(os.path.join(base, 'pids.current')) or '0').strip()
+        metrics.pids = int(pids) if pids.isdigit() else 0
+        
+        if init_pid:
+            metrics.uptime_seconds = self.process_uptime(init_pid)
+        return metrics
+
+    def process_uptime(self, pid: int) -> Optional[float]:
+        """Seconds since a host PID started, from its /proc stat start time."""
+        stat = self._read(os.path.join(self.proc_root, str(pid), 'stat'))
+        system_uptime = self._read(os.path.join(self.proc_root, 'uptime'))
+        if not stat or not system_uptime:
+            return None
+        # The command name may contain spaces, so count fields from after ")"
+        fields = stat.rsplit(')', 1)[-1].split()
+        started_ticks = int(fields[19])
+        return max(float(system_uptime.split()[0]) - started_ticks / self._clock_ticks, 0.0)
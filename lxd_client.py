@@ -0,0 +1,360 @@
+"""Async client for the LXD REST API over its unix socket.
+
+Kept apart from bot.py, which connects to LXD and opens the database on
+import, so the client can be used and tested on its own.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+class LXDError(Exception):
+    """An LXD request or background operation failed."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class LXDNotFound(LXDError):
+    """The instance, device or other object does not exist."""
+
+class LXDConflict(LXDError):
+    """The object already exists or is busy with another operation."""
+
+def _lxd_error(message: str, status_code: Optional[int]) -> LXDError:
+    if status_code == 404:
+        return LXDNotFound(message, status_code)
+    if status_code == 409:
+        return LXDConflict(message, status_code)
+    return LXDError(message, status_code)
+
+class LXDClient:
+    """Async client for the LXD REST API over its unix socket.
+
+    One aiohttp session, and so one pool of keep-alive socket connections, is
+    shared by every call. Requests that LXD runs as background operations are
+    waited on before returning, and failures are raised as LXDError subclasses
+    instead of CLI stderr text. Point socket_path at a fake server to test.
+    """
+
+    def __init__(self, socket_path: str, timeout: int = 120, max_connections: int = 16):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # Bumped when an instance is created, deleted, renamed or changes power
+        # state, so cached views of the whole fleet can tell they are out of date
+        self.generation = 0
+        self._subscribers: List[Callable] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._extensions: Optional[set] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.UnixConnector(path=self.socket_path, limit=self.max_connections)
+            self._session = aiohttp.ClientSession(connector=connector, base_url='http://lxd')
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def subscribe(self, callback: Callable):
+        """Call callback(name) after any request that may have changed that instance."""
+        self._subscribers.append(callback)
+
+    def _record_change(self, method: str, path: str):
+        parts = path.split('?', 1)[0].strip('/').split('/')
+        if parts[:2] != ['1.0', 'instances']:
+            return
+        if len(parts) == 2 or (len(parts) == 3 and method in ('POST', 'DELETE')) or parts[3:] == ['state']:
+            self.generation += 1
+        if len(parts) > 2:
+            for callback in self._subscribers:
+                callback(parts[2])
+
+    async def _send(self, method: str, path: str, body=None, *, data: bytes = None, params=None, headers=None, timeout=None):
+        """Perform one HTTP round trip; returns (response headers, JSON document or raw bytes).
+
+        body is sent as JSON, data as a raw request body.
+        """
+        timeout = timeout or self.timeout
+        try:
+            async with self._get_session().request(method, path, json=body, data=data, params=params, headers=headers,
+                                                   timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                if resp.content_type != 'application/json':
+                    raw = await resp.read()
+                    if resp.status >= 400:
+                        raise _lxd_error(raw.decode(errors='replace').strip() or resp.reason, resp.status)
+                    return resp.headers, raw
+                document = await resp.json()
+                if document.get('type') == 'error' or resp.status >= 400:
+                    raise _lxd_error(document.get('error') or resp.reason, document.get('error_code') or resp.status)
+                return resp.headers, document
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"LXD request timed out after {timeout} seconds")
+        except aiohttp.ClientError as e:
+            raise LXDError(f"Cannot reach LXD at {self.socket_path}: {e}")
+
+    async def request(self, method: str, path: str, body=None, *, params=None, headers=None,
+                      timeout: Optional[int] = None, wait: bool = True):
+        """Send a request and return its metadata, waiting for async operations to finish."""
+        try:
+            _, document = await self._send(method, path, body, params=params, headers=headers, timeout=timeout)
+            if document.get('type') == 'async' and wait:
+                return await self.wait_operation(document['operation'], timeout)
+            return document.get('metadata')
+        except (LXDError, asyncio.TimeoutError) as e:
+            logger.error(f"LXD Error: {method} {path} - {e}")
+            raise
+        finally:
+            if method != 'GET':
+                self._record_change(method, path)
+
+    async def wait_operation(self, operation: str, timeout: Optional[int] = None) -> Dict[str, Any]:
+        timeout = timeout or self.timeout
+        _, document = await self._send('GET', f"{operation}/wait", params={'timeout': str(timeout)}, timeout=timeout + 5)
+        op = document.get('metadata') or {}
+        if op.get('status') == 'Running':
+            raise asyncio.TimeoutError(f"Operation did not finish within {timeout} seconds")
+        if op.get('status') != 'Success':
+            raise _lxd_error(op.get('err') or f"Operation {op.get('status', 'failed').lower()}", op.get('status_code'))
+        return op
+
+    async def events(self, types: str = 'lifecycle', on_connect: Optional[Callable] = None):
+        """Yield events from /1.0/events until the stream drops.
+
+        on_connect is awaited once the websocket is open and before the first
+        event is read, so anything that happens meanwhile is queued, not lost.
+        """
+        try:
+            async with self._get_session().ws_connect('/1.0/events', params={'type': types}, heartbeat=30) as ws:
+                if on_connect is not None:
+                    await on_connect()
+                async for message in ws:
+                    if message.type == aiohttp.WSMsgType.TEXT:
+                        yield json.loads(message.data)
+                    elif message.type == aiohttp.WSMsgType.ERROR:
+                        raise LXDError(f"Event stream error: {ws.exception()}")
+        except aiohttp.ClientError as e:
+            raise LXDError(f"Cannot subscribe to LXD events at {self.socket_path}: {e}")
+
+    async def supports(self, extension: str) -> bool:
+        """Whether the server advertises an API extension (fetched once)."""
+        if self._extensions is None:
+            server = await self.request('GET', '/1.0')
+            self._extensions = set(server.get('api_extensions') or [])
+        return extension in self._extensions
+
+    # Instances
+    async def list_instances(self, recursion: int = 1) -> List[Any]:
+        """All instances; recursion=2 includes each one's live state."""
+        return await self.request('GET', '/1.0/instances', params={'recursion': str(recursion)})
+
+    async def get_instance(self, name: str) -> Dict[str, Any]:
+        return await self.request('GET', f'/1.0/instances/{name}')
+
+    async def get_instance_state(self, name: str) -> Dict[str, Any]:
+        return await self.request('GET', f'/1.0/instances/{name}/state')
+
+    async def create_instance(self, name: str, source: Dict[str, Any], config: Dict[str, str] = None,
+                              devices: Dict[str, Dict[str, str]] = None, profiles: List[str] = None):
+        body = {'name': name, 'type': 'container', 'source': source,
+                'config': config or {}, 'devices': devices or {}}
+        if profiles is not None:
+            body['profiles'] = profiles
+        return await self.request('POST', '/1.0/instances', body, timeout=600)
+
+    async def update_instance(self, name: str, config: Dict[str, str] = None, devices: Dict[str, Dict[str, str]] = None,
+                              profiles: List[str] = None):
+        """Merge config keys and devices into the instance (and replace its profiles) in a single PATCH."""
+        body = {}
+        if config:
+            body['config'] = config
+        if devices:
+            body['devices'] = devices
+        if profiles is not None:
+            body['profiles'] = profiles
+        return await self.request('PATCH', f'/1.0/instances/{name}', body)
+
+    async def rename_instance(self, name: str, new_name: str):
+        """Rename a stopped instance."""
+        return await self.request('POST', f'/1.0/instances/{name}', {'name': new_name})
+
+    async def remove_devices(self, name: str, *device_names: str, missing_ok: bool = False):
+        """Drop local devices with one conditional PUT of the instance."""
+        headers, document = await self._send('GET', f'/1.0/instances/{name}')
+        instance = document['metadata']
+        devices = instance.get('devices') or {}
+        missing = [device for device in device_names if device not in devices]
+        if missing and not missing_ok:
+            raise LXDNotFound(f"Device {missing[0]} not found on {name}", 404)
+        if len(missing) == len(device_names):
+            return
+        for device in device_names:
+            devices.pop(device, None)
+        body = {key: instance[key] for key in ('architecture', 'config', 'devices', 'ephemeral', 'profiles', 'description')
+                if key in instance}
+        etag = headers.get('ETag')
+        await self.request('PUT', f'/1.0/instances/{name}', body, headers={'If-Match': etag} if etag else None)
+
+    async def set_state(self, name: str, action: str, force: bool = False, timeout: int = 30):
+        body = {'action': action, 'timeout': timeout, 'force': force}
+        return await self.request('PUT', f'/1.0/instances/{name}/state', body, timeout=timeout + 60)
+
+    async def start_instance(self, name: str):
+        return await self.set_state(name, 'start')
+
+    async def stop_instance(self, name: str, force: bool = False, timeout: int = 30):
+        return await self.set_state(name, 'stop', force=force, timeout=timeout)
+
+    async def restart_instance(self, name: str, force: bool = False, timeout: int = 30):
+        return await self.set_state(name, 'restart', force=force, timeout=timeout)
+
+    async def rebuild_instance(self, name: str, source: Dict[str, str]):
+        """Replace a stopped instance's root filesystem, keeping its config, devices and profiles."""
+        return await self.request('POST', f'/1.0/instances/{name}/rebuild', {'source': source}, timeout=600)
+
+    async def create_snapshot(self, name: str, snapshot: str):
+        return await self.request('POST', f'/1.0/instances/{name}/snapshots', {'name': snapshot, 'stateful': False})
+
+    async def has_snapshot(self, name: str, snapshot: str) -> bool:
+        try:
+            await self._send('GET', f'/1.0/instances/{name}/snapshots/{snapshot}')
+            return True
+        except LXDNotFound:
+            return False
+
+    async def restore_rootfs(self, name: str, snapshot: str):
+        """Restore a snapshot's filesystem but keep the instance's current config, devices and profiles.
+
+        LXD restores config along with the rootfs, which would drop proxy
+        devices and limits added since the snapshot, so they are put back.
+        """
+        current = await self.get_instance(name)
+        await self.request('PUT', f'/1.0/instances/{name}', {'restore': snapshot}, timeout=600)
+        restored = await self.get_instance(name)
+        # volatile.* keys describe the restored filesystem; everything else is the live config
+        config = {key: value for key, value in (current.get('config') or {}).items() if not key.startswith('volatile.')}
+        config.update({key: value for key, value in (restored.get('config') or {}).items() if key.startswith('volatile.')})
+        body = {key: current[key] for key in ('architecture', 'devices', 'ephemeral', 'profiles', 'description') if key in current}
+        body['config'] = config
+        return await self.request('PUT', f'/1.0/instances/{name}', body)
+
+    async def stop_all(self, force: bool = True):
+        """Stop every instance with the bulk state endpoint."""
+        return await self.request('PUT', '/1.0/instances', {'state': {'action': 'stop', 'force': force, 'timeout': 30}}, timeout=300)
+
+    async def get_storage_pool_resources(self, pool: str) -> Dict[str, Any]:
+        return await self.request('GET', f'/1.0/storage-pools/{pool}/resources')
+
+    async def delete_instance(self, name: str, force: bool = False):
+        if force:
+            state = await self.get_instance_state(name)
+            if state.get('status') != 'Stopped':
+                await self.stop_instance(name, force=True)
+        return await self.request('DELETE', f'/1.0/instances/{name}')
+
+    async def exec(self, name: str, command: List[str], environment: Dict[str, str] = None,
+                   timeout: Optional[int] = None, check: bool = True) -> tuple:
+        """Run a command with recorded output; returns (return code, stdout, stderr).
+
+        With check=True a non-zero exit raises LXDError carrying stderr.
+        """
+        body = {'command': command, 'environment': environment or {}, 'interactive': False,
+                'wait-for-websocket': False, 'record-output': True}
+        op = await self.request('POST', f'/1.0/instances/{name}/exec', body, timeout=timeout)
+        metadata = op.get('metadata') or {}
+        output = metadata.get('output') or {}
+        stdout, stderr = await asyncio.gather(self._read_exec_log(output.get('1')), self._read_exec_log(output.get('2')))
+        return_code = metadata.get('return', -1)
+        if check and return_code != 0:
+            raise LXDError(stderr.strip() or f"Command exited with status {return_code}")
+        return return_code, stdout, stderr
+
+    async def push_file(self, name: str, path: str, content: bytes, mode: str = '0644', uid: int = 0, gid: int = 0):
+        """Write one file into the instance's filesystem; works while it is stopped."""
+        headers = {'X-LXD-type': 'file', 'X-LXD-mode': mode, 'X-LXD-uid': str(uid), 'X-LXD-gid': str(gid),
+                   'X-LXD-write': 'overwrite', 'Content-Type': 'application/octet-stream'}
+        try:
+            await self._send('POST', f'/1.0/instances/{name}/files', data=content, params={'path': path}, headers=headers)
+        except (LXDError, asyncio.TimeoutError) as e:
+            logger.error(f"LXD Error: push {path} to {name} - {e}")
+            raise
+
+    async def _read_exec_log(self, path: Optional[str]) -> str:
+        if not path:
+            return ''
+        try:
+            _, raw = await self._send('GET', path)
+            return raw.decode(errors='replace') if isinstance(raw, bytes) else ''
+        finally:
+            try:
+                await self._send('DELETE', path)
+            except (LXDError, asyncio.TimeoutError):
+                pass
+
+    # Images
+    async def list_image_aliases(self) -> List[Dict[str, Any]]:
+        return await self.request('GET', '/1.0/images/aliases', params={'recursion': '1'})
+
+    async def get_image(self, fingerprint: str) -> Dict[str, Any]:
+        return await self.request('GET', f'/1.0/images/{fingerprint}')
+
+    async def has_image(self, fingerprint: str) -> bool:
+        try:
+            await self._send('GET', f'/1.0/images/{fingerprint}')
+            return True
+        except LXDNotFound:
+            return False
+
+    async def pull_image(self, source: Dict[str, str]) -> str:
+        """Copy an image from a remote into the local store; returns its fingerprint."""
+        op = await self.request('POST', '/1.0/images', {'source': source}, timeout=1800)
+        return (op.get('metadata') or {}).get('fingerprint')
+
+    async def upload_image(self, metadata_path: str, rootfs_path: str) -> str:
+        """Import a split image (metadata tarball + squashfs rootfs); returns its fingerprint."""
+        with open(metadata_path, 'rb') as metadata, open(rootfs_path, 'rb') as rootfs:
+            form = aiohttp.FormData()
+            form.add_field('metadata', metadata, filename=os.path.basename(metadata_path),
+                           content_type='application/octet-stream')
+            form.add_field('rootfs', rootfs, filename=os.path.basename(rootfs_path),
+                           content_type='application/octet-stream')
+            try:
+                _, document = await self._send('POST', '/1.0/images', data=form, timeout=1800)
+                op = await self.wait_operation(document['operation'], 1800)
+            except (LXDError, asyncio.TimeoutError) as e:
+                logger.error(f"LXD Error: upload {rootfs_path} - {e}")
+                raise
+        return (op.get('metadata') or {}).get('fingerprint')
+
+    async def create_image_alias(self, name: str, target: str, description: str = ''):
+        return await self.request('POST', '/1.0/images/aliases', {'name': name, 'target': target, 'description': description})
+
+    async def update_image_alias(self, name: str, target: str, description: str = ''):
+        return await self.request('PUT', f'/1.0/images/aliases/{name}', {'target': target, 'description': description})
+
+    async def delete_image(self, fingerprint: str):
+        return await self.request('DELETE', f'/1.0/images/{fingerprint}')
+
+    # Profiles
+    async def get_profile(self, name: str) -> Dict[str, Any]:
+        # Not through request(): a missing profile is expected, not an error to log
+        _, document = await self._send('GET', f'/1.0/profiles/{name}')
+        return document['metadata']
+
+    async def create_profile(self, name: str, config: Dict[str, str], devices: Dict[str, Dict[str, str]],
+                             description: str = ''):
+        return await self.request('POST', '/1.0/profiles',
+                                  {'name': name, 'config': config, 'devices': devices, 'description': description})
+
+    async def replace_profile(self, name: str, config: Dict[str, str], devices: Dict[str, Dict[str, str]],
+                              description: str = ''):
+        """Overwrite a profile; instances using it pick the change up immediately."""
+        return await self.request('PUT', f'/1.0/profiles/{name}',
+                                  {'config': config, 'devices': devices, 'description': description})
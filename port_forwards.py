@@ -0,0 +1,136 @@
+"""Host port allocation and LXD proxy devices for port forwards.
+
+Kept apart from bot.py, which connects to LXD and opens the database on
+import, so the allocator can be used and tested on its own.
+"""
+import socket
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+def proxy_devices(host_port: int, vps_port: int) -> Dict[str, Dict[str, str]]:
+    """The tcp_proxy_/udp_proxy_ device pair that forwards host_port to vps_port."""
+    return {
+        f"tcp_proxy_{host_port}": {'type': 'proxy', 'listen': f"tcp:0.0.0.0:{host_port}", 'connect': f"tcp:127.0.0.1:{vps_port}"},
+        f"udp_proxy_{host_port}": {'type': 'proxy', 'listen': f"udp:0.0.0.0:{host_port}", 'connect': f"udp:127.0.0.1:{vps_port}"},
+    }
+
+class PortAllocator:
+    """Host port allocator for port forwards.
+
+    Free/used state is kept as one byte per port over the configured ranges
+    and searched from a rotating cursor with bytearray.find(), so picking a
+    port is a single memchr rather than random probing, and an exhausted
+    range is detected from the free counter without scanning. A candidate is
+    bind-probed on the host (TCP and UDP) before use, and is reserved by
+    inserting its port_forwards row (UNIQUE host_port) through db, bot.py's
+    AsyncDatabase, before any proxy device is created. Ports found busy on
+    the host are skipped for HOST_BUSY_COOLDOWN seconds and then offered
+    again, since whatever held them may have exited.
+    """
+
+    FREE, USED, HOST_BUSY = 0, 1, 2
+    HOST_BUSY_COOLDOWN = 300
+
+    def __init__(self, ranges: List[tuple], db):
+        self.db = db
+        self._ranges = []
+        size = 0
+        for start, end in sorted(ranges):
+            self._ranges.append((start, end, size))
+            size += end - start + 1
+        self._map = bytearray(size)
+        self._free = size
+        self._cursor = 0
+        # host port -> when it was found busy
+        self._busy: Dict[int, float] = {}
+
+    def _slot(self, port: int) -> Optional[int]:
+        for start, end, base in self._ranges:
+            if start <= port <= end:
+                return base + port - start
+        return None
+
+    def _port(self, slot: int) -> int:
+        for start, end, base in self._ranges:
+            if slot <= base + end - start:
+                return start + slot - base
+        raise ValueError(f"Slot {slot} outside port ranges")
+
+    def _set(self, port: int, state: int):
+        slot = self._slot(port)
+        if slot is None:
+            return
+        if self._map[slot] == self.FREE and state != self.FREE:
+            self._free -= 1
+        elif self._map[slot] != self.FREE and state == self.FREE:
+            self._free += 1
+        self._map[slot] = state
+
+    def load(self, used_ports):
+        self._map = bytearray(len(self._map))
+        self._free = len(self._map)
+        self._busy.clear()
+        for port in used_ports:
+            self._set(port, self.USED)
+
+    def release(self, port: int):
+        self._busy.pop(port, None)
+        self._set(port, self.FREE)
+
+    def _mark_busy(self, port: int):
+        self._set(port, self.HOST_BUSY)
+        self._busy[port] = time.monotonic()
+
+    def _expire_busy(self):
+        """Return ports found busy more than HOST_BUSY_COOLDOWN seconds ago to the free set."""
+        if not self._busy:
+            return
+        cutoff = time.monotonic() - self.HOST_BUSY_COOLDOWN
+        for port in [port for port, marked_at in self._busy.items() if marked_at <= cutoff]:
+            del self._busy[port]
+            self._set(port, self.FREE)
+
+    @property
+    def free_count(self) -> int:
+        return self._free
+
+    def _take_next(self) -> Optional[int]:
+        if self._free == 0:
+            return None
+        slot = self._map.find(self.FREE, self._cursor)
+        if slot == -1:
+            slot = self._map.find(self.FREE, 0, self._cursor)
+        self._cursor = slot + 1 if slot + 1 < len(self._map) else 0
+        port = self._port(slot)
+        self._set(port, self.USED)
+        return port
+
+    @staticmethod
+    def is_free_on_host(port: int) -> bool:
+        for sock_type in (socket.SOCK_STREAM, socket.SOCK_DGRAM):
+            with socket.socket(socket.AF_INET, sock_type) as sock:
+                try:
+                    sock.bind(('0.0.0.0', port))
+                except OSError:
+                    return False
+        return True
+
+    async def reserve(self, user_id: str, container: str, vps_port: int, attempts: int = 50) -> Optional[tuple]:
+        """Pick a free host port and claim it in port_forwards; returns (forward_id, host_port)."""
+        self._expire_busy()
+        for _ in range(attempts):
+            port = self._take_next()
+            if port is None:
+                return None
+            if not self.is_free_on_host(port):
+                self._mark_busy(port)
+                continue
+            try:
+                cur = await self.db.execute('INSERT INTO port_forwards (user_id, vps_container, vps_port, host_port, created_at) VALUES (?, ?, ?, ?, ?)',
+                                            (user_id, container, vps_port, port, datetime.now().isoformat()))
+                return cur.lastrowid, port
+            except sqlite3.IntegrityError:
+                continue
+        return None
@@ -0,0 +1,210 @@
+"""Reconciliation between vps.db and LXD instances and proxy devices.
+
+Kept apart from bot.py, which connects to LXD and opens the database on
+import, so the diff can be used and tested on its own.
+"""
+import asyncio
+import logging
+import re
+import sqlite3
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Pattern
+
+from lxd_client import LXDClient, LXDNotFound
+from port_forwards import PortAllocator, proxy_devices
+
+logger = logging.getLogger(__name__)
+
+PROXY_DEVICE_PATTERN = re.compile(r'(tcp|udp)_proxy_\d+')
+# LXD statuses a VPS record tracks; transitional ones (Starting, Stopping...) are not drift
+TRACKED_STATUSES = ('running', 'stopped', 'frozen')
+
+class DriftReport:
+    """Differences found by one reconciliation pass."""
+
+    __slots__ = ('orphan_containers', 'dangling_records', 'dangling_forwards', 'missing_devices',
+                 'extra_devices', 'status_changes', 'fixed', 'errors')
+
+    def __init__(self):
+        self.orphan_containers: List[str] = []
+        self.dangling_records: List[tuple] = []
+        self.dangling_forwards: List[sqlite3.Row] = []
+        self.missing_devices: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self.extra_devices: Dict[str, List[str]] = {}
+        self.status_changes: Dict[str, str] = {}
+        self.fixed = False
+        self.errors: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return (len(self.orphan_containers) + len(self.dangling_records) + len(self.dangling_forwards)
+                + sum(len(devices) for devices in self.missing_devices.values())
+                + sum(len(devices) for devices in self.extra_devices.values()) + len(self.status_changes))
+
+    @property
+    def is_clean(self) -> bool:
+        return self.count == 0
+
+    def sections(self) -> List[tuple]:
+        """(label, lines) for every non-empty kind of drift."""
+        sections = [
+            ("👻 Orphan Containers", [f"`{name}` exists in LXD but not in vps.db" for name in self.orphan_containers]),
+            ("🗑️ Dangling Records", [f"`{vps.container_name}` (owner {owner_id}) has no container" for owner_id, vps in self.dangling_records]),
+            ("🔌 Dangling Port Forwards", [f"#{row['id']} host port {row['host_port']} → `{row['vps_container']}`" for row in self.dangling_forwards]),
+            ("➕ Missing Proxy Devices", [f"`{name}`: {', '.join(devices)}" for name, devices in self.missing_devices.items()]),
+            ("➖ Extra Proxy Devices", [f"`{name}`: {', '.join(devices)}" for name, devices in self.extra_devices.items()]),
+            ("🔄 Status Drift", [f"`{name}` is {status}" for name, status in self.status_changes.items()]),
+        ]
+        return [(label, lines) for label, lines in sections if lines]
+
+class Reconciler:
+    """Diffs vps.db against LXD and optionally repairs the drift.
+
+    The diff costs one instance listing (which carries every instance's
+    devices) and one port_forwards query, however many VPS there are; only
+    repairs make further calls, one per drifted container. Containers that
+    do not follow the bot's naming scheme (name_pattern) are never touched.
+
+    db is bot.py's AsyncDatabase and index its container name index; repairs
+    drop dangling records through forget(owner_id, record) and persist
+    status fixes with save().
+    """
+
+    def __init__(self, client: LXDClient, db, index: Dict[str, tuple], provisioning: set, allocator: PortAllocator,
+                 name_pattern: Pattern, forget: Callable[[str, Any], Awaitable], save: Callable[[], Awaitable]):
+        self.client = client
+        self.db = db
+        self.index = index
+        self.provisioning = provisioning
+        self.allocator = allocator
+        self.name_pattern = name_pattern
+        self.forget = forget
+        self.save = save
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, mode: str = 'off'):
+        """Run the startup pass once per process; mode is the reconcile_on_startup setting."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._startup(mode))
+
+    async def remove_dropped_forward_devices(self) -> int:
+        """Remove proxy devices left behind by port forwards the schema migration dropped.
+
+        A device is kept if a surviving forward on the same container still
+        uses its host port. Returns how many containers were cleaned.
+        """
+        rows = await self.db.fetchall('SELECT vps_container, host_port FROM dropped_port_forwards')
+        if not rows:
+            return 0
+        kept = {(row['vps_container'], row['host_port'])
+                for row in await self.db.fetchall('SELECT vps_container, host_port FROM port_forwards')}
+        by_container: Dict[str, List[str]] = {}
+        for row in rows:
+            if (row['vps_container'], row['host_port']) not in kept:
+                by_container.setdefault(row['vps_container'], []).extend(proxy_devices(row['host_port'], 0))
+        done = []
+        for name, devices in by_container.items():
+            try:
+                await self.client.remove_devices(name, *devices, missing_ok=True)
+            except LXDNotFound:
+                pass
+            except Exception as e:
+                logger.warning(f"Could not remove dropped proxy devices from {name}: {e}")
+                continue
+            logger.info(f"Removed proxy devices of dropped port forwards from {name}: {', '.join(devices)}")
+            done.append(name)
+        done += [row['vps_container'] for row in rows if row['vps_container'] not in by_container]
+        await self.db.executemany('DELETE FROM dropped_port_forwards WHERE vps_container = ?', [(name,) for name in set(done)])
+        return len(by_container)
+
+    async def _startup(self, mode: str):
+        try:
+            await self.remove_dropped_forward_devices()
+        except Exception as e:
+            logger.error(f"Could not clean up dropped port forwards: {e}")
+        if mode not in ('report', 'fix'):
+            return
+        try:
+            report = await self.run(fix=mode == 'fix')
+        except Exception as e:
+            logger.error(f"Startup reconciliation failed: {e}")
+            return
+        if report.is_clean:
+            logger.info("Startup reconciliation: no drift")
+            return
+        for label, lines in report.sections():
+            logger.warning(f"Startup reconciliation - {label.split(' ', 1)[1]}: {'; '.join(lines)}")
+        for error in report.errors:
+            logger.error(f"Startup reconciliation repair failed: {error}")
+
+    async def diff(self) -> DriftReport:
+        instances = {instance['name']: instance for instance in await self.client.list_instances(recursion=1)}
+        forwards = await self.db.fetchall('SELECT id, user_id, vps_container, vps_port, host_port FROM port_forwards')
+        report = DriftReport()
+
+        for name in instances:
+            if name not in self.index and name not in self.provisioning and self.name_pattern.fullmatch(name):
+                report.orphan_containers.append(name)
+        for name, (owner_id, vps) in self.index.items():
+            instance = instances.get(name)
+            if instance is None:
+                report.dangling_records.append((owner_id, vps))
+                continue
+            status = (instance.get('status') or '').lower()
+            if status in TRACKED_STATUSES and status != vps.status:
+                report.status_changes[name] = status
+
+        expected: Dict[str, Dict[str, Dict[str, str]]] = {}
+        for row in forwards:
+            name = row['vps_container']
+            if name not in self.index or name not in instances:
+                report.dangling_forwards.append(row)
+            else:
+                expected.setdefault(name, {}).update(proxy_devices(row['host_port'], row['vps_port']))
+        for name, instance in instances.items():
+            if name not in self.index:
+                continue
+            devices = instance.get('devices') or {}
+            wanted = expected.get(name, {})
+            missing = {device: spec for device, spec in wanted.items() if device not in devices}
+            extra = [device for device in devices if PROXY_DEVICE_PATTERN.fullmatch(device) and device not in wanted]
+            if missing:
+                report.missing_devices[name] = missing
+            if extra:
+                report.extra_devices[name] = extra
+        return report
+
+    async def repair(self, report: DriftReport):
+        async def attempt(description: str, coro):
+            try:
+                await coro
+            except Exception as e:
+                report.errors.append(f"{description}: {e}")
+
+        for name in report.orphan_containers:
+            if name in self.index or name in self.provisioning:
+                continue  # claimed since the diff was taken
+            await attempt(f"delete orphan {name}", self.client.delete_instance(name, force=True))
+        for owner_id, vps in report.dangling_records:
+            await attempt(f"delete record {vps.container_name}", self.forget(owner_id, vps))
+        if report.dangling_forwards:
+            await attempt("delete dangling port forwards",
+                          self.db.executemany('DELETE FROM port_forwards WHERE id = ?', [(row['id'],) for row in report.dangling_forwards]))
+            for row in report.dangling_forwards:
+                self.allocator.release(row['host_port'])
+        for name, devices in report.missing_devices.items():
+            await attempt(f"add proxy devices to {name}", self.client.update_instance(name, devices=devices))
+        for name, devices in report.extra_devices.items():
+            await attempt(f"remove proxy devices from {name}", self.client.remove_devices(name, *devices, missing_ok=True))
+        for name, status in report.status_changes.items():
+            found = self.index.get(name)
+            if found:
+                found[1].status = status
+        if report.status_changes:
+            await attempt("save statuses", self.save())
+        report.fixed = True
+
+    async def run(self, fix: bool = False) -> DriftReport:
+        report = await self.diff()
+        if fix and not report.is_clean:
+            await self.repair(report)
+        return report
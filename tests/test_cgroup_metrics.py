@@ -0,0 +1,143 @@
+import pytest
+
+from cgroup_metrics import CgroupCollector
+
+CPU_STAT = """usage_usec 5000000
+user_usec 3000000
+system_usec 2000000
+nr_periods 0
+"""
+
+MEMORY_STAT = """anon 104857600
+file 52428800
+active_file 20971520
+inactive_file 31457280
+"""
+
+IO_STAT = """8:0 rbytes=1048576 wbytes=2097152 rios=10 wios=20 dbytes=0 dios=0
+8:16 rbytes=4096 wbytes=8192 rios=1 wios=2 dbytes=0 dios=0
+"""
+
+
+def write_cgroup(root, name, files):
+    base = root / f"lxc.payload.{name}"
+    base.mkdir(parents=True)
+    for filename, content in files.items():
+        (base / filename).write_text(content)
+    return base
+
+
+def full_cgroup(**overrides):
+    files = {
+        'cpu.stat': CPU_STAT,
+        'memory.current': '209715200\n',
+        'memory.max': '1073741824\n',
+        'memory.stat': MEMORY_STAT,
+        'io.stat': IO_STAT,
+        'pids.current': '42\n',
+    }
+    files.update(overrides)
+    return {key: value for key, value in files.items() if value is not None}
+
+
+@pytest.fixture
+def roots(tmp_path):
+    cgroup_root = tmp_path / 'cgroup'
+    proc_root = tmp_path / 'proc'
+    cgroup_root.mkdir()
+    proc_root.mkdir()
+    return cgroup_root, proc_root
+
+
+@pytest.fixture
+def collector(roots):
+    cgroup_root, proc_root = roots
+    collector = CgroupCollector(str(cgroup_root), str(proc_root))
+    collector._clock_ticks = 100
+    return collector
+
+
+def test_cgroup_path_uses_pattern(roots):
+    cgroup_root, proc_root = roots
+    collector = CgroupCollector(str(cgroup_root), str(proc_root), pattern='lxc.payload.{name}.scope')
+    assert collector.cgroup_path('vps') == str(cgroup_root / 'lxc.payload.vps.scope')
+
+
+def test_read_parses_all_counters(roots, collector):
+    write_cgroup(roots[0], 'vps', full_cgroup())
+    metrics = collector.read('vps')
+    assert metrics.name == 'vps'
+    assert metrics.cpu_usage_usec == 5000000
+    # memory.current less inactive_file
+    assert metrics.memory_bytes == 209715200 - 31457280
+    assert metrics.memory_limit_bytes == 1073741824
+    assert metrics.io_read_bytes == 1048576 + 4096
+    assert metrics.io_write_bytes == 2097152 + 8192
+    assert metrics.pids == 42
+    assert metrics.uptime_seconds is None
+
+
+def test_unlimited_memory_max(roots, collector):
+    write_cgroup(roots[0], 'vps', full_cgroup(**{'memory.max': 'max\n'}))
+    assert collector.read('vps').memory_limit_bytes is None
+
+
+def test_missing_cgroup_means_not_running(collector):
+    assert collector.read('absent') is None
+
+
+def test_missing_optional_files_default_to_zero(roots, collector):
+    write_cgroup(roots[0], 'vps', {'cpu.stat': CPU_STAT})
+    metrics = collector.read('vps')
+    assert metrics.cpu_usage_usec == 5000000
+    assert metrics.memory_bytes == 0
+    assert metrics.memory_limit_bytes is None
+    assert metrics.io_read_bytes == 0
+    assert metrics.io_write_bytes == 0
+    assert metrics.pids == 0
+
+
+def test_memory_never_negative(roots, collector):
+    write_cgroup(roots[0], 'vps', full_cgroup(**{'memory.current': '1024\n'}))
+    assert collector.read('vps').memory_bytes == 0
+
+
+def test_empty_io_stat_line(roots, collector):
+    write_cgroup(roots[0], 'vps', full_cgroup(**{'io.stat': '8:0\n'}))
+    metrics = collector.read('vps')
+    assert metrics.io_read_bytes == 0
+    assert metrics.io_write_bytes == 0
+
+
+def write_proc_stat(proc_root, pid, command, start_ticks):
+    # Fields after the command: state is field 3, starttime is field 22
+    rest = ['S'] + ['0'] * 18 + [str(start_ticks)] + ['0'] * 30
+    (proc_root / str(pid)).mkdir()
+    (proc_root / str(pid) / 'stat').write_text(f"{pid} ({command}) {' '.join(rest)}\n")
+
+
+def test_process_uptime(roots, collector):
+    proc_root = roots[1]
+    (proc_root / 'uptime').write_text('1000.50 3000.00\n')
+    write_proc_stat(proc_root, 1234, 'systemd', 50000)
+    assert collector.process_uptime(1234) == pytest.approx(500.5)
+
+
+def test_process_uptime_command_with_spaces(roots, collector):
+    proc_root = roots[1]
+    (proc_root / 'uptime').write_text('1000.00 3000.00\n')
+    write_proc_stat(proc_root, 77, 'my init) (x', 90000)
+    assert collector.process_uptime(77) == pytest.approx(100.0)
+
+
+def test_process_uptime_missing_pid(roots, collector):
+    (roots[1] / 'uptime').write_text('1000.00 3000.00\n')
+    assert collector.process_uptime(999) is None
+
+
+def test_read_with_init_pid(roots, collector):
+    cgroup_root, proc_root = roots
+    write_cgroup(cgroup_root, 'vps', full_cgroup())
+    (proc_root / 'uptime').write_text('200.00 0.00\n')
+    write_proc_stat(proc_root, 10, 'init', 5000)
+    assert collector.read('vps', init_pid=10).uptime_seconds == pytest.approx(150.0)
@@ -0,0 +1,197 @@
+import asyncio
+import uuid
+
+import pytest
+from aiohttp import web
+
+from lxd_client import LXDClient, LXDConflict, LXDError, LXDNotFound
+
+
+def sync(metadata, status=200, headers=None):
+    return web.json_response({'type': 'sync', 'status': 'Success', 'status_code': 200, 'metadata': metadata},
+                             status=status, headers=headers)
+
+
+def error(message, code):
+    return web.json_response({'type': 'error', 'error': message, 'error_code': code}, status=code)
+
+
+class FakeLXD:
+    """Just enough of the LXD API for the client: instances, their state and operations."""
+
+    def __init__(self):
+        self.instances = {
+            'c1': {'name': 'c1', 'status': 'Stopped', 'config': {}, 'profiles': ['default'],
+                   'devices': {'tcp_proxy_1': {'type': 'proxy'}, 'udp_proxy_1': {'type': 'proxy'}}},
+        }
+        self.operations = {}
+        self.requests = []
+
+    def operation(self, status='Success', err=''):
+        op_id = str(uuid.uuid4())
+        self.operations[op_id] = {'id': op_id, 'status': status, 'status_code': 200 if status == 'Success' else 400,
+                                  'err': err, 'metadata': {}}
+        return web.json_response({'type': 'async', 'status': 'Operation created', 'status_code': 100,
+                                  'operation': f'/1.0/operations/{op_id}', 'metadata': self.operations[op_id]},
+                                 status=202)
+
+    async def handle(self, request):
+        self.requests.append((request.method, request.path, dict(request.query), dict(request.headers)))
+        parts = request.path.strip('/').split('/')
+        if parts[1] == 'operations':
+            return sync(self.operations[parts[2]])
+        if parts[1] == 'boom':
+            return web.Response(status=500, text='internal failure')
+        if parts == ['1.0', 'instances']:
+            return sync(list(self.instances.values()))
+        instance = self.instances.get(parts[2])
+        if instance is None:
+            return error('Instance not found', 404)
+        if len(parts) == 4 and parts[3] == 'state':
+            if request.method == 'GET':
+                return sync({'status': instance['status']})
+            body = await request.json()
+            if body['action'] == 'start' and instance['status'] == 'Running':
+                return error('The instance is already running', 409)
+            if body['action'] == 'stop' and instance['status'] == 'Frozen':
+                return self.operation('Failure', 'Instance is frozen')
+            instance['status'] = 'Running' if body['action'] == 'start' else 'Stopped'
+            return self.operation()
+        if request.method == 'GET':
+            return sync(instance, headers={'ETag': 'etag-1'})
+        if request.method == 'PUT':
+            if request.headers.get('If-Match') != 'etag-1':
+                return error('ETag mismatch', 412)
+            instance.update(await request.json())
+            return self.operation()
+        if request.method == 'PATCH':
+            body = await request.json()
+            instance['config'].update(body.get('config', {}))
+            return sync({})
+        return error('Not implemented', 501)
+
+
+def run_against(tmp_path, scenario):
+    """Serve a FakeLXD on a unix socket under tmp_path and run scenario(client, fake)."""
+    fake = FakeLXD()
+
+    async def main():
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', fake.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        socket_path = str(tmp_path / 'lxd.sock')
+        await web.UnixSite(runner, socket_path).start()
+        client = LXDClient(socket_path, timeout=5)
+        try:
+            return await scenario(client, fake)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_sync_response_returns_metadata(tmp_path):
+    async def scenario(client, fake):
+        return await client.get_instance('c1'), await client.list_instances()
+
+    instance, instances = run_against(tmp_path, scenario)
+    assert instance['name'] == 'c1'
+    assert [i['name'] for i in instances] == ['c1']
+
+
+def test_async_operation_is_waited_on(tmp_path):
+    async def scenario(client, fake):
+        op = await client.start_instance('c1')
+        return op, fake
+
+    op, fake = run_against(tmp_path, scenario)
+    assert op['status'] == 'Success'
+    assert fake.instances['c1']['status'] == 'Running'
+    method, path, query, _ = fake.requests[-1]
+    assert (method, path) == ('GET', f"/1.0/operations/{op['id']}/wait")
+    assert query == {'timeout': '90'}
+
+
+def test_failed_operation_raises(tmp_path):
+    async def scenario(client, fake):
+        fake.instances['c1']['status'] = 'Frozen'
+        await client.stop_instance('c1')
+
+    with pytest.raises(LXDError, match='Instance is frozen'):
+        run_against(tmp_path, scenario)
+
+
+def test_not_found_maps_to_lxd_not_found(tmp_path):
+    async def scenario(client, fake):
+        await client.get_instance('missing')
+
+    with pytest.raises(LXDNotFound) as excinfo:
+        run_against(tmp_path, scenario)
+    assert excinfo.value.status_code == 404
+    assert str(excinfo.value) == 'Instance not found'
+
+
+def test_conflict_maps_to_lxd_conflict(tmp_path):
+    async def scenario(client, fake):
+        fake.instances['c1']['status'] = 'Running'
+        await client.start_instance('c1')
+
+    with pytest.raises(LXDConflict):
+        run_against(tmp_path, scenario)
+
+
+def test_non_json_error(tmp_path):
+    async def scenario(client, fake):
+        await client.request('GET', '/1.0/boom')
+
+    with pytest.raises(LXDError, match='internal failure') as excinfo:
+        run_against(tmp_path, scenario)
+    assert excinfo.value.status_code == 500
+
+
+def test_unreachable_socket(tmp_path):
+    async def main():
+        client = LXDClient(str(tmp_path / 'absent.sock'), timeout=5)
+        try:
+            await client.get_instance('c1')
+        finally:
+            await client.close()
+
+    with pytest.raises(LXDError, match='Cannot reach LXD'):
+        asyncio.run(main())
+
+
+def test_remove_devices_uses_etag(tmp_path):
+    async def scenario(client, fake):
+        await client.remove_devices('c1', 'tcp_proxy_1')
+        return fake
+
+    fake = run_against(tmp_path, scenario)
+    assert list(fake.instances['c1']['devices']) == ['udp_proxy_1']
+    put = next(r for r in fake.requests if r[0] == 'PUT')
+    assert put[3]['If-Match'] == 'etag-1'
+
+
+def test_remove_missing_device(tmp_path):
+    async def scenario(client, fake):
+        await client.remove_devices('c1', 'tcp_proxy_9')
+
+    with pytest.raises(LXDNotFound):
+        run_against(tmp_path, scenario)
+
+
+def test_generation_and_subscribers(tmp_path):
+    async def scenario(client, fake):
+        changed = []
+        client.subscribe(changed.append)
+        await client.update_instance('c1', config={'limits.cpu': '2'})
+        after_update = client.generation
+        await client.start_instance('c1')
+        return after_update, client.generation, changed
+
+    after_update, after_start, changed = run_against(tmp_path, scenario)
+    assert after_update == 0
+    assert after_start == 1
+    assert changed == ['c1', 'c1']
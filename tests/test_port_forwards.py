@@ -0,0 +1,98 @@
+import asyncio
+import sqlite3
+
+import port_forwards
+from port_forwards import PortAllocator, proxy_devices
+
+
+class FakeDB:
+    """The one AsyncDatabase call the allocator makes, over an in-memory port_forwards table."""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('''CREATE TABLE port_forwards (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT,
+                             vps_container TEXT, vps_port INTEGER, host_port INTEGER UNIQUE, created_at TEXT)''')
+
+    async def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def host_ports(self):
+        return [row[0] for row in self.conn.execute('SELECT host_port FROM port_forwards ORDER BY id')]
+
+
+def allocator(ranges, busy=()):
+    ports = PortAllocator(ranges, FakeDB())
+    ports.is_free_on_host = lambda port: port not in busy
+    return ports
+
+
+def reserve(ports, times=1):
+    async def main():
+        return [await ports.reserve('u1', 'c1', 22) for _ in range(times)]
+
+    return asyncio.run(main())
+
+
+def test_allocates_in_order_across_ranges():
+    ports = allocator([(30000, 30001), (20000, 20001)])
+    assert ports.free_count == 4
+    reservations = reserve(ports, 5)
+    assert [r[1] for r in reservations[:4]] == [20000, 20001, 30000, 30001]
+    assert [r[0] for r in reservations[:4]] == [1, 2, 3, 4]
+    assert reservations[4] is None
+    assert ports.free_count == 0
+    assert ports.db.host_ports() == [20000, 20001, 30000, 30001]
+
+
+def test_load_skips_used_ports():
+    ports = allocator([(20000, 20004)])
+    ports.load([20000, 20002, 40000])
+    assert ports.free_count == 3
+    assert [r[1] for r in reserve(ports, 3)] == [20001, 20003, 20004]
+
+
+def test_cursor_wraps_around_to_released_ports():
+    ports = allocator([(20000, 20002)])
+    reserve(ports, 2)
+    ports.db.conn.execute('DELETE FROM port_forwards WHERE host_port = 20000')
+    ports.release(20000)
+    # The cursor moves on to 20002 before coming back round to 20000
+    first, second, third = reserve(ports, 3)
+    assert (first[1], second[1], third) == (20002, 20000, None)
+
+
+def test_port_taken_in_the_database_is_skipped():
+    ports = allocator([(20000, 20001)])
+    ports.db.conn.execute("INSERT INTO port_forwards (host_port) VALUES (20000)")
+    assert reserve(ports)[0][1] == 20001
+
+
+def test_host_busy_port_is_offered_again_after_cooldown(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(port_forwards.time, 'monotonic', lambda: now[0])
+    busy = {20000}
+    ports = allocator([(20000, 20001)], busy)
+
+    assert reserve(ports)[0][1] == 20001
+    assert ports.free_count == 0
+    assert reserve(ports) == [None]
+
+    busy.clear()
+    now[0] += PortAllocator.HOST_BUSY_COOLDOWN - 1
+    assert reserve(ports) == [None]
+    now[0] += 1
+    assert reserve(ports)[0][1] == 20000
+
+
+def test_release_clears_host_busy_mark():
+    ports = allocator([(20000, 20000)], {20000})
+    assert reserve(ports) == [None]
+    ports.release(20000)
+    assert ports.free_count == 1
+    assert ports._busy == {}
+
+
+def test_proxy_devices():
+    devices = proxy_devices(20000, 22)
+    assert devices['tcp_proxy_20000']['listen'] == 'tcp:0.0.0.0:20000'
+    assert devices['udp_proxy_20000']['connect'] == 'udp:127.0.0.1:22'
@@ -0,0 +1,183 @@
+import asyncio
+import re
+import sqlite3
+from types import SimpleNamespace
+
+from lxd_client import LXDNotFound
+from port_forwards import PortAllocator, proxy_devices
+from reconciler import Reconciler
+
+PATTERN = re.compile(r'pvmlix-\d+-\d+')
+
+
+class FakeDB:
+    """The AsyncDatabase calls the reconciler makes, over in-memory port forward tables."""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:', isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('''CREATE TABLE port_forwards (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT,
+                             vps_container TEXT, vps_port INTEGER, host_port INTEGER UNIQUE, created_at TEXT)''')
+        self.conn.execute('''CREATE TABLE dropped_port_forwards (vps_container TEXT NOT NULL, host_port INTEGER NOT NULL,
+                             PRIMARY KEY (vps_container, host_port))''')
+
+    async def fetchall(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    async def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    async def executemany(self, sql, seq_of_params):
+        return self.conn.executemany(sql, list(seq_of_params))
+
+    def forward(self, container, host_port, vps_port=22):
+        self.conn.execute('INSERT INTO port_forwards (user_id, vps_container, vps_port, host_port) VALUES (?, ?, ?, ?)',
+                          ('u1', container, vps_port, host_port))
+
+
+class FakeClient:
+    """LXDClient calls made by the reconciler, over a dict of instances."""
+
+    def __init__(self, instances):
+        self.instances = {instance['name']: instance for instance in instances}
+        self.calls = []
+
+    async def list_instances(self, recursion=0):
+        return list(self.instances.values())
+
+    async def delete_instance(self, name, force=False):
+        self.calls.append(('delete', name))
+        del self.instances[name]
+
+    async def update_instance(self, name, devices=None):
+        self.calls.append(('update', name, sorted(devices)))
+        self.instances[name]['devices'].update(devices)
+
+    async def remove_devices(self, name, *devices, missing_ok=False):
+        self.calls.append(('remove', name, sorted(devices)))
+        if name not in self.instances:
+            raise LXDNotFound('Instance not found', 404)
+        for device in devices:
+            self.instances[name]['devices'].pop(device, None)
+
+
+def instance(name, status='Running', devices=None):
+    return {'name': name, 'status': status, 'devices': dict(devices or {})}
+
+
+def record(name, status='running'):
+    return SimpleNamespace(container_name=name, status=status)
+
+
+def reconciler(instances, index, provisioning=()):
+    forgotten, saves = [], []
+
+    async def forget(owner_id, vps):
+        forgotten.append((owner_id, vps.container_name))
+        index.pop(vps.container_name, None)
+
+    async def save():
+        saves.append(True)
+
+    allocator = PortAllocator([(20000, 20099)], None)
+    allocator.load(range(20000, 20100))
+    rec = Reconciler(FakeClient(instances), FakeDB(), index, set(provisioning), allocator, PATTERN, forget, save)
+    return rec, forgotten, saves
+
+
+def test_clean_fleet_has_no_drift():
+    index = {'pvmlix-1-1': ('u1', record('pvmlix-1-1'))}
+    rec, _, _ = reconciler([instance('pvmlix-1-1', devices={**proxy_devices(20000, 22), 'root': {'type': 'disk'}})], index)
+    rec.db.forward('pvmlix-1-1', 20000)
+    report = asyncio.run(rec.run(fix=True))
+    assert report.is_clean
+    assert not report.fixed
+    assert rec.client.calls == []
+
+
+def test_diff_finds_every_kind_of_drift():
+    index = {
+        'pvmlix-1-1': ('u1', record('pvmlix-1-1')),
+        'pvmlix-1-2': ('u1', record('pvmlix-1-2')),
+        'pvmlix-1-3': ('u1', record('pvmlix-1-3', 'stopped')),
+    }
+    instances = [
+        instance('pvmlix-1-1', 'Stopped', {**proxy_devices(20000, 22), **proxy_devices(20009, 80)}),
+        instance('pvmlix-1-3', 'Starting'),
+        instance('pvmlix-2-1'),
+        instance('pvmlix-2-2'),
+        instance('someone-elses-box'),
+    ]
+    rec, _, _ = reconciler(instances, index, provisioning={'pvmlix-2-2'})
+    rec.db.forward('pvmlix-1-1', 20000)
+    rec.db.forward('pvmlix-1-1', 20001, 8080)
+    rec.db.forward('pvmlix-1-2', 20002)
+    rec.db.forward('gone', 20003)
+
+    report = asyncio.run(rec.diff())
+    assert report.orphan_containers == ['pvmlix-2-1']
+    assert [owner_vps[1].container_name for owner_vps in report.dangling_records] == ['pvmlix-1-2']
+    assert sorted(row['host_port'] for row in report.dangling_forwards) == [20002, 20003]
+    assert report.missing_devices == {'pvmlix-1-1': proxy_devices(20001, 8080)}
+    assert report.extra_devices == {'pvmlix-1-1': ['tcp_proxy_20009', 'udp_proxy_20009']}
+    # pvmlix-1-3 is mid-start, which is not drift
+    assert report.status_changes == {'pvmlix-1-1': 'stopped'}
+    assert report.count == 9
+    assert [label for label, _ in report.sections()] == [
+        "👻 Orphan Containers", "🗑️ Dangling Records", "🔌 Dangling Port Forwards",
+        "➕ Missing Proxy Devices", "➖ Extra Proxy Devices", "🔄 Status Drift"]
+
+
+def test_fix_repairs_the_drift():
+    index = {
+        'pvmlix-1-1': ('u1', record('pvmlix-1-1')),
+        'pvmlix-1-2': ('u1', record('pvmlix-1-2')),
+    }
+    instances = [instance('pvmlix-1-1', 'Frozen', proxy_devices(20009, 80)), instance('pvmlix-2-1')]
+    rec, forgotten, saves = reconciler(instances, index)
+    rec.db.forward('pvmlix-1-1', 20000)
+    rec.db.forward('pvmlix-1-2', 20002)
+
+    report = asyncio.run(rec.run(fix=True))
+    assert report.fixed and report.errors == []
+    assert forgotten == [('u1', 'pvmlix-1-2')]
+    assert 'pvmlix-2-1' not in rec.client.instances
+    assert [row['host_port'] for row in rec.db.conn.execute('SELECT host_port FROM port_forwards')] == [20000]
+    assert rec.allocator.free_count == 1
+    assert sorted(rec.client.instances['pvmlix-1-1']['devices']) == ['tcp_proxy_20000', 'udp_proxy_20000']
+    assert index['pvmlix-1-1'][1].status == 'frozen'
+    assert saves == [True]
+    assert asyncio.run(rec.diff()).is_clean
+
+
+def test_fix_skips_orphans_claimed_since_the_diff():
+    rec, _, _ = reconciler([instance('pvmlix-2-1')], {})
+    report = asyncio.run(rec.diff())
+    rec.provisioning.add('pvmlix-2-1')
+    asyncio.run(rec.repair(report))
+    assert rec.client.calls == []
+
+
+def test_repair_errors_are_collected():
+    index = {'pvmlix-1-1': ('u1', record('pvmlix-1-1'))}
+    rec, _, _ = reconciler([instance('pvmlix-1-1', devices=proxy_devices(20009, 80))], index)
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError('socket closed')
+
+    rec.client.remove_devices = broken
+    report = asyncio.run(rec.run(fix=True))
+    assert report.errors == ['remove proxy devices from pvmlix-1-1: socket closed']
+
+
+def test_dropped_forward_devices_are_removed_unless_reused():
+    index = {'pvmlix-1-1': ('u1', record('pvmlix-1-1'))}
+    devices = {**proxy_devices(20000, 22), **proxy_devices(20001, 22)}
+    rec, _, _ = reconciler([instance('pvmlix-1-1', devices=devices)], index)
+    rec.db.forward('pvmlix-1-1', 20001)
+    rec.db.conn.executemany('INSERT INTO dropped_port_forwards VALUES (?, ?)',
+                            [('pvmlix-1-1', 20000), ('pvmlix-1-1', 20001), ('gone', 20005)])
+
+    assert asyncio.run(rec.remove_dropped_forward_devices()) == 2
+    assert sorted(rec.client.instances['pvmlix-1-1']['devices']) == ['tcp_proxy_20001', 'udp_proxy_20001']
+    assert rec.db.conn.execute('SELECT COUNT(*) FROM dropped_port_forwards').fetchone()[0] == 0
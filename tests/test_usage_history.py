@@ -0,0 +1,158 @@
+import asyncio
+import sqlite3
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import usage_history
+from usage_history import HISTORY_TIERS, UsageHistory, UsageSummary, percentile
+
+SCHEMA = '''CREATE TABLE usage_history (
+    tier INTEGER NOT NULL, container_name TEXT NOT NULL, metric TEXT NOT NULL, ts INTEGER NOT NULL,
+    samples INTEGER NOT NULL, min_value REAL NOT NULL, avg_value REAL NOT NULL, max_value REAL NOT NULL,
+    p95_value REAL NOT NULL, PRIMARY KEY (tier, container_name, metric, ts)
+) WITHOUT ROWID'''
+
+
+class FakeDB:
+    """The AsyncDatabase calls the recorder makes, over an in-memory usage_history table."""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:', isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute('BEGIN')
+        yield self.conn
+        self.conn.execute('COMMIT')
+
+    async def transaction(self, fn, *args):
+        with self._transaction() as conn:
+            return fn(conn, *args)
+
+    async def fetchall(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def rows(self, tier, metric='cpu'):
+        return [tuple(row) for row in self.conn.execute(
+            '''SELECT container_name, ts, samples, min_value, avg_value, max_value FROM usage_history
+               WHERE tier = ? AND metric = ? ORDER BY container_name, ts''', (tier, metric))]
+
+
+class FakeSnapshots:
+    def __init__(self):
+        self.instances = {}
+        self.taken_at = 0.0
+
+    async def get(self, max_age):
+        return SimpleNamespace(instances=self.instances, taken_at=self.taken_at)
+
+
+def state(running=True, rx=0, tx=0):
+    return SimpleNamespace(is_running=running, pid=100, memory_bytes=1024, disk_bytes=2048,
+                           net_rx_bytes=rx, net_tx_bytes=tx, processes=7)
+
+
+def recorder(index=('c1',)):
+    snapshots = FakeSnapshots()
+    sampler = SimpleNamespace(current=lambda name: 50.0)
+    collector = SimpleNamespace(read=lambda name, pid: SimpleNamespace(memory_bytes=4096, pids=3))
+    return UsageHistory(snapshots, sampler, collector, FakeDB(), set(index))
+
+
+def insert(db, tier, name, ts, value, metric='cpu'):
+    db.conn.execute('INSERT INTO usage_history VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)',
+                    (tier, name, metric, ts, value, value, value, value))
+
+
+def write(history, now):
+    asyncio.run(history.db.transaction(history._write, [], now))
+
+
+def test_percentile_and_merge():
+    assert percentile([5, 1, 3, 2, 4], 95) == 5
+    assert percentile([5, 1, 3, 2, 4], 50) == 3
+    rows = [{'samples': 1, 'min_value': 2.0, 'avg_value': 2.0, 'max_value': 2.0, 'p95_value': 2.0},
+            {'samples': 3, 'min_value': 1.0, 'avg_value': 6.0, 'max_value': 9.0, 'p95_value': 8.0}]
+    merged = UsageSummary.merge(rows)
+    assert (merged.samples, merged.min, merged.avg, merged.p95, merged.max) == (4, 1.0, 5.0, 8.0, 9.0)
+
+
+def test_record_once_writes_managed_running_containers(monkeypatch):
+    history = recorder()
+    history.snapshots.instances = {'c1': state(rx=1000, tx=500), 'stopped': state(running=False), 'foreign': state()}
+    history.index.add('stopped')
+    monkeypatch.setattr(usage_history.time, 'time', lambda: 10_000)
+    asyncio.run(history.record_once())
+
+    metrics = {row['metric']: row['avg_value'] for row in history.db.conn.execute('SELECT * FROM usage_history')}
+    # No network rates until there are two counter readings
+    assert metrics == {'cpu': 50.0, 'memory': 4096, 'disk': 2048, 'pids': 3}
+
+    history.snapshots.instances['c1'] = state(rx=3000, tx=1500)
+    history.snapshots.taken_at = 10.0
+    monkeypatch.setattr(usage_history.time, 'time', lambda: 10_010)
+    asyncio.run(history.record_once())
+    assert history.db.rows(0, 'net_rx') == [('c1', 10_010, 1, 200.0, 200.0, 200.0)]
+    assert history.db.rows(0, 'net_tx') == [('c1', 10_010, 1, 100.0, 100.0, 100.0)]
+
+
+def test_finished_buckets_roll_up_into_each_tier():
+    history = recorder()
+    step1, step2 = HISTORY_TIERS[1][0], HISTORY_TIERS[2][0]
+    base = 100 * step2
+    for offset, value in ((0, 1.0), (10, 3.0), (step1, 10.0), (step1 + 10, 20.0), (2 * step1, 99.0)):
+        insert(history.db, 0, 'c1', base + offset, value)
+
+    write(history, base + 2 * step1 + 5)
+    # The bucket holding base + 2 * step1 is still open
+    assert history.db.rows(1) == [('c1', base, 2, 1.0, 2.0, 3.0), ('c1', base + step1, 2, 10.0, 15.0, 20.0)]
+    assert history.db.rows(2) == []
+
+    write(history, base + step2)
+    assert history.db.rows(1)[-1] == ('c1', base + 2 * step1, 1, 99.0, 99.0, 99.0)
+    assert history.db.rows(2) == [('c1', base, 5, 1.0, 26.6, 99.0)]
+
+
+def test_rollup_resumes_after_restart_without_double_counting():
+    history = recorder()
+    step1 = HISTORY_TIERS[1][0]
+    base = 1000 * step1
+    insert(history.db, 0, 'c1', base, 4.0)
+    write(history, base + step1)
+
+    restarted = UsageHistory(history.snapshots, history.sampler, history.collector, history.db, history.index)
+    insert(history.db, 0, 'c1', base + step1, 8.0)
+    write(restarted, base + 2 * step1)
+    assert history.db.rows(1) == [('c1', base, 1, 4.0, 4.0, 4.0), ('c1', base + step1, 1, 8.0, 8.0, 8.0)]
+
+
+def test_rows_past_retention_are_pruned():
+    history = recorder()
+    now = 1_000_000 * HISTORY_TIERS[2][0]
+    for tier, (_, retention) in enumerate(HISTORY_TIERS):
+        insert(history.db, tier, 'c1', now - retention - 1, 1.0)
+        insert(history.db, tier, 'c1', now - retention, 2.0)
+    # Start the rollups at now so only pruning touches the rows above
+    history._rolled = {tier: now for tier in range(1, len(HISTORY_TIERS))}
+    write(history, now)
+    for tier, (_, retention) in enumerate(HISTORY_TIERS):
+        assert history.db.rows(tier) == [('c1', now - retention, 1, 2.0, 2.0, 2.0)]
+
+
+def test_summary_reads_the_finest_tier_covering_the_window(monkeypatch):
+    history = recorder()
+    now = 1_000_000
+    monkeypatch.setattr(usage_history.time, 'time', lambda: now)
+    insert(history.db, 0, 'c1', now - 20, 10.0)
+    insert(history.db, 0, 'c1', now - 10, 30.0)
+    insert(history.db, 1, 'c1', now - 7200, 80.0)
+    insert(history.db, 0, 'c2', now - 10, 99.0)
+
+    recent = asyncio.run(history.summary('c1', 60))
+    assert set(recent) == {'cpu'}
+    assert (recent['cpu'].samples, recent['cpu'].avg, recent['cpu'].max) == (2, 20.0, 30.0)
+
+    day = asyncio.run(history.summary('c1', 86400))
+    assert (day['cpu'].samples, day['cpu'].max) == (1, 80.0)
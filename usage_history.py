@@ -0,0 +1,170 @@
+"""Per-container usage history in SQLite, downsampled into rollup tiers.
+
+Kept apart from bot.py, which connects to LXD and opens the database on
+import, so the recorder can be used and tested on its own.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from cgroup_metrics import CgroupCollector
+
+logger = logging.getLogger(__name__)
+
+# (step seconds, retention seconds) per tier: raw samples for an hour,
+# 1-minute rollups for a day and 15-minute rollups for 30 days
+HISTORY_TIERS = [(10, 3600), (60, 86400), (900, 30 * 86400)]
+
+METRICS = ('cpu', 'memory', 'disk', 'net_rx', 'net_tx', 'pids')
+
+_HISTORY_INSERT = '''INSERT OR REPLACE INTO usage_history
+                     (tier, container_name, metric, ts, samples, min_value, avg_value, max_value, p95_value)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+class UsageSummary:
+    __slots__ = ('samples', 'min', 'avg', 'p95', 'max')
+
+    def __init__(self, samples: int, min_value: float, avg_value: float, p95_value: float, max_value: float):
+        self.samples = samples
+        self.min = min_value
+        self.avg = avg_value
+        self.p95 = p95_value
+        self.max = max_value
+
+    @classmethod
+    def merge(cls, rows) -> "UsageSummary":
+        """Combine usage_history rows (raw samples or rollups) into one summary."""
+        samples = sum(row['samples'] for row in rows)
+        return cls(samples,
+                   min(row['min_value'] for row in rows),
+                   sum(row['avg_value'] * row['samples'] for row in rows) / samples,
+                   percentile([row['p95_value'] for row in rows], 95),
+                   max(row['max_value'] for row in rows))
+
+class UsageHistory:
+    """Per-container CPU, memory, disk, network and process history in SQLite.
+
+    Every HISTORY_TIERS[0] step the recorder writes one raw row per metric
+    per running VPS, folds finished buckets into the next tier up and deletes
+    rows past each tier's retention, all in one write transaction. Rollups
+    stream their source rows, so in memory the bot only keeps the last
+    network counters per container; on disk each tier holds a fixed number
+    of buckets per container.
+
+    snapshots and sampler are bot.py's FleetSnapshotCache and CPUSampler, db
+    its AsyncDatabase; only containers in index (the container name index)
+    are recorded.
+
+    Rollup p95 values are the p95 of the child buckets' p95s, so they are an
+    approximation once data leaves the raw tier.
+    """
+
+    def __init__(self, snapshots, sampler, collector: CgroupCollector, db, index):
+        self.snapshots = snapshots
+        self.sampler = sampler
+        self.collector = collector
+        self.db = db
+        self.index = index
+        self._net_last: Dict[str, tuple] = {}
+        self._rolled: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(HISTORY_TIERS[0][0])
+            try:
+                await self.record_once()
+            except Exception as e:
+                logger.warning(f"Usage history recording failed: {e}")
+
+    def _net_rates(self, name: str, taken_at: float, rx: int, tx: int) -> tuple:
+        previous = self._net_last.get(name)
+        self._net_last[name] = (taken_at, rx, tx)
+        if previous is None or taken_at <= previous[0] or rx < previous[1] or tx < previous[2]:
+            return None, None
+        elapsed = taken_at - previous[0]
+        return (rx - previous[1]) / elapsed, (tx - previous[2]) / elapsed
+
+    async def record_once(self):
+        snapshot = await self.snapshots.get(max_age=HISTORY_TIERS[0][0] / 2)
+        now = int(time.time())
+        rows = []
+        running = set()
+        for name, state in snapshot.instances.items():
+            if not state.is_running or name not in self.index:
+                continue
+            running.add(name)
+            metrics = self.collector.read(name, state.pid)
+            net_rx, net_tx = self._net_rates(name, snapshot.taken_at, state.net_rx_bytes, state.net_tx_bytes)
+            values = {
+                'cpu': self.sampler.current(name),
+                'memory': metrics.memory_bytes if metrics else state.memory_bytes,
+                'disk': state.disk_bytes,
+                'net_rx': net_rx,
+                'net_tx': net_tx,
+                'pids': metrics.pids if metrics else state.processes,
+            }
+            for metric, value in values.items():
+                if value is not None:
+                    rows.append((0, name, metric, now, 1, value, value, value, value))
+        for name in set(self._net_last) - running:
+            self._net_last.pop(name, None)
+        await self.db.transaction(self._write, rows, now)
+
+    def _write(self, conn, rows: List[tuple], now: int):
+        conn.executemany(_HISTORY_INSERT, rows)
+        for tier in range(1, len(HISTORY_TIERS)):
+            self._rollup(conn, tier, now)
+        for tier, (_, retention) in enumerate(HISTORY_TIERS):
+            conn.execute('DELETE FROM usage_history WHERE tier = ? AND ts < ?', (tier, now - retention))
+
+    def _rollup(self, conn, tier: int, now: int):
+        """Fold the finished buckets of tier - 1 into tier."""
+        step = HISTORY_TIERS[tier][0]
+        end = now - now % step
+        start = self._rolled.get(tier)
+        if start is None:
+            last = conn.execute('SELECT MAX(ts) FROM usage_history WHERE tier = ?', (tier,)).fetchone()[0]
+            start = last + step if last is not None else 0
+        if start >= end:
+            return
+
+        cursor = conn.execute('''SELECT container_name, metric, ts, samples, min_value, avg_value, max_value, p95_value
+                                 FROM usage_history WHERE tier = ? AND ts >= ? AND ts < ?
+                                 ORDER BY container_name, metric, ts''', (tier - 1, start, end))
+        rollups = []
+        for (name, metric, bucket), rows in itertools.groupby(cursor, key=lambda row: (row[0], row[1], row[2] - row[2] % step)):
+            merged = UsageSummary.merge(list(rows))
+            rollups.append((tier, name, metric, bucket, merged.samples, merged.min, merged.avg, merged.max, merged.p95))
+        conn.executemany(_HISTORY_INSERT, rollups)
+        self._rolled[tier] = end
+
+    async def summary(self, container_name: str, window: int) -> Dict[str, UsageSummary]:
+        """min/avg/p95/max per metric over the last window seconds, from the finest tier covering it."""
+        tier = next((i for i, (_, retention) in enumerate(HISTORY_TIERS) if retention >= window), len(HISTORY_TIERS) - 1)
+        # Naming the metrics keeps this on the primary key rather than the (tier, ts) index
+        metrics = list(METRICS)
+        rows = await self.db.fetchall(f'''SELECT metric, samples, min_value, avg_value, max_value, p95_value FROM usage_history
+                                          WHERE tier = ? AND container_name = ? AND metric IN ({', '.join('?' * len(metrics))}) AND ts >= ?''',
+                                      (tier, container_name, *metrics, int(time.time()) - window))
+        grouped: Dict[str, List[sqlite3.Row]] = {}
+        for row in rows:
+            grouped.setdefault(row['metric'], []).append(row)
+        return {metric: UsageSummary.merge(group) for metric, group in grouped.items()}